@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+ESCRITOR DE LOGS DE ACTIVIDAD EN LOTE
+=====================================
+Los eventos de activity_logs se encolan en memoria y un task en segundo
+plano los inserta por lotes, fuera de la latencia de pagos y revocaciones.
+La cola es acotada: al llenarse se descartan eventos ('drop') o quien
+registra espera a que haya sitio ('block').
+
+activity_logs está particionada por mes: el mantenimiento crea las
+particiones por adelantado, resume cada día en activity_daily_rollups y
+elimina las particiones fuera de la retención con un DROP en lugar de DELETE.
+La partición DEFAULT recoge lo que cae fuera de los meses creados (reloj
+adelantado, mantenimiento atrasado) para que un INSERT nunca falle.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bot.config import ACTIVITY_LOG_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# (user_id, action, details JSON, timestamp UTC)
+ActivityEvent = Tuple[Optional[int], str, str, datetime]
+
+# Clave de advisory lock: un solo proceso (bot o webhook) mantiene las particiones
+MAINTENANCE_LOCK_KEY = 7_240_001
+
+PARTITION_PREFIX = 'activity_logs_p'
+DEFAULT_PARTITION = 'activity_logs_default'
+
+
+def _midnight(day: date) -> datetime:
+    """date -> TIMESTAMP sin zona (asyncpg no codifica un date en un parámetro timestamp)"""
+    return datetime.combine(day, datetime.min.time())
+
+
+def _month_start(months_offset: int = 0) -> date:
+    """Primer día del mes UTC actual desplazado `months_offset` meses"""
+    today = datetime.now(timezone.utc).date()
+    month_index = today.year * 12 + today.month - 1 + months_offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+async def ensure_partitions(conn, months_back: int = 0) -> int:
+    """Crear las particiones mensuales desde `months_back` meses atrás hasta `premake_months` adelante"""
+    await conn.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF activity_logs DEFAULT")
+
+    created = 0
+    for offset in range(-months_back, ACTIVITY_LOG_CONFIG["premake_months"] + 1):
+        start, end = _month_start(offset), _month_start(offset + 1)
+        name = f"{PARTITION_PREFIX}{start:%Y%m}"
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+        if not exists:
+            # Los eventos del mes que ya cayeron en DEFAULT se mueven antes de adjuntar la partición
+            async with conn.transaction():
+                await conn.execute(f"CREATE TABLE {name} (LIKE activity_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                await conn.execute(
+                    f"""
+                    WITH moved AS (
+                        DELETE FROM {DEFAULT_PARTITION}
+                        WHERE timestamp >= $1 AND timestamp < $2
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                    """,
+                    _midnight(start), _midnight(end)
+                )
+                await conn.execute(
+                    f"ALTER TABLE activity_logs ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+            created += 1
+    return created
+
+
+async def drop_expired_partitions(conn) -> List[str]:
+    """Eliminar las particiones anteriores a la retención (O(1) por mes, sin DELETE)"""
+    cutoff = _month_start(-ACTIVITY_LOG_CONFIG["retention_months"])
+    rows = await conn.fetch(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'activity_logs'::regclass
+        """
+    )
+
+    dropped = []
+    for row in rows:
+        name = row['relname']
+        suffix = name[len(PARTITION_PREFIX):]
+        if not (name.startswith(PARTITION_PREFIX) and suffix.isdigit() and len(suffix) == 6):
+            continue
+        if date(int(suffix[:4]), int(suffix[4:]), 1) < cutoff:
+            await conn.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+
+    # DEFAULT solo guarda rezagados: se limpia por filas
+    await conn.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < $1", _midnight(cutoff))
+    return dropped
+
+
+async def rollup_daily(conn) -> int:
+    """Resumir por día y acción los días completos aún no resumidos"""
+    last_day = await conn.fetchval("SELECT MAX(day) FROM activity_daily_rollups")
+    start = _month_start(-ACTIVITY_LOG_CONFIG["retention_months"])
+    if last_day is not None:
+        start = max(start, last_day)
+    today = datetime.now(timezone.utc).date()
+
+    if start >= today:
+        return 0
+
+    # El último día resumido se recalcula por si llegaron eventos tardíos
+    result = await conn.execute(
+        """
+        INSERT INTO activity_daily_rollups (day, action, events, unique_users)
+        SELECT timestamp::date, action, COUNT(*), COUNT(DISTINCT user_id)
+        FROM activity_logs
+        WHERE timestamp >= $1 AND timestamp < $2
+        GROUP BY 1, 2
+        ON CONFLICT (day, action) DO UPDATE SET
+            events = EXCLUDED.events,
+            unique_users = EXCLUDED.unique_users
+        """,
+        _midnight(start), _midnight(today)
+    )
+    return int(result.split()[-1])
+
+
+class ActivityLogWriter:
+    """Cola acotada de eventos de actividad volcada por lotes"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.policy = ACTIVITY_LOG_CONFIG["overflow_policy"]
+        self._queue: "asyncio.Queue[ActivityEvent]" = asyncio.Queue(maxsize=ACTIVITY_LOG_CONFIG["max_pending"])
+        self._task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        # Lote sacado de la cola y aún no escrito (se recupera si el task se cancela)
+        self._in_flight: List[ActivityEvent] = []
+        self._write_lock = asyncio.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """Arrancar el volcado en segundo plano (idempotente)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_loop())
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def log(self, user_id: Optional[int], action: str, details: Optional[Dict] = None) -> None:
+        """Encolar un evento; con la cola llena aplica la política configurada"""
+        event = (user_id, action, json.dumps(details or {}), datetime.now(timezone.utc).replace(tzinfo=None))
+
+        if self.policy == 'block':
+            await self._queue.put(event)
+            return
+
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            # Avisar una vez por cada bloque de descartes para no inundar el log
+            if self.dropped % 1000 == 1:
+                logger.warning(f"⚠️ Activity log queue full, dropped {self.dropped} events so far")
+
+    async def _run_loop(self) -> None:
+        """Esperar el primer evento y volcar todo lo acumulado hasta `batch_size`"""
+        while True:
+            self._in_flight = [await self._queue.get()]
+            try:
+                # Dar margen a que se acumulen eventos antes de escribir
+                await asyncio.sleep(ACTIVITY_LOG_CONFIG["flush_interval"])
+                self._in_flight += self._drain(ACTIVITY_LOG_CONFIG["batch_size"] - 1)
+                await self._write(self._in_flight)
+            except Exception as e:
+                logger.error(f"❌ Error in activity log writer: {e}")
+            self._in_flight = []
+
+    async def maintain(self) -> Dict[str, Any]:
+        """Crear particiones futuras, resumir días cerrados y aplicar la retención"""
+        async with self.manager.pool.acquire() as conn:
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MAINTENANCE_LOCK_KEY):
+                return {}
+            try:
+                result = {
+                    'partitions_created': await ensure_partitions(conn),
+                    'rollup_rows': await rollup_daily(conn),
+                    'partitions_dropped': await drop_expired_partitions(conn)
+                }
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_KEY)
+
+        if result['partitions_created'] or result['partitions_dropped']:
+            logger.info(
+                f"🗂️ Activity log maintenance: {result['partitions_created']} partitions created, "
+                f"dropped {result['partitions_dropped'] or 'none'}"
+            )
+        return result
+
+    async def _maintenance_loop(self) -> None:
+        """Mantenimiento periódico de particiones y rollups"""
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"❌ Error in activity log maintenance: {e}")
+            await asyncio.sleep(ACTIVITY_LOG_CONFIG["maintenance_interval"])
+
+    def _drain(self, limit: int) -> List[ActivityEvent]:
+        """Sacar hasta `limit` eventos ya encolados sin esperar"""
+        events = []
+        while len(events) < limit:
+            try:
+                events.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return events
+
+    async def _write(self, events: List[ActivityEvent]) -> None:
+        """Insertar un lote con una sola sentencia (un reintento ante errores transitorios)"""
+        columns = list(zip(*events))
+
+        async with self._write_lock:
+            for attempt in (1, 2):
+                try:
+                    async with self.manager.pool.acquire() as conn:
+                        # user_id desconocido se guarda como NULL en lugar de romper la FK del lote
+                        await conn.execute(
+                            """
+                            INSERT INTO activity_logs (user_id, action, details, timestamp)
+                            SELECT u.user_id, e.action, e.details::jsonb, e.logged_at
+                            FROM unnest($1::bigint[], $2::text[], $3::text[], $4::timestamp[])
+                                AS e(user_id, action, details, logged_at)
+                            LEFT JOIN users u ON u.user_id = e.user_id
+                            """,
+                            *columns
+                        )
+                    self.written += len(events)
+                    return
+                except Exception as e:
+                    if attempt == 2:
+                        self.failed += len(events)
+                        logger.error(f"❌ Lost {len(events)} activity log events: {e}")
+                        return
+                    logger.warning(f"⚠️ Activity log batch failed, retrying: {e}")
+                    await asyncio.sleep(1)
+
+    async def flush(self) -> int:
+        """Volcar ya todo lo encolado (apagado ordenado)"""
+        flushed = 0
+        if self._in_flight:
+            events, self._in_flight = self._in_flight, []
+            await self._write(events)
+            flushed += len(events)
+
+        while True:
+            events = self._drain(ACTIVITY_LOG_CONFIG["batch_size"])
+            if not events:
+                return flushed
+            await self._write(events)
+            flushed += len(events)
+
+    async def close(self) -> None:
+        """Detener el task de fondo y volcar los eventos pendientes"""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        flushed = await self.flush()
+        if flushed:
+            logger.info(f"✅ Flushed {flushed} pending activity log events")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Profundidad de la cola y contadores de eventos"""
+        return {
+            'queue_depth': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'overflow_policy': self.policy
+        }
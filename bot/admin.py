@@ -5,6 +5,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
 from telegram.ext import ContextTypes
 from bot.texts import TEXTS
 from bot.config import ADMIN_IDS, ADMIN_HOST, ADMIN_PORT, BOT_TOKEN
+from bot.dispatcher import Lane, get_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -74,6 +75,21 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             logger.error(f"Database error: {db_error}")
             stats = {"total": "❓", "active": "❓", "users": "❓", "expired": "❓"}
         
+        # Actividad de los últimos 7 días desde los resúmenes diarios (no recorre activity_logs)
+        try:
+            from bot.enhanced_subscriber_manager import get_subscriber_manager
+            
+            manager = await get_subscriber_manager()
+            events_by_action = {}
+            for row in await manager.get_activity_rollups(days=7):
+                events_by_action[row['action']] = events_by_action.get(row['action'], 0) + row['events']
+            
+            top_actions = sorted(events_by_action.items(), key=lambda item: item[1], reverse=True)[:5]
+            activity = "\n".join(f"• `{action}`: {events}" for action, events in top_actions) or "• No activity yet"
+        except Exception as rollup_error:
+            logger.error(f"Error loading activity rollups: {rollup_error}")
+            activity = "• ❓"
+        
         text = f"""📊 **Bot Statistics - DETAILED**
 
 👥 **Subscribers:**
@@ -84,6 +100,9 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 👤 **Users:**
 • Total users registered: {stats['users']}
 
+📈 **Activity (last 7 days):**
+{activity}
+
 🌐 **Admin Panel:** http://{ADMIN_HOST}:{ADMIN_PORT}
 📅 **Last updated:** Just now
 
@@ -169,71 +188,28 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Confirmar antes de enviar
         await update.message.reply_text("📤 Enviando broadcast...")
         
-        # ✅ ARREGLO DE EMERGENCIA: Obtener usuarios con conexión directa
+        # Audiencia como stream paginado por user_id (memoria constante)
         try:
-            from bot.config import DATABASE_URL
-            import asyncpg
-            from datetime import datetime, timezone
-            
-            conn = await asyncpg.connect(DATABASE_URL)
-            
-            # Query para obtener usuarios según filtros
-            base_query = """
-                SELECT DISTINCT u.user_id, u.language,
-                       CASE
-                           WHEN s.expires_at IS NULL THEN 'never'
-                           WHEN s.expires_at > $1 THEN 'active'
-                           ELSE 'churned'
-                       END AS status
-                FROM users u
-                LEFT JOIN subscribers s ON u.user_id = s.user_id
-                WHERE 1=1
-            """
+            from bot.enhanced_subscriber_manager import get_subscriber_manager
             
-            params = [datetime.now(timezone.utc)]
-            conditions = []
-            
-            # Filtro de idioma
-            if language:
-                conditions.append("u.language = $" + str(len(params) + 1))
-                params.append(language)
-            
-            # Filtro de estado
-            if statuses:
-                if 'active' in statuses:
-                    conditions.append("s.expires_at > $1")
-                elif 'churned' in statuses:
-                    conditions.append("s.expires_at <= $1 AND s.expires_at IS NOT NULL")
-                elif 'never' in statuses:
-                    conditions.append("s.expires_at IS NULL")
-            
-            # Construir query final
-            if conditions:
-                query = base_query + " AND " + " AND ".join(conditions)
-            else:
-                query = base_query
-            
-            users_rows = await conn.fetch(query, *params)
-            users = [{"user_id": row["user_id"], "language": row["language"], "status": row["status"]} for row in users_rows]
-            await conn.close()
+            manager = await get_subscriber_manager()
             
         except Exception as db_error:
             logger.error(f"Database error getting users: {db_error}")
             await update.message.reply_text("❌ Error obteniendo lista de usuarios")
             return
         
-        if not users:
-            await update.message.reply_text("❌ No se encontraron usuarios con esos filtros")
-            return
-        
-        # Enviar a cada usuario
+        # Enviar a cada usuario mientras se recorren las páginas
         bot = Bot(token=BOT_TOKEN)
+        dispatcher = get_dispatcher()
         success_count = 0
         error_count = 0
         
-        for user in users:
+        async for user in manager.iter_audience(language=language, statuses=statuses):
             try:
-                await bot.send_message(
+                await dispatcher.call(
+                    Lane.MARKETING,
+                    bot.send_message,
                     chat_id=user["user_id"],
                     text=message_text,
                     parse_mode='Markdown'
@@ -243,13 +219,18 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 error_count += 1
                 logger.error(f"Error sending to {user['user_id']}: {e}")
         
+        target_count = success_count + error_count
+        if not target_count:
+            await update.message.reply_text("❌ No se encontraron usuarios con esos filtros")
+            return
+        
         # Reportar resultados
         result_text = f"""✅ **Broadcast Completado**
 
 📊 **Resultados:**
 • ✅ Enviados exitosamente: {success_count}
 • ❌ Errores: {error_count}
-• 👥 Total usuarios objetivo: {len(users)}
+• 👥 Total usuarios objetivo: {target_count}
 
 🎯 **Filtros aplicados:**
 • 🌐 Idioma: {language or 'Todos'}
@@ -281,31 +262,20 @@ async def broadcast_active_command(update: Update, context: ContextTypes.DEFAULT
     await update.message.reply_text("📤 Enviando a suscriptores activos...")
     
     try:
-        # ✅ ARREGLO FINAL: Conexión directa sin subscriber_manager
-        from bot.config import DATABASE_URL
-        import asyncpg
-        from datetime import datetime, timezone
-        
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Query para usuarios activos
-        users_rows = await conn.fetch("""
-            SELECT DISTINCT u.user_id
-            FROM users u
-            INNER JOIN subscribers s ON u.user_id = s.user_id
-            WHERE s.expires_at > $1
-        """, datetime.now(timezone.utc))
+        # Stream paginado de suscriptores activos
+        from bot.enhanced_subscriber_manager import get_subscriber_manager
         
-        await conn.close()
-        
-        users = [{"user_id": row["user_id"]} for row in users_rows]
+        manager = await get_subscriber_manager()
         
         bot = Bot(token=BOT_TOKEN)
+        dispatcher = get_dispatcher()
         success_count = 0
         
-        for user in users:
+        async for user in manager.iter_audience(statuses=["active"]):
             try:
-                await bot.send_message(
+                await dispatcher.call(
+                    Lane.MARKETING,
+                    bot.send_message,
                     chat_id=user["user_id"],
                     text=f"🎬 **Mensaje Exclusivo**\n\n{message_text}",
                     parse_mode='Markdown'
@@ -337,22 +307,20 @@ async def broadcast_all_command(update: Update, context: ContextTypes.DEFAULT_TY
     await update.message.reply_text("📤 Enviando a todos los usuarios...")
     
     try:
-        # ✅ ARREGLO FINAL: Conexión directa sin subscriber_manager
-        from bot.config import DATABASE_URL
-        import asyncpg
-        
-        conn = await asyncpg.connect(DATABASE_URL)
-        users_rows = await conn.fetch("SELECT user_id FROM users")
-        await conn.close()
+        # Stream paginado de todos los usuarios
+        from bot.enhanced_subscriber_manager import get_subscriber_manager
         
-        users = [{"user_id": row["user_id"]} for row in users_rows]
+        manager = await get_subscriber_manager()
         
         bot = Bot(token=BOT_TOKEN)
+        dispatcher = get_dispatcher()
         success_count = 0
         
-        for user in users:
+        async for user in manager.iter_audience():
             try:
-                await bot.send_message(
+                await dispatcher.call(
+                    Lane.MARKETING,
+                    bot.send_message,
                     chat_id=user["user_id"],
                     text=message_text,
                     parse_mode='Markdown'
@@ -589,7 +557,9 @@ async def reply_to_customer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Enviar respuesta al cliente
         bot = Bot(token=BOT_TOKEN)
-        await bot.send_message(
+        await get_dispatcher().call(
+            Lane.SUPPORT,
+            bot.send_message,
             chat_id=customer_id,
             text=f"👨‍💼 **Soporte PNP Television**\n\n{response_message}\n\n"
                  f"¿Necesitas más ayuda? Solo escribe tu pregunta.",
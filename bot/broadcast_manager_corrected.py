@@ -8,25 +8,73 @@ Gestión de mensajes masivos con optimizaciones de rendimiento y seguridad
 from __future__ import annotations
 
 import asyncio
-import backoff
+import heapq
+import secrets
+import time
+from collections import deque
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Set, Tuple, Union
 import logging
 
-from telegram import Bot
-from telegram.error import TelegramError, RetryAfter
+from telegram import Bot, Message, MessageId
+from telegram.error import TelegramError
 
 from bot.enhanced_subscriber_manager import get_subscriber_manager  # ✅ CORREGIDO: Import correcto
-from bot.config import BOT_TOKEN, RATE_LIMIT_CONFIG, SECURITY_CONFIG
+from bot.config import BOT_TOKEN, RATE_LIMIT_CONFIG, SECURITY_CONFIG, BROADCAST_CONFIG
+from bot.rate_limiter import ChatPacer
+from bot.dispatcher import Lane, get_dispatcher, retry_after_seconds
+from bot.media_cache import MediaFanout, is_remote_media
+from bot.telegram_errors import ErrorKind, classify_error
 
 logger = logging.getLogger(__name__)
 
+# Resultados de un envío individual
+SEND_OK = 'sent'
+SEND_BLOCKED = 'blocked'
+SEND_NOT_FOUND = 'not_found'
+SEND_FAILED = 'failed'
+
+# Callback async que recibe los eventos de progreso de un broadcast
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class _CompletionWatermark:
+    """
+    user_id más alto tal que todos los destinatarios anteriores ya terminaron.
+    
+    Los workers completan fuera de orden; el checkpoint solo avanza sobre el
+    prefijo contiguo de envíos terminados para que reanudar no salte a nadie.
+    """
+
+    def __init__(self, start: Optional[int] = None):
+        self.value = start
+        self._in_flight: deque = deque()
+        self._done: Set[int] = set()
+
+    def dispatch(self, user_id: int) -> None:
+        self._in_flight.append(user_id)
+
+    def complete(self, user_id: int) -> None:
+        self._done.add(user_id)
+        while self._in_flight and self._in_flight[0] in self._done:
+            self.value = self._in_flight.popleft()
+            self._done.discard(self.value)
+
 class BroadcastManager:
     """Gestor de broadcasts con programación, segmentación y rate limiting mejorado"""
 
     def __init__(self, bot: Bot | None = None):
         self.bot = bot or Bot(token=BOT_TOKEN)
-        self.scheduled: List[tuple[datetime, asyncio.Task]] = []
+        # Min-heap (fecha, broadcast_id) de broadcasts programados; la fuente de verdad es broadcast_jobs
+        self._schedule_heap: List[Tuple[datetime, str]] = []
+        self._schedule_changed = asyncio.Event()
+        self._scheduler_task: Optional[asyncio.Task] = None
+        # Ejecuciones de broadcasts programados lanzadas por el scheduler (referencia fuerte hasta que terminan)
+        self._scheduled_runs: Set[asyncio.Task] = set()
+        # Broadcasts en curso en este proceso -> evento de cancelación
+        self._running_jobs: Dict[str, asyncio.Event] = {}
+        # Broadcasts en curso -> task que los ejecuta (para detenerlos al apagar)
+        self._job_tasks: Dict[str, asyncio.Task] = {}
         self.metrics = {
             'messages_sent': 0,
             'messages_failed': 0,
@@ -36,6 +84,11 @@ class BroadcastManager:
         }
         self._daily_broadcast_count = 0
         self._last_reset_date = datetime.now(timezone.utc).date()
+        # Los envíos van por el carril de marketing del despachador global;
+        # el espaciado por chat es propio de los broadcasts
+        self.dispatcher = get_dispatcher()
+        self.rate_limiter = self.dispatcher.rate_limiter
+        self.chat_pacer = ChatPacer(RATE_LIMIT_CONFIG["per_chat_interval"])
 
     def _check_daily_limit(self) -> bool:
         """Verificar límite diario de broadcasts"""
@@ -48,45 +101,114 @@ class BroadcastManager:
         
         return self._daily_broadcast_count < SECURITY_CONFIG["max_broadcast_per_day"]
 
-    @backoff.on_exception(
-        backoff.expo,
-        (TelegramError, RetryAfter),
-        max_tries=RATE_LIMIT_CONFIG["max_retries"],
-        base=2
-    )
-    async def _send_message_with_retry(self, chat_id: int, **kwargs) -> bool:
-        """Enviar mensaje individual con reintentos automáticos"""
-        try:
-            if kwargs.get('photo'):
-                await self.bot.send_photo(chat_id=chat_id, **kwargs)
-            elif kwargs.get('video'):
-                await self.bot.send_video(chat_id=chat_id, **kwargs)
-            elif kwargs.get('animation'):
-                await self.bot.send_animation(chat_id=chat_id, **kwargs)
-            elif kwargs.get('text'):
-                await self.bot.send_message(chat_id=chat_id, **kwargs)
-            else:
-                logger.warning(f"No valid content to send to {chat_id}")
-                return False
-            
-            return True
-            
-        except TelegramError as e:
-            # Log específico para diferentes tipos de errores
-            if "blocked" in str(e).lower():
-                logger.info(f"User {chat_id} has blocked the bot")
-                # Marcar usuario como bloqueado en la base de datos
-                try:
-                    manager = await get_subscriber_manager()
-                    await manager.record_user(chat_id, is_blocked=True)
-                except Exception as db_error:
-                    logger.warning(f"Failed to mark user {chat_id} as blocked: {db_error}")
-            elif "not found" in str(e).lower():
-                logger.info(f"User {chat_id} not found or deleted account")
+    async def _send_message_with_retry(
+        self, chat_id: int, media_upload: Optional[MediaFanout] = None, **kwargs
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Enviar mensaje individual con reintentos automáticos
+        
+        Un RetryAfter no se reintenta a ciegas: frena el controlador de tasa
+        global (todos los workers esperan `retry_after`) y luego se reintenta.
+        Los fallos transitorios de red se reintentan con espera exponencial;
+        los permanentes (bloqueado, chat inexistente, petición inválida) nunca.
+        
+        Returns:
+            Tuple[str, Optional[str]]: (SEND_OK, SEND_BLOCKED, SEND_NOT_FOUND o
+            SEND_FAILED, nombre de la clase del último error)
+        """
+        error_class = None
+        for attempt in range(1, RATE_LIMIT_CONFIG["max_retries"] + 1):
+            try:
+                if media_upload is not None:
+                    # El medio se sube una vez y el resto de envíos reutiliza el file_id
+                    await media_upload.send(
+                        lambda media: self._send_content(chat_id, {**kwargs, media_upload.media_type: media})
+                    )
+                elif await self._send_content(chat_id, kwargs) is None:
+                    logger.warning(f"No valid content to send to {chat_id}")
+                    return SEND_FAILED, None
+                
+                return SEND_OK, None
+                
+            except TelegramError as e:
+                error_class = type(e).__name__
+                kind = classify_error(e)
+                
+                if kind is ErrorKind.THROTTLE:
+                    # El despachador ya recortó la tasa global y pausó todos los carriles
+                    logger.warning(
+                        f"⏳ RetryAfter {retry_after_seconds(e):g}s sending to {chat_id} (attempt {attempt}); "
+                        f"global rate lowered to {self.rate_limiter.current_rate:.1f} msg/s"
+                    )
+                elif kind is ErrorKind.RETRY:
+                    logger.warning(f"Transient error sending to {chat_id} (attempt {attempt}): {e}")
+                    if attempt < RATE_LIMIT_CONFIG["max_retries"]:
+                        await asyncio.sleep(2 ** (attempt - 1))
+                elif kind is ErrorKind.BLOCKED:
+                    # El motor marca a los usuarios inalcanzables en lote en lugar de escribir aquí
+                    logger.info(f"User {chat_id} has blocked the bot")
+                    return SEND_BLOCKED, error_class
+                elif kind is ErrorKind.NOT_FOUND:
+                    logger.info(f"User {chat_id} not found or deleted account")
+                    return SEND_NOT_FOUND, error_class
+                else:
+                    logger.error(f"Error sending message to {chat_id}: {e}")
+                    return SEND_FAILED, error_class
+        
+        logger.error(f"Giving up on {chat_id} after {RATE_LIMIT_CONFIG['max_retries']} attempts")
+        return SEND_FAILED, error_class
+
+    async def _send_content(self, chat_id: int, kwargs: Dict[str, Any]) -> Optional[Union[Message, MessageId]]:
+        """Llamada a la API según el tipo de contenido (el texto va como caption en medios)"""
+        text = kwargs.get('text')
+        parse_mode = kwargs.get('parse_mode')
+        message_ids = kwargs.get('message_ids')
+        is_album = bool(message_ids) and len(message_ids) > 1
+        
+        if message_ids:
+            # Copia del mensaje original: conserva formato, entidades y álbumes
+            if not is_album:
+                method, call_kwargs = self.bot.copy_message, {
+                    'from_chat_id': kwargs['from_chat_id'], 'message_id': message_ids[0]
+                }
             else:
-                logger.error(f"Error sending message to {chat_id}: {e}")
-            
-            return False
+                method, call_kwargs = self.bot.copy_messages, {
+                    'from_chat_id': kwargs['from_chat_id'], 'message_ids': message_ids
+                }
+        elif kwargs.get('photo'):
+            method, call_kwargs = self.bot.send_photo, {'photo': kwargs['photo'], 'caption': text, 'parse_mode': parse_mode}
+        elif kwargs.get('video'):
+            method, call_kwargs = self.bot.send_video, {'video': kwargs['video'], 'caption': text, 'parse_mode': parse_mode}
+        elif kwargs.get('animation'):
+            method, call_kwargs = self.bot.send_animation, {'animation': kwargs['animation'], 'caption': text, 'parse_mode': parse_mode}
+        elif text:
+            method, call_kwargs = self.bot.send_message, {'text': text, 'parse_mode': parse_mode}
+        else:
+            return None
+        
+        await self.chat_pacer.wait(chat_id)
+        result = await self.dispatcher.call(Lane.MARKETING, method, chat_id=chat_id, **call_kwargs)
+        
+        if is_album:
+            return result[0] if result else None
+        return result
+
+    async def _prepare_media(self, message_kwargs: Dict[str, Any], manager) -> Optional[MediaFanout]:
+        """Resolver un medio remoto a file_id (caché) o prepararlo para subirlo una sola vez"""
+        media_type = next((k for k in ('photo', 'video', 'animation') if message_kwargs.get(k)), None)
+        
+        if not media_type or not is_remote_media(message_kwargs[media_type]):
+            return None
+        
+        media_upload = MediaFanout(media_type, message_kwargs[media_type], manager)
+        try:
+            await media_upload.prepare()
+        except Exception as e:
+            # Sin descarga previa se mantiene la URL: Telegram la buscará en cada envío
+            logger.warning(f"Could not prefetch {media_type} {message_kwargs[media_type]}: {e}")
+            return None
+        
+        return media_upload
 
     async def send(
         self,
@@ -97,7 +219,10 @@ class BroadcastManager:
         animation: Optional[str] = None,
         language: Optional[str] = None,
         statuses: Optional[List[str]] = None,
-        dry_run: bool = False
+        dry_run: bool = False,
+        from_chat_id: Optional[int] = None,
+        message_ids: Optional[List[int]] = None,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         """
         Enviar broadcast con métricas detalladas y manejo de errores mejorado
@@ -111,6 +236,10 @@ class BroadcastManager:
             language: Filtro de idioma ('en', 'es', None para todos)
             statuses: Filtro de estados (['active'], ['churned'], etc.)
             dry_run: Solo contar usuarios sin enviar mensajes
+            from_chat_id: Chat del mensaje original (modo copy_message)
+            message_ids: Mensaje(s) a copiar tal cual; varios IDs copian un álbum
+            progress_callback: Recibe eventos de progreso (el primero trae el
+                broadcast_id, necesario para cancel())
             
         Returns:
             Dict con métricas del broadcast
@@ -121,113 +250,484 @@ class BroadcastManager:
             raise ValueError(f"Daily broadcast limit reached ({SECURITY_CONFIG['max_broadcast_per_day']})")
         
         # Validar contenido
-        if not any([text, photo, video, animation]):
+        if not any([text, photo, video, animation, message_ids]):
             raise ValueError("At least one content type must be provided")
         
-        broadcast_start = datetime.now(timezone.utc)
+        if message_ids and from_chat_id is None:
+            raise ValueError("from_chat_id is required to copy messages")
         
-        # Obtener usuarios filtrados
+        # Audiencia filtrada: COUNT para dry run, stream paginado para el envío
         try:
             manager = await get_subscriber_manager()
-            users = await manager.get_users(language=language, statuses=statuses)
         except Exception as e:
             logger.error(f"Error fetching users for broadcast: {e}")
             raise
         
         if dry_run:
+            target_users = await manager.count_audience(language=language, statuses=statuses)
+            
             return {
                 'dry_run': True,
-                'target_users': len(users),
+                'target_users': target_users,
                 'filters': {
                     'language': language,
                     'statuses': statuses
                 },
-                'estimated_duration': len(users) * RATE_LIMIT_CONFIG["broadcast_delay"]
+                'estimated_duration': target_users / RATE_LIMIT_CONFIG["global_rate"]
             }
         
-        logger.info(f"Starting broadcast to {len(users)} users with filters: language={language}, statuses={statuses}")
-        
-        # Preparar argumentos del mensaje
-        message_kwargs = {
+        # Registrar el broadcast como job durable antes de enviar
+        broadcast_start = datetime.now(timezone.utc)
+        broadcast_id = f"BC_{int(broadcast_start.timestamp())}_{secrets.token_hex(3)}"
+        payload = {
             'text': text,
             'parse_mode': parse_mode,
             'photo': photo,
             'video': video,
-            'animation': animation
+            'animation': animation,
+            'from_chat_id': from_chat_id,
+            'message_ids': message_ids,
+            'language': language,
+            'statuses': statuses
         }
+        await manager.create_broadcast_job(broadcast_id, payload)
         
-        # Remover argumentos vacíos
-        message_kwargs = {k: v for k, v in message_kwargs.items() if v is not None}
+        self._daily_broadcast_count += 1
+        self.metrics['broadcasts_today'] = self._daily_broadcast_count
         
-        # Contadores para métricas
-        sent_count = 0
-        failed_count = 0
-        blocked_users = []
+        return await self._execute_job(broadcast_id, payload, broadcast_start, progress_callback=progress_callback)
+
+    def cancel(self, broadcast_id: str) -> bool:
+        """Detener un broadcast en curso en este proceso; lo ya enviado se conserva"""
+        cancel_event = self._running_jobs.get(broadcast_id)
         
-        # Enviar mensajes con rate limiting
-        for i, user in enumerate(users):
-            user_id = user["user_id"]
-            
+        if cancel_event is None:
+            return False
+        
+        cancel_event.set()
+        logger.info(f"Cancellation requested for broadcast {broadcast_id}")
+        return True
+
+    async def shutdown(self, timeout: float = 10.0) -> None:
+        """
+        Detener los broadcasts en curso sin marcarlos como terminados.
+        
+        Cada job guarda su ledger y checkpoint al cancelarse y queda 'running',
+        así resume_jobs lo continúa en el siguiente arranque. Debe llamarse
+        antes de cerrar el pool de la base de datos.
+        """
+        if self._scheduler_task is not None:
+            self._scheduler_task.cancel()
+            self._scheduler_task = None
+        
+        # Incluye los programados que aún no registraron su job (p. ej. durante el claim)
+        tasks = [task for task in {*self._job_tasks.values(), *self._scheduled_runs} if not task.done()]
+        if not tasks:
+            return
+        
+        logger.info(f"Stopping {len(tasks)} running broadcasts for shutdown")
+        for task in tasks:
+            task.cancel()
+        
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} broadcasts did not stop within {timeout:g}s")
+
+    async def resume_jobs(self) -> List[Dict[str, Any]]:
+        """
+        Reanudar broadcasts que quedaron en curso tras un reinicio del worker.
+        
+        Se reanudan sin progress_callback: el mensaje de progreso del admin no
+        sobrevive al reinicio y el avance solo queda en los logs y en broadcast_jobs.
+        """
+        manager = await get_subscriber_manager()
+        jobs = await manager.get_resumable_broadcast_jobs()
+        results = []
+        
+        for job in jobs:
+            logger.info(
+                f"Resuming broadcast {job['broadcast_id']} after user {job['cursor_user_id']} "
+                f"({job['processed']} already processed)"
+            )
             try:
-                success = await self._send_message_with_retry(user_id, **message_kwargs)
-                
-                if success:
-                    sent_count += 1
-                    self.metrics['messages_sent'] += 1
-                else:
-                    failed_count += 1
-                    self.metrics['messages_failed'] += 1
-                    blocked_users.append(user_id)
-                
-                # Rate limiting mejorado
-                if i < len(users) - 1:  # No hacer delay en el último mensaje
-                    await asyncio.sleep(RATE_LIMIT_CONFIG["broadcast_delay"])
-                
-                # Log de progreso cada 100 mensajes
-                if (i + 1) % 100 == 0:
-                    logger.info(f"Broadcast progress: {i + 1}/{len(users)} messages processed")
-                    
+                results.append(await self._execute_job(
+                    job['broadcast_id'],
+                    job['payload'],
+                    job['started_at'].replace(tzinfo=timezone.utc),
+                    cursor_user_id=job['cursor_user_id'],
+                    counters={
+                        'sent': job['messages_sent'],
+                        'failed': job['messages_failed'],
+                        'blocked': job['blocked_users'],
+                        'processed': job['processed']
+                    }
+                ))
             except Exception as e:
-                logger.error(f"Unexpected error sending to user {user_id}: {e}")
-                failed_count += 1
-                self.metrics['messages_failed'] += 1
+                logger.error(f"Error resuming broadcast {job['broadcast_id']}: {e}")
+        
+        return results
+
+    async def _execute_job(
+        self,
+        broadcast_id: str,
+        payload: Dict[str, Any],
+        broadcast_start: datetime,
+        cursor_user_id: Optional[int] = None,
+        counters: Optional[Dict[str, int]] = None,
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """Ejecutar (o continuar) un job de broadcast desde su checkpoint"""
+        manager = await get_subscriber_manager()
+        language = payload.get('language')
+        statuses = payload.get('statuses')
+        
+        logger.info(f"Starting broadcast {broadcast_id} with filters: language={language}, statuses={statuses}")
+        
+        # Envío concurrente con tasa global adaptativa y checkpoints por lotes
+        throttle_events_before = self.rate_limiter.throttle_events
+        cancel_event = asyncio.Event()
+        self._running_jobs[broadcast_id] = cancel_event
+        self._job_tasks[broadcast_id] = asyncio.current_task()
+        try:
+            # Dentro del try: un fallo al preparar el envío también cierra el job como 'failed'
+            message_kwargs = await self._build_message_kwargs(payload, manager)
+            
+            audience = manager.iter_audience(language=language, statuses=statuses, after_user_id=cursor_user_id)
+            
+            # Total estimado para calcular el ETA del progreso
+            target_estimate = await manager.count_audience(language=language, statuses=statuses, use_cache=False)
+            
+            counters = await self._run_engine(
+                audience, message_kwargs,
+                broadcast_id=broadcast_id,
+                cursor_user_id=cursor_user_id,
+                counters=counters,
+                cancel_event=cancel_event,
+                progress_callback=progress_callback,
+                target_users=target_estimate
+            )
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} failed: {e}")
+            try:
+                await manager.finish_broadcast_job(broadcast_id, 'failed', error=str(e))
+            except Exception as finish_error:
+                logger.error(f"Could not mark broadcast {broadcast_id} as failed: {finish_error}")
+            raise
+        finally:
+            self._running_jobs.pop(broadcast_id, None)
+            self._job_tasks.pop(broadcast_id, None)
+        
+        cancelled = cancel_event.is_set()
+        await manager.finish_broadcast_job(broadcast_id, 'cancelled' if cancelled else 'completed', counters=counters)
+        
+        sent_count = counters['sent']
+        failed_count = counters['failed']
+        target_users = counters['processed']
         
         # Actualizar métricas
         broadcast_end = datetime.now(timezone.utc)
         duration = (broadcast_end - broadcast_start).total_seconds()
         
-        self._daily_broadcast_count += 1
         self.metrics['users_reached'] = sent_count
-        self.metrics['broadcasts_today'] = self._daily_broadcast_count
         self.metrics['last_broadcast'] = broadcast_end
         
+        # Throughput real frente al techo configurado
+        throughput = (sent_count + failed_count) / duration if duration > 0 else 0.0
+        ceiling = RATE_LIMIT_CONFIG["global_rate"]
+        
         # Resultado del broadcast
         result = {
-            'broadcast_id': f"BC_{int(broadcast_start.timestamp())}",
+            'broadcast_id': broadcast_id,
             'started_at': broadcast_start.isoformat(),
             'completed_at': broadcast_end.isoformat(),
             'duration_seconds': duration,
-            'target_users': len(users),
+            'target_users': target_users,
             'messages_sent': sent_count,
             'messages_failed': failed_count,
-            'success_rate': (sent_count / len(users) * 100) if users else 0,
-            'blocked_users': len(blocked_users),
+            'success_rate': (sent_count / target_users * 100) if target_users else 0,
+            'blocked_users': counters['blocked'],
             'filters_applied': {
                 'language': language,
                 'statuses': statuses
             },
             'content_type': self._get_content_type(message_kwargs),
-            'rate_limit_delay': RATE_LIMIT_CONFIG["broadcast_delay"]
+            'messages_per_second': throughput,
+            'rate_limit_ceiling': ceiling,
+            'ceiling_utilization': throughput / ceiling * 100,
+            'current_rate': self.rate_limiter.current_rate,
+            'throttle_events': self.rate_limiter.throttle_events - throttle_events_before,
+            'max_in_flight': RATE_LIMIT_CONFIG["broadcast_concurrency"],
+            'cancelled': cancelled
         }
         
         logger.info(
-            f"Broadcast completed: {sent_count}/{len(users)} sent "
-            f"({result['success_rate']:.1f}% success rate) in {duration:.1f}s"
+            f"Broadcast {broadcast_id} {'cancelled' if cancelled else 'completed'}: {sent_count}/{target_users} sent "
+            f"({result['success_rate']:.1f}% success rate) in {duration:.1f}s "
+            f"at {throughput:.1f} msg/s ({result['ceiling_utilization']:.0f}% of {ceiling:g} msg/s ceiling)"
         )
         
         return result
 
-    def schedule(
+    async def _build_message_kwargs(self, payload: Dict[str, Any], manager) -> Dict[str, Any]:
+        """Preparar argumentos del mensaje a partir del payload de un job"""
+        message_kwargs = {
+            k: payload.get(k)
+            for k in ('text', 'parse_mode', 'photo', 'video', 'animation', 'from_chat_id', 'message_ids')
+        }
+        
+        # Remover argumentos vacíos
+        message_kwargs = {k: v for k, v in message_kwargs.items() if v is not None}
+        
+        media_upload = await self._prepare_media(message_kwargs, manager)
+        if media_upload:
+            message_kwargs['media_upload'] = media_upload
+        
+        return message_kwargs
+
+    async def retry_failed(self, broadcast_id: str) -> Dict[str, Any]:
+        """Reenviar un broadcast terminado solo a los destinatarios con fallo transitorio"""
+        manager = await get_subscriber_manager()
+        job = await manager.get_broadcast_job(broadcast_id)
+        
+        if job is None:
+            raise ValueError(f"Broadcast {broadcast_id} not found")
+        
+        if job['status'] in ('scheduled', 'running'):
+            raise ValueError(f"Broadcast {broadcast_id} is still {job['status']}")
+        
+        user_ids = await manager.get_failed_delivery_user_ids(broadcast_id)
+        logger.info(f"Retrying broadcast {broadcast_id} for {len(user_ids)} failed deliveries")
+        
+        async def _failed_audience() -> AsyncIterator[Dict[str, Any]]:
+            for user_id in user_ids:
+                yield {'user_id': user_id}
+        
+        message_kwargs = await self._build_message_kwargs(job['payload'], manager)
+        counters = await self._run_engine(_failed_audience(), message_kwargs, ledger_id=broadcast_id)
+        
+        return {
+            'broadcast_id': broadcast_id,
+            'retried_users': counters['processed'],
+            'messages_sent': counters['sent'],
+            'messages_failed': counters['failed'],
+            'blocked_users': counters['blocked']
+        }
+
+    async def _run_engine(
+        self,
+        audience: AsyncIterator[Dict[str, Any]],
+        message_kwargs: Dict[str, Any],
+        broadcast_id: Optional[str] = None,
+        cursor_user_id: Optional[int] = None,
+        counters: Optional[Dict[str, int]] = None,
+        ledger_id: Optional[str] = None,
+        cancel_event: Optional[asyncio.Event] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+        target_users: Optional[int] = None
+    ) -> Dict[str, int]:
+        """
+        Motor de envío concurrente.
+        
+        Un pool fijo de workers limita las requests en vuelo, el despachador
+        global reparte la tasa (carril de marketing, detrás del tráfico
+        transaccional) y el ChatPacer espacia envíos al mismo chat.
+        La audiencia se consume página a página mientras los workers envían.
+        
+        Con `broadcast_id`, cada BROADCAST_CHECKPOINT_EVERY mensajes se guarda en
+        el job el user_id más alto hasta el cual todos los envíos terminaron.
+        
+        Cada resultado se anota en broadcast_deliveries bajo `ledger_id` (por
+        defecto `broadcast_id`) con COPY por lotes; los usuarios que ya figuran
+        como 'sent' se saltan, así reanudar no repite mensajes.
+        
+        `progress_callback` recibe un evento al empezar, cada
+        BROADCAST_PROGRESS_INTERVAL segundos y al terminar. Si `cancel_event`
+        se activa se deja de despachar; lo pendiente en cola no se envía y el
+        checkpoint queda en el último envío contiguo terminado.
+        """
+        concurrency = max(1, RATE_LIMIT_CONFIG["broadcast_concurrency"])
+        checkpoint_every = max(1, BROADCAST_CONFIG["checkpoint_every"])
+        queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        counters = dict(counters or {'sent': 0, 'failed': 0, 'blocked': 0, 'processed': 0})
+        watermark = _CompletionWatermark(cursor_user_id)
+        checkpoint_lock = asyncio.Lock()
+        manager = await get_subscriber_manager()
+        blocked_buffer: List[int] = []
+        ledger_id = ledger_id or broadcast_id
+        ledger_buffer: List[tuple] = []
+        ledger_lock = asyncio.Lock()
+        delivered: Set[int] = set()
+        
+        if ledger_id:
+            delivered = await manager.get_delivered_user_ids(ledger_id, after_user_id=cursor_user_id)
+
+        async def _flush_ledger() -> None:
+            # COPY por lotes; el lock mantiene el orden frente al checkpoint
+            async with ledger_lock:
+                if not ledger_buffer:
+                    return
+                batch = ledger_buffer[:]
+                ledger_buffer.clear()
+                try:
+                    await manager.record_deliveries(batch)
+                except asyncio.CancelledError:
+                    # Se devuelve el lote para el flush final de la cancelación
+                    ledger_buffer[:0] = batch
+                    raise
+                except Exception as e:
+                    logger.warning(f"Failed to record {len(batch)} deliveries for {ledger_id}: {e}")
+
+        async def _flush_blocked() -> None:
+            # Un UPDATE ... WHERE user_id = ANY($1) por lote de usuarios inalcanzables
+            if not blocked_buffer:
+                return
+            batch = blocked_buffer[:]
+            blocked_buffer.clear()
+            try:
+                await manager.mark_users_blocked(batch)
+            except asyncio.CancelledError:
+                blocked_buffer[:0] = batch
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to mark {len(batch)} users as blocked: {e}")
+
+        async def _checkpoint() -> None:
+            async with checkpoint_lock:
+                await _flush_blocked()
+                await _flush_ledger()
+                if broadcast_id:
+                    await manager.checkpoint_broadcast_job(broadcast_id, watermark.value, counters)
+
+        async def _worker() -> None:
+            while True:
+                user_id = await queue.get()
+                try:
+                    if user_id is None:
+                        return
+                    
+                    if cancel_event is not None and cancel_event.is_set():
+                        continue
+                    
+                    sent_at = time.monotonic()
+                    try:
+                        outcome, error_class = await self._send_message_with_retry(user_id, **message_kwargs)
+                    except Exception as e:
+                        logger.error(f"Unexpected error sending to user {user_id}: {e}")
+                        outcome, error_class = SEND_FAILED, type(e).__name__
+                    
+                    if outcome == SEND_OK:
+                        counters['sent'] += 1
+                        self.metrics['messages_sent'] += 1
+                    else:
+                        counters['failed'] += 1
+                        self.metrics['messages_failed'] += 1
+                    
+                    if ledger_id:
+                        latency_ms = int((time.monotonic() - sent_at) * 1000)
+                        ledger_buffer.append((ledger_id, user_id, outcome, error_class, latency_ms))
+                        if len(ledger_buffer) >= BROADCAST_CONFIG["ledger_flush_size"]:
+                            await _flush_ledger()
+                    
+                    if outcome in (SEND_BLOCKED, SEND_NOT_FOUND):
+                        counters['blocked'] += 1
+                        blocked_buffer.append(user_id)
+                        if len(blocked_buffer) >= BROADCAST_CONFIG["blocked_flush_size"]:
+                            await _flush_blocked()
+                    
+                    counters['processed'] += 1
+                    watermark.complete(user_id)
+                    
+                    # Checkpoint durable por lotes
+                    if counters['processed'] % checkpoint_every == 0:
+                        try:
+                            await _checkpoint()
+                        except Exception as e:
+                            logger.warning(f"Failed to checkpoint broadcast {broadcast_id}: {e}")
+                    
+                    # Log de progreso cada 100 mensajes
+                    if counters['processed'] % 100 == 0:
+                        logger.info(f"Broadcast progress: {counters['processed']} messages processed")
+                finally:
+                    queue.task_done()
+
+        run_start = time.monotonic()
+        processed_at_start = counters['processed']
+
+        def _progress(state: str) -> Dict[str, Any]:
+            elapsed = time.monotonic() - run_start
+            throughput = (counters['processed'] - processed_at_start) / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, (target_users or 0) - counters['processed'])
+            return {
+                'broadcast_id': broadcast_id or ledger_id,
+                'state': state,
+                'processed': counters['processed'],
+                'sent': counters['sent'],
+                'failed': counters['failed'],
+                'blocked': counters['blocked'],
+                'target_users': target_users,
+                'messages_per_second': throughput,
+                'current_rate': self.rate_limiter.current_rate,
+                'eta_seconds': remaining / throughput if throughput > 0 and target_users else None,
+                'elapsed_seconds': elapsed
+            }
+
+        async def _reporter() -> None:
+            while True:
+                await asyncio.sleep(BROADCAST_CONFIG["progress_interval"])
+                await self._emit_progress(progress_callback, _progress('running'))
+
+        if progress_callback:
+            await self._emit_progress(progress_callback, _progress('running'))
+
+        workers = [asyncio.create_task(_worker()) for _ in range(concurrency)]
+        reporter = asyncio.create_task(_reporter()) if progress_callback else None
+        try:
+            async for user in audience:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if user["user_id"] in delivered:
+                    continue
+                watermark.dispatch(user["user_id"])
+                await queue.put(user["user_id"])
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            # Apagado (deploy/SIGTERM): guardar lo ya enviado antes de propagar, así
+            # reanudar no repite a nadie. Los workers se detienen primero para que
+            # el ledger y el watermark no cambien durante el último flush.
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            try:
+                await asyncio.shield(_checkpoint())
+            except Exception as e:
+                logger.warning(f"Failed to checkpoint broadcast {broadcast_id or ledger_id} on shutdown: {e}")
+            raise
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if reporter:
+                reporter.cancel()
+            if hasattr(audience, 'aclose'):
+                await audience.aclose()
+
+        await _checkpoint()
+
+        if progress_callback:
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            await self._emit_progress(progress_callback, _progress('cancelled' if cancelled else 'completed'))
+
+        return counters
+
+    async def _emit_progress(self, progress_callback: ProgressCallback, event: Dict[str, Any]) -> None:
+        """Entregar un evento de progreso sin que un error del callback afecte al envío"""
+        try:
+            await progress_callback(event)
+        except Exception as e:
+            logger.warning(f"Progress callback failed for {event['broadcast_id']}: {e}")
+
+    async def schedule(
         self,
         when: datetime,
         *,
@@ -242,10 +742,16 @@ class BroadcastManager:
         """
         Programar broadcast con validaciones mejoradas
         
+        El broadcast se guarda en broadcast_jobs con estado 'scheduled', así la
+        cola de 72 horas sobrevive a reinicios del worker.
+        
         Returns:
             str: ID único del broadcast programado
         """
         now = datetime.now(timezone.utc)
+        # Fechas sin zona se interpretan como UTC; a la base van sin zona (columnas TIMESTAMP)
+        when = when.replace(tzinfo=timezone.utc) if when.tzinfo is None else when.astimezone(timezone.utc)
+        when_utc = when.replace(tzinfo=None)
         
         # Validaciones de tiempo
         if when < now:
@@ -254,110 +760,167 @@ class BroadcastManager:
         if when > now + timedelta(hours=72):
             raise ValueError("Cannot schedule broadcasts more than 72 hours in advance")
         
-        # Verificar límite de broadcasts programados para el día
+        # Validar contenido
+        if not any([text, photo, video, animation]):
+            raise ValueError("At least one content type must be provided")
+        
+        manager = await get_subscriber_manager()
+        
+        # Verificar límite de broadcasts programados para el día (consulta indexada)
         target_date = when.date()
-        scheduled_for_day = sum(
-            1 for (scheduled_time, _) in self.scheduled 
-            if scheduled_time.date() == target_date
-        )
+        day_start = datetime.combine(target_date, datetime.min.time())
+        scheduled_for_day = await manager.count_scheduled_broadcasts(day_start, day_start + timedelta(days=1))
         
         if scheduled_for_day >= SECURITY_CONFIG["max_broadcast_per_day"]:
             raise ValueError(f"Maximum {SECURITY_CONFIG['max_broadcast_per_day']} broadcasts per day limit reached for {target_date}")
         
-        # Validar contenido
-        if not any([text, photo, video, animation]):
-            raise ValueError("At least one content type must be provided")
-        
         # Crear ID único para el broadcast
-        broadcast_id = f"SCHED_{int(when.timestamp())}_{len(self.scheduled)}"
+        broadcast_id = f"SCHED_{int(when.timestamp())}_{secrets.token_hex(3)}"
+        payload = {
+            'text': text,
+            'parse_mode': parse_mode,
+            'photo': photo,
+            'video': video,
+            'animation': animation,
+            'language': language,
+            'statuses': statuses
+        }
+        await manager.create_broadcast_job(broadcast_id, payload, scheduled_at=when_utc)
         
-        async def _scheduled_task():
-            """Tarea programada para ejecutar el broadcast"""
-            try:
-                # Calcular delay hasta el momento programado
-                delay = (when - datetime.now(timezone.utc)).total_seconds()
-                if delay > 0:
-                    logger.info(f"Waiting {delay:.1f}s for scheduled broadcast {broadcast_id}")
-                    await asyncio.sleep(delay)
-                
-                # Ejecutar el broadcast
-                logger.info(f"Executing scheduled broadcast {broadcast_id}")
-                result = await self.send(
-                    text=text,
-                    parse_mode=parse_mode,
-                    photo=photo,
-                    video=video,
-                    animation=animation,
-                    language=language,
-                    statuses=statuses,
-                )
-                
-                logger.info(f"Scheduled broadcast {broadcast_id} completed successfully")
-                
-            except Exception as e:
-                logger.error(f"Error executing scheduled broadcast {broadcast_id}: {e}")
-            finally:
-                # Auto-limpiar de la lista
-                self.scheduled = [
-                    (t, task) for (t, task) in self.scheduled 
-                    if task != asyncio.current_task()
-                ]
-
-        # Crear y programar la tarea
-        task = asyncio.create_task(_scheduled_task())
-        self.scheduled.append((when, task))
-        
-        # Callback para limpieza cuando termine
-        def _cleanup_callback(fut: asyncio.Task) -> None:
-            """Limpiar tareas completadas"""
-            self.scheduled = [
-                (w, t) for (w, t) in self.scheduled if t is not fut
-            ]
-
-        task.add_done_callback(_cleanup_callback)
+        heapq.heappush(self._schedule_heap, (when, broadcast_id))
+        self._schedule_changed.set()
+        self._ensure_scheduler()
         
         logger.info(f"Broadcast scheduled for {when.isoformat()} with ID {broadcast_id}")
         return broadcast_id
 
-    def get_scheduled_broadcasts(self) -> List[Dict[str, Any]]:
+    async def start_scheduler(self) -> int:
+        """Cargar los broadcasts programados desde la base de datos y arrancar el timer"""
+        manager = await get_subscriber_manager()
+        jobs = await manager.get_scheduled_broadcast_jobs()
+        
+        self._schedule_heap = [
+            (job['scheduled_at'].replace(tzinfo=timezone.utc), job['broadcast_id'])
+            for job in jobs
+        ]
+        heapq.heapify(self._schedule_heap)
+        self._schedule_changed.set()
+        self._ensure_scheduler()
+        
+        logger.info(f"✅ Broadcast scheduler started with {len(self._schedule_heap)} pending broadcasts")
+        return len(self._schedule_heap)
+
+    def _ensure_scheduler(self) -> None:
+        """Arrancar el loop del scheduler si no está corriendo"""
+        if self._scheduler_task is None or self._scheduler_task.done():
+            self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+
+    async def _scheduler_loop(self) -> None:
+        """
+        Un único timer sobre un min-heap de (fecha, broadcast_id).
+        
+        Duerme hasta el próximo vencimiento o hasta que schedule/cancel
+        modifiquen el heap, en lugar de mantener una tarea dormida por broadcast.
+        """
+        while True:
+            self._schedule_changed.clear()
+            
+            if not self._schedule_heap:
+                await self._schedule_changed.wait()
+                continue
+            
+            when, broadcast_id = self._schedule_heap[0]
+            delay = (when - datetime.now(timezone.utc)).total_seconds()
+            
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._schedule_changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self._schedule_heap)
+            task = asyncio.create_task(self._run_scheduled(broadcast_id))
+            self._scheduled_runs.add(task)
+            task.add_done_callback(self._scheduled_runs.discard)
+
+    async def _run_scheduled(self, broadcast_id: str) -> None:
+        """Ejecutar un broadcast programado que llegó a su hora"""
+        try:
+            manager = await get_subscriber_manager()
+            
+            # El claim atómico evita ejecutar un broadcast cancelado o ya tomado
+            payload = await manager.claim_scheduled_broadcast_job(broadcast_id)
+            if payload is None:
+                logger.info(f"Scheduled broadcast {broadcast_id} was cancelled or already started")
+                return
+            
+            if not self._check_daily_limit():
+                await manager.finish_broadcast_job(broadcast_id, 'failed', error='Daily broadcast limit reached')
+                logger.warning(f"Skipping scheduled broadcast {broadcast_id}: daily limit reached")
+                return
+            
+            self._daily_broadcast_count += 1
+            self.metrics['broadcasts_today'] = self._daily_broadcast_count
+            
+            logger.info(f"Executing scheduled broadcast {broadcast_id}")
+            await self._execute_job(broadcast_id, payload, datetime.now(timezone.utc))
+            logger.info(f"Scheduled broadcast {broadcast_id} completed successfully")
+            
+        except Exception as e:
+            logger.error(f"Error executing scheduled broadcast {broadcast_id}: {e}")
+
+    async def get_scheduled_broadcasts(self) -> List[Dict[str, Any]]:
         """Obtener lista de broadcasts programados"""
+        manager = await get_subscriber_manager()
+        now = datetime.now(timezone.utc)
         scheduled_list = []
         
-        for scheduled_time, task in self.scheduled:
-            if not task.done():
-                scheduled_list.append({
-                    'scheduled_time': scheduled_time.isoformat(),
-                    'time_remaining': (scheduled_time - datetime.now(timezone.utc)).total_seconds(),
-                    'task_status': 'pending',
-                    'can_cancel': True
-                })
-        
-        return sorted(scheduled_list, key=lambda x: x['scheduled_time'])
+        for job in await manager.get_scheduled_broadcast_jobs():
+            scheduled_time = job['scheduled_at'].replace(tzinfo=timezone.utc)
+            scheduled_list.append({
+                'broadcast_id': job['broadcast_id'],
+                'scheduled_time': scheduled_time.isoformat(),
+                'time_remaining': (scheduled_time - now).total_seconds(),
+                'task_status': 'pending',
+                'can_cancel': True
+            })
+        
+        return scheduled_list
 
-    def cancel_scheduled_broadcast(self, broadcast_time: datetime) -> bool:
+    async def cancel_scheduled_broadcast(self, broadcast_id: str) -> bool:
         """Cancelar broadcast programado"""
-        for i, (scheduled_time, task) in enumerate(self.scheduled):
-            if scheduled_time == broadcast_time and not task.done():
-                task.cancel()
-                self.scheduled.pop(i)
-                logger.info(f"Cancelled scheduled broadcast for {broadcast_time.isoformat()}")
-                return True
+        manager = await get_subscriber_manager()
+        
+        if not await manager.cancel_scheduled_broadcast_job(broadcast_id):
+            return False
         
-        return False
+        self._schedule_heap = [entry for entry in self._schedule_heap if entry[1] != broadcast_id]
+        heapq.heapify(self._schedule_heap)
+        self._schedule_changed.set()
+        
+        logger.info(f"Cancelled scheduled broadcast {broadcast_id}")
+        return True
 
     def get_metrics(self) -> Dict[str, Any]:
         """Obtener métricas del sistema de broadcast"""
         return {
             **self.metrics,
-            'scheduled_count': len([t for _, t in self.scheduled if not t.done()]),
+            'scheduled_count': len(self._schedule_heap),
             'daily_broadcasts_used': self._daily_broadcast_count,
             'daily_broadcasts_remaining': SECURITY_CONFIG["max_broadcast_per_day"] - self._daily_broadcast_count,
-            'rate_limit_delay': RATE_LIMIT_CONFIG["broadcast_delay"]
+            'rate_limit_ceiling': RATE_LIMIT_CONFIG["global_rate"],
+            'current_rate': self.rate_limiter.current_rate,
+            'throttle_events': self.rate_limiter.throttle_events,
+            'max_in_flight': RATE_LIMIT_CONFIG["broadcast_concurrency"],
+            'dispatcher': self.dispatcher.get_metrics()
         }
 
     def _get_content_type(self, message_kwargs: Dict[str, Any]) -> str:
         """Determinar tipo de contenido del mensaje"""
-        if message_kwargs.get('photo'):
+        if message_kwargs.get('message_ids'):
+            return 'album_copy' if len(message_kwargs['message_ids']) > 1 else 'copy'
+        elif message_kwargs.get('photo'):
             return 'photo'
         elif message_kwargs.get('video'):
             return 'video'
@@ -373,7 +936,8 @@ class BroadcastManager:
         logger.info(f"Sending test broadcast to admin {admin_user_id}")
         
         try:
-            success = await self._send_message_with_retry(admin_user_id, **kwargs)
+            outcome, _ = await self._send_message_with_retry(admin_user_id, **kwargs)
+            success = outcome == SEND_OK
             
             return {
                 'test_completed': True,
@@ -393,15 +957,15 @@ class BroadcastManager:
             }
 
     async def cleanup_old_scheduled(self) -> int:
-        """Limpiar broadcasts programados completados o cancelados"""
-        initial_count = len(self.scheduled)
+        """Resincronizar el heap con la tabla, descartando entradas canceladas o ya ejecutadas"""
+        manager = await get_subscriber_manager()
+        pending = {job['broadcast_id'] for job in await manager.get_scheduled_broadcast_jobs()}
+        initial_count = len(self._schedule_heap)
         
-        self.scheduled = [
-            (time, task) for time, task in self.scheduled 
-            if not task.done()
-        ]
+        self._schedule_heap = [entry for entry in self._schedule_heap if entry[1] in pending]
+        heapq.heapify(self._schedule_heap)
         
-        cleaned_count = initial_count - len(self.scheduled)
+        cleaned_count = initial_count - len(self._schedule_heap)
         
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old scheduled broadcasts")
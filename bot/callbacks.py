@@ -902,7 +902,7 @@ async def handle_age_confirmation(query, user_id, data):
     """Confirmación de edad con persistencia mejorada"""
     try:
         manager = await get_subscriber_manager()
-        await manager.record_user(user_id, age_verified=True)
+        await manager.record_user(user_id, age_verified=True, durable=True)
         
         # Log de actividad de seguridad
         logger.info(f"Usuario {user_id} confirmó verificación de edad - IP: {query.from_user.id}")
@@ -989,7 +989,7 @@ async def handle_terms_acceptance(query, user_id, data):
     """Manejar aceptación de términos con timestamp"""
     try:
         manager = await get_subscriber_manager()
-        await manager.record_user(user_id, terms_accepted=True)
+        await manager.record_user(user_id, terms_accepted=True, durable=True)
         
         # Log de aceptación legal
         logger.info(f"Usuario {user_id} aceptó términos y condiciones - Timestamp: {datetime.now()}")
@@ -200,7 +200,13 @@ if not DATABASE_URL:
 DATABASE_CONFIG = {
     "min_size": int(os.getenv("DB_MIN_POOL_SIZE", 5)),
     "max_size": int(os.getenv("DB_MAX_POOL_SIZE", 20)),
-    "command_timeout": int(os.getenv("DB_COMMAND_TIMEOUT", 60))
+    "command_timeout": int(os.getenv("DB_COMMAND_TIMEOUT", 60)),
+    "audience_page_size": int(os.getenv("AUDIENCE_PAGE_SIZE", 1000)),  # Filas por página keyset
+    "audience_count_ttl": float(os.getenv("AUDIENCE_COUNT_TTL", 60)),  # Segundos de caché de conteos de audiencia
+    "user_status_cache_size": int(os.getenv("USER_STATUS_CACHE_SIZE", 10000)),  # Usuarios en la caché LRU de estado
+    "user_status_cache_ttl": float(os.getenv("USER_STATUS_CACHE_TTL", 300)),  # Segundos de vida de cada estado en caché
+    "user_write_flush_ms": int(os.getenv("USER_WRITE_FLUSH_MS", 500)),  # Intervalo de volcado de record_user en buffer
+    "user_write_max_pending": int(os.getenv("USER_WRITE_MAX_PENDING", 500))  # Usuarios en buffer que fuerzan un volcado
 }
 
 # Webhook settings for Railway deployment
@@ -212,12 +218,69 @@ if not WEBHOOK_URL:
 
 # Reminder settings
 REMINDER_DAYS_BEFORE_EXPIRY = int(os.getenv("REMINDER_DAYS_BEFORE_EXPIRY", 3))
+REMINDER_CONFIG = {
+    "stages": sorted(
+        {int(days) for days in os.getenv("REMINDER_STAGES", f"7,{REMINDER_DAYS_BEFORE_EXPIRY},1").split(",") if days.strip().isdigit()},
+        reverse=True
+    ),  # Días antes de expirar de cada etapa de recordatorio
+    "spread_seconds": int(os.getenv("REMINDER_SPREAD_SECONDS", 6 * 3600)),  # Ventana en la que se reparten los envíos de cada etapa
+    "retry_delay": int(os.getenv("REMINDER_RETRY_DELAY", 900)),  # Segundos antes de reintentar un recordatorio que falló
+    "claim_timeout": int(os.getenv("REMINDER_CLAIM_TIMEOUT", 900))  # Segundos antes de re-reclamar un recordatorio abandonado
+}
+
+# Invite link pool settings
+INVITE_POOL_CONFIG = {
+    "size": int(os.getenv("INVITE_POOL_SIZE", 5)),  # Enlaces listos por canal en cada worker del webhook (0 desactiva el pool)
+    "link_ttl": int(os.getenv("INVITE_LINK_TTL", 86400)),  # Validez de cada enlace pre-generado (segundos)
+    "min_remaining": int(os.getenv("INVITE_MIN_REMAINING", 3600)),  # Validez mínima para entregar un enlace
+    "refill_interval": float(os.getenv("INVITE_POOL_REFILL_INTERVAL", 60))  # Segundos entre revisiones del pool
+}
+
+# Expiry sweep settings
+EXPIRY_CONFIG = {
+    "batch_size": int(os.getenv("EXPIRY_BATCH_SIZE", 100)),  # Suscripciones reclamadas por lote
+    "revoke_concurrency": int(os.getenv("EXPIRY_REVOKE_CONCURRENCY", 10)),  # Expulsiones de canal en paralelo
+    "claim_timeout": int(os.getenv("EXPIRY_CLAIM_TIMEOUT", 900)),  # Segundos antes de re-reclamar un lote abandonado
+    "revoke_retry_base": int(os.getenv("EXPIRY_REVOKE_RETRY_BASE", 300)),  # Espera (s) tras el primer fallo transitorio al revocar
+    "revoke_retry_max": int(os.getenv("EXPIRY_REVOKE_RETRY_MAX", 21600)),  # Espera máxima (s) entre reintentos de revocación
+    "max_revoke_attempts": int(os.getenv("EXPIRY_MAX_REVOKE_ATTEMPTS", 8)),  # Intentos antes de marcar la revocación como fallida
+    "reload_interval": int(os.getenv("EXPIRY_RELOAD_INTERVAL", 3600)),  # Horizonte (s) de vencimientos cargados en el heap
+    "load_limit": int(os.getenv("EXPIRY_LOAD_LIMIT", 1000)),  # Máximo de vencimientos por carga
+    "error_backoff": float(os.getenv("EXPIRY_ERROR_BACKOFF", 60)),  # Espera tras un error del planificador
+    "min_sweep_interval": float(os.getenv("EXPIRY_MIN_SWEEP_INTERVAL", 5))  # Separación mínima entre recargas y barridos sin progreso
+}
 
 # Rate limiting settings
 RATE_LIMIT_CONFIG = {
-    "invite_delay": float(os.getenv("INVITE_DELAY", 0.1)),  # Reduced from 0.5
-    "broadcast_delay": float(os.getenv("BROADCAST_DELAY", 0.05)),
-    "max_retries": int(os.getenv("MAX_RETRIES", 3))
+    "max_retries": int(os.getenv("MAX_RETRIES", 3)),
+    "global_rate": float(os.getenv("GLOBAL_RATE", os.getenv("BROADCAST_RATE", 25))),  # msg/s de todo el proceso (Telegram ~30/s)
+    "global_min_rate": float(os.getenv("GLOBAL_MIN_RATE", 1)),  # Piso de la tasa adaptativa
+    "rate_increase_step": float(os.getenv("RATE_INCREASE_STEP", 1)),  # msg/s recuperados por segundo sin RetryAfter
+    "rate_decrease_factor": float(os.getenv("RATE_DECREASE_FACTOR", 0.5)),  # Recorte de tasa por RetryAfter
+    "broadcast_concurrency": int(os.getenv("BROADCAST_CONCURRENCY", 20)),  # Requests en vuelo
+    "per_chat_interval": float(os.getenv("PER_CHAT_INTERVAL", 1.0)),  # Segundos entre mensajes al mismo chat
+    "coordination_interval": float(os.getenv("DISPATCHER_COORDINATION_INTERVAL", 1.0)),  # Segundos entre sincronizaciones de cuota
+    "lease_ttl": float(os.getenv("DISPATCHER_LEASE_TTL", 5)),  # Segundos sin latido para dar un proceso por muerto
+    "expected_processes": int(os.getenv("DISPATCHER_PROCESSES", 3))  # Reparto de GLOBAL_RATE si la base no responde (bot + workers web)
+}
+
+# Broadcast engine settings
+BROADCAST_CONFIG = {
+    "checkpoint_every": int(os.getenv("BROADCAST_CHECKPOINT_EVERY", 200)),  # Mensajes entre checkpoints del job
+    "blocked_flush_size": int(os.getenv("BROADCAST_BLOCKED_FLUSH_SIZE", 500)),  # Usuarios bloqueados por UPDATE
+    "ledger_flush_size": int(os.getenv("BROADCAST_LEDGER_FLUSH_SIZE", 500)),  # Filas de broadcast_deliveries por COPY
+    "progress_interval": float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))  # Segundos entre eventos de progreso
+}
+
+# Activity log writer settings
+ACTIVITY_LOG_CONFIG = {
+    "batch_size": int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", 500)),  # Eventos por INSERT
+    "flush_interval": float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", 1.0)),  # Segundos de acumulación antes de escribir
+    "max_pending": int(os.getenv("ACTIVITY_LOG_MAX_PENDING", 10000)),  # Tamaño máximo de la cola en memoria
+    "overflow_policy": os.getenv("ACTIVITY_LOG_OVERFLOW_POLICY", "drop").lower(),  # 'drop' descarta, 'block' espera sitio
+    "retention_months": int(os.getenv("ACTIVITY_LOG_RETENTION_MONTHS", 6)),  # Meses completos conservados además del actual
+    "premake_months": int(os.getenv("ACTIVITY_LOG_PREMAKE_MONTHS", 2)),  # Particiones futuras creadas por adelantado
+    "maintenance_interval": float(os.getenv("ACTIVITY_LOG_MAINTENANCE_INTERVAL", 3600))  # Segundos entre mantenimientos
 }
 
 # Security settings
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+DESPACHADOR CENTRAL DE LLAMADAS A TELEGRAM
+==========================================
+Un único presupuesto de tasa global, repartido con prioridad estricta entre
+carriles: transaccional > soporte > recordatorios > marketing. Un broadcast
+grande nunca retrasa la invitación de un cliente.
+
+El bot y los workers del webhook comparten GLOBAL_RATE mediante la tabla
+dispatcher_leases: cada proceso publica su carril pendiente más prioritario
+y recibe una cuota; los procesos cuyo trabajo es menos prioritario que el de
+otro ceden el presupuesto, y un RetryAfter pausa a todos.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import socket
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+
+from bot.config import RATE_LIMIT_CONFIG
+from bot.rate_limiter import AdaptiveRateController
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(IntEnum):
+    """Carriles de salida; un valor menor tiene más prioridad"""
+    TRANSACTIONAL = 0  # Confirmaciones de pago, invitaciones a canales
+    SUPPORT = 1        # Respuestas de soporte y avisos a administradores
+    REMINDER = 2       # Recordatorios de renovación y avisos de expiración
+    MARKETING = 3      # Broadcasts
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Segundos de espera pedidos por Telegram (int o timedelta según la versión)"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class OutboundDispatcher:
+    """
+    Reparte los tokens del controlador de tasa con prioridad estricta.
+
+    Cada llamada espera su turno en un heap (carril, orden de llegada); un
+    único repartidor consume un token y se lo entrega al primer pendiente
+    del carril más prioritario en ese momento.
+    """
+
+    def __init__(self, rate_limiter: AdaptiveRateController):
+        self.rate_limiter = rate_limiter
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._granter: Optional[asyncio.Task] = None
+        self._stats: Dict[Lane, Dict[str, float]] = {
+            lane: {'queued': 0, 'dispatched': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for lane in Lane
+        }
+        # Coordinación entre procesos (ver start_coordination)
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._pool = None
+        self._coordination_task: Optional[asyncio.Task] = None
+        self._demand_changed = asyncio.Event()
+        self._published_lane: Optional[int] = None
+        self.live_processes = 1
+
+    async def call(self, lane: Lane, method: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Esperar turno en el carril y ejecutar `method(*args, **kwargs)`.
+
+        Un RetryAfter frena el presupuesto global para todos los carriles y se
+        relanza para que quien llama decida si reintenta.
+        """
+        await self._acquire(lane)
+
+        try:
+            result = await method(*args, **kwargs)
+        except RetryAfter as e:
+            self.rate_limiter.on_throttle(retry_after_seconds(e))
+            raise
+
+        self.rate_limiter.on_success()
+        return result
+
+    async def _acquire(self, lane: Lane) -> None:
+        """Encolar y esperar a que el repartidor entregue un token a este carril"""
+        stats = self._stats[lane]
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(lane), next(self._sequence), future))
+        stats['queued'] += 1
+
+        # Un carril más prioritario que el publicado se anuncia sin esperar al próximo latido
+        if self._published_lane is None or int(lane) < self._published_lane:
+            self._demand_changed.set()
+
+        if self._granter is None or self._granter.done():
+            self._granter = asyncio.create_task(self._grant_loop())
+
+        start = time.monotonic()
+        try:
+            await future
+        finally:
+            stats['queued'] -= 1
+
+        waited = time.monotonic() - start
+        stats['dispatched'] += 1
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+
+    async def _grant_loop(self) -> None:
+        """Entregar tokens en orden de prioridad mientras haya pendientes"""
+        while self._waiters:
+            await self.rate_limiter.acquire()
+
+            # Descartar esperas canceladas; el token va al primer pendiente vivo
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    def _top_lane(self) -> Optional[int]:
+        """Carril pendiente más prioritario de este proceso (None si no hay nada en cola)"""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        return self._waiters[0][0] if self._waiters else None
+
+    def start_coordination(self, pool) -> None:
+        """Compartir GLOBAL_RATE con los demás procesos a través de dispatcher_leases"""
+        self._pool = pool
+        # Hasta el primer latido, reparto estático entre los procesos esperados
+        self.rate_limiter.set_max_rate(
+            RATE_LIMIT_CONFIG["global_rate"] / max(1, RATE_LIMIT_CONFIG["expected_processes"])
+        )
+        if self._coordination_task is None or self._coordination_task.done():
+            self._coordination_task = asyncio.create_task(self._coordination_loop())
+
+    async def _coordination_loop(self) -> None:
+        """Publicar la demanda de este proceso y ajustar su cuota"""
+        while True:
+            self._demand_changed.clear()
+            try:
+                await self._sync_budget()
+            except Exception as e:
+                logger.warning(f"⚠️ Rate budget sync failed, using static share: {e}")
+                self.rate_limiter.set_max_rate(
+                    RATE_LIMIT_CONFIG["global_rate"] / max(1, RATE_LIMIT_CONFIG["expected_processes"])
+                )
+
+            try:
+                await asyncio.wait_for(self._demand_changed.wait(), timeout=RATE_LIMIT_CONFIG["coordination_interval"])
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sync_budget(self) -> None:
+        """
+        Latido en dispatcher_leases y cálculo de la cuota de este proceso.
+
+        Los procesos sin cola o con trabajo menos prioritario que el de otro
+        se quedan con `global_min_rate`; el resto del presupuesto se reparte
+        entre los que tienen pendiente el carril más prioritario.
+        """
+        top_lane = self._top_lane()
+        async with self._pool.acquire() as conn:
+            # La consulta no ve la fila recién escrita (mismo snapshot): los demás procesos se leen aparte
+            others = await conn.fetch(
+                """
+                WITH heartbeat AS (
+                    INSERT INTO dispatcher_leases (process_id, top_lane, throttled_until, heartbeat_at)
+                    VALUES ($1, $2, NOW() + make_interval(secs => $3), NOW())
+                    ON CONFLICT (process_id) DO UPDATE SET
+                        top_lane = EXCLUDED.top_lane,
+                        throttled_until = EXCLUDED.throttled_until,
+                        heartbeat_at = EXCLUDED.heartbeat_at
+                ), expired AS (
+                    DELETE FROM dispatcher_leases
+                    WHERE heartbeat_at < NOW() - make_interval(secs => $4)
+                )
+                SELECT top_lane, EXTRACT(EPOCH FROM (throttled_until - NOW()))::float8 AS pause_left
+                FROM dispatcher_leases
+                WHERE process_id <> $1
+                AND heartbeat_at >= NOW() - make_interval(secs => $4)
+                """,
+                self.process_id, top_lane, self.rate_limiter.pause_remaining, RATE_LIMIT_CONFIG["lease_ttl"]
+            )
+        self._published_lane = top_lane
+
+        # Un RetryAfter en otro proceso es el mismo límite del bot: pausar también aquí
+        pause_left = max((row['pause_left'] or 0.0 for row in others), default=0.0)
+        if pause_left > self.rate_limiter.pause_remaining + 0.5:
+            self.rate_limiter.on_throttle(pause_left)
+
+        lanes = [row['top_lane'] for row in others if row['top_lane'] is not None]
+        if top_lane is not None:
+            lanes.append(top_lane)
+
+        global_rate = RATE_LIMIT_CONFIG["global_rate"]
+        min_rate = RATE_LIMIT_CONFIG["global_min_rate"]
+        processes = len(others) + 1
+        leaders = lanes.count(min(lanes)) if lanes else 0
+
+        if top_lane is None or top_lane > min(lanes):
+            share = min_rate
+        else:
+            share = (global_rate - min_rate * (processes - leaders)) / leaders
+
+        self.live_processes = processes
+        self.rate_limiter.set_max_rate(share)
+
+    async def stop_coordination(self) -> None:
+        """Detener los latidos y liberar la cuota de este proceso (antes de cerrar el pool)"""
+        if self._coordination_task is not None:
+            self._coordination_task.cancel()
+            try:
+                await self._coordination_task
+            except asyncio.CancelledError:
+                pass
+            self._coordination_task = None
+
+        if self._pool is not None:
+            try:
+                async with self._pool.acquire() as conn:
+                    await conn.execute("DELETE FROM dispatcher_leases WHERE process_id = $1", self.process_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not release rate budget lease: {e}")
+            self._pool = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Profundidad de cola y tiempos de espera por carril"""
+        lanes = {}
+        for lane, stats in self._stats.items():
+            dispatched = stats['dispatched']
+            lanes[lane.name.lower()] = {
+                'queue_depth': int(stats['queued']),
+                'dispatched': int(dispatched),
+                'avg_wait_seconds': stats['wait_total'] / dispatched if dispatched else 0.0,
+                'max_wait_seconds': stats['wait_max']
+            }
+
+        return {
+            'current_rate': self.rate_limiter.current_rate,
+            'rate_share': self.rate_limiter.max_rate,
+            'live_processes': self.live_processes,
+            'throttle_events': self.rate_limiter.throttle_events,
+            'lanes': lanes
+        }
+
+
+# Instancia global singleton
+_dispatcher_instance: Optional[OutboundDispatcher] = None
+
+
+def get_dispatcher() -> OutboundDispatcher:
+    """Obtener el despachador del proceso (coordinado con los demás vía start_coordination)"""
+    global _dispatcher_instance
+
+    if _dispatcher_instance is None:
+        _dispatcher_instance = OutboundDispatcher(
+            AdaptiveRateController(
+                RATE_LIMIT_CONFIG["global_rate"],
+                min_rate=RATE_LIMIT_CONFIG["global_min_rate"],
+                increase_step=RATE_LIMIT_CONFIG["rate_increase_step"],
+                decrease_factor=RATE_LIMIT_CONFIG["rate_decrease_factor"]
+            )
+        )
+        logger.info("✅ OutboundDispatcher singleton initialized")
+
+    return _dispatcher_instance
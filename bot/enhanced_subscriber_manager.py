@@ -7,11 +7,15 @@ Sistema completo de gestión automática de canales con mejoras de rendimiento y
 
 import asyncio
 import backoff
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional, Union
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 import logging
 import hashlib
 import hmac
+import json
+import math
+import time
 
 try:
     import asyncpg
@@ -23,14 +27,25 @@ except ImportError as exc:
 from bot.config import (
     CHANNELS, PLANS, BOT_TOKEN, DATABASE_URL, ADMIN_IDS, 
     get_plan_channels, get_plan_channel_names, REMINDER_DAYS_BEFORE_EXPIRY,
-    DATABASE_CONFIG, RATE_LIMIT_CONFIG, SECURITY_CONFIG
+    DATABASE_CONFIG, RATE_LIMIT_CONFIG, SECURITY_CONFIG, EXPIRY_CONFIG, REMINDER_CONFIG,
+    ACTIVITY_LOG_CONFIG
 )
 import sys
 from telegram import Bot
-from telegram.error import TelegramError, RetryAfter
+from telegram.error import TelegramError
+from telegram.helpers import escape_markdown
+
+from bot.dispatcher import Lane, get_dispatcher
+from bot.telegram_errors import ErrorKind, classify_error, is_permanent_error
+from bot.invite_pool import InvitePool
+from bot.subscription_scheduler import SubscriptionScheduler, publish_expiry_change
+from bot.activity_log import ActivityLogWriter, MAINTENANCE_LOCK_KEY, ensure_partitions as ensure_activity_partitions
 
 logger = logging.getLogger(__name__)
 
+# Canal LISTEN/NOTIFY con el user_id cuyo estado cambió (bot y webhook)
+USER_STATUS_CHANNEL = 'user_status_changed'
+
 class EnhancedSubscriberManager:
     """Gestor unificado de suscripciones con gestión automática de canales y mejoras de seguridad"""
     
@@ -46,6 +61,28 @@ class EnhancedSubscriberManager:
             'payments_processed': 0,
             'reminders_sent': 0
         }
+        # Conteos de audiencia por combinación de filtros: clave -> (expira_en, conteo)
+        self._audience_count_cache: Dict[tuple, tuple] = {}
+        # Caché LRU de get_user_status: user_id -> (expira_en, estado)
+        self._status_cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._status_listener = None
+        # Generación de invalidaciones: una lectura no se cachea si su usuario se
+        # invalidó mientras leía (user_id -> generación de su última invalidación;
+        # al podar o al perder el listener, toda lectura anterior a `_status_floor` se descarta)
+        self._status_generation = 0
+        self._status_invalidated: Dict[int, int] = {}
+        self._status_floor = 0
+        # Escrituras de record_user en buffer: user_id -> campos a actualizar
+        self._user_writes: Dict[int, Dict] = {}
+        self._user_writes_full = asyncio.Event()
+        self._user_flush_lock = asyncio.Lock()
+        self._user_write_task: Optional[asyncio.Task] = None
+        # Enlaces de invitación de un solo uso pre-generados por canal (los arranca solo el webhook)
+        self.invite_pool = InvitePool(self, list(CHANNELS.values()))
+        # Eventos de activity_logs escritos en lote fuera de la ruta de cada petición
+        self.activity_log = ActivityLogWriter(self)
+        # Expiraciones y recordatorios a su hora exacta (se arranca con las tareas de automatización)
+        self.scheduler = SubscriptionScheduler(self)
         
     async def initialize(self):
         """Inicializar pool de conexiones optimizado y tablas"""
@@ -57,6 +94,10 @@ class EnhancedSubscriberManager:
                 command_timeout=DATABASE_CONFIG["command_timeout"]
             )
             await self._ensure_tables()
+            get_dispatcher().start_coordination(self.pool)
+            asyncio.create_task(self._start_status_listener())
+            self._user_write_task = asyncio.create_task(self._user_write_loop())
+            self.activity_log.start()
             logger.info("✅ Enhanced SubscriberManager initialized with optimized pool")
         except Exception as exc:
             logger.error(f"❌ Database connection failed: {exc}")
@@ -83,12 +124,60 @@ class EnhancedSubscriberManager:
                     reminder_sent BOOLEAN DEFAULT FALSE,
                     payment_amount DECIMAL(10,2),
                     payment_currency TEXT DEFAULT 'USD',
+                    access_state TEXT NOT NULL DEFAULT 'active',
+                    revoked_at TIMESTAMP NULL,
+                    revoke_claimed_at TIMESTAMP NULL,
+                    revoke_attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP NULL,
                     created_at TIMESTAMP DEFAULT NOW(),
                     updated_at TIMESTAMP DEFAULT NOW()
                 )
                 """
             )
             
+            # Estado de revocación ('active' | 'revoking' | 'revoked' | 'revoke_failed');
+            # en bases existentes se rellena una vez a partir de los logs de revocación
+            has_access_state = await conn.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'subscribers' AND column_name = 'access_state'
+                )
+                """
+            )
+            if not has_access_state:
+                await conn.execute(
+                    """
+                    ALTER TABLE subscribers
+                        ADD COLUMN access_state TEXT NOT NULL DEFAULT 'active',
+                        ADD COLUMN revoked_at TIMESTAMP NULL,
+                        ADD COLUMN revoke_claimed_at TIMESTAMP NULL
+                    """
+                )
+                has_activity_logs = await conn.fetchval("SELECT to_regclass('activity_logs') IS NOT NULL")
+                if has_activity_logs:
+                    await conn.execute(
+                        """
+                        UPDATE subscribers s SET access_state = 'revoked', revoked_at = al.last_revoked
+                        FROM (
+                            SELECT user_id, MAX(timestamp) AS last_revoked
+                            FROM activity_logs
+                            WHERE action = 'access_revoked'
+                            GROUP BY user_id
+                        ) al
+                        WHERE al.user_id = s.user_id AND al.last_revoked > s.expires_at
+                        """
+                    )
+            
+            # Reintentos de revocación con espera creciente
+            await conn.execute(
+                """
+                ALTER TABLE subscribers
+                    ADD COLUMN IF NOT EXISTS revoke_attempts INTEGER NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP NULL
+                """
+            )
+            
             # Tabla de usuarios mejorada
             await conn.execute(
                 """
@@ -110,6 +199,68 @@ class EnhancedSubscriberManager:
                 """
             )
             
+            # Estado de suscripción almacenado para segmentar con índices
+            # ('never' | 'active' | 'churned'); se rellena una vez al crear la columna
+            has_status_column = await conn.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'users' AND column_name = 'subscription_status'
+                )
+                """
+            )
+            if not has_status_column:
+                await conn.execute(
+                    "ALTER TABLE users ADD COLUMN subscription_status TEXT NOT NULL DEFAULT 'never'"
+                )
+                await conn.execute(
+                    """
+                    UPDATE users u SET subscription_status =
+                        CASE WHEN s.expires_at > NOW() THEN 'active' ELSE 'churned' END
+                    FROM subscribers s
+                    WHERE s.user_id = u.user_id
+                    """
+                )
+            
+            # Recordatorios de renovación por etapa (7d/3d/1d...), uno por fila
+            has_reminders_table = await conn.fetchval("SELECT to_regclass('subscription_reminders') IS NOT NULL")
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS subscription_reminders (
+                    user_id BIGINT NOT NULL,
+                    stage INTEGER NOT NULL,
+                    due_at TIMESTAMP NOT NULL,
+                    sent_at TIMESTAMP NULL,
+                    claimed_at TIMESTAMP NULL,
+                    skipped BOOLEAN NOT NULL DEFAULT FALSE,
+                    PRIMARY KEY (user_id, stage)
+                )
+                """
+            )
+            await conn.execute(
+                """
+                ALTER TABLE subscription_reminders
+                    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP NULL,
+                    ADD COLUMN IF NOT EXISTS skipped BOOLEAN NOT NULL DEFAULT FALSE
+                """
+            )
+            if not has_reminders_table:
+                # Programar las etapas futuras de las suscripciones vigentes; el
+                # recordatorio único anterior cubre las etapas más lejanas
+                await conn.execute(
+                    """
+                    INSERT INTO subscription_reminders (user_id, stage, due_at)
+                    SELECT s.user_id, st.days,
+                           s.expires_at - make_interval(days => st.days)
+                               + make_interval(secs => mod(s.user_id::numeric * 2654435761, $2)::float8)
+                    FROM subscribers s CROSS JOIN unnest($1::int[]) AS st(days)
+                    WHERE s.expires_at - make_interval(days => st.days) > NOW()
+                    AND (s.reminder_sent IS NOT TRUE OR st.days < $3)
+                    ON CONFLICT DO NOTHING
+                    """,
+                    REMINDER_CONFIG["stages"], max(REMINDER_CONFIG["spread_seconds"], 1), REMINDER_DAYS_BEFORE_EXPIRY
+                )
+            
             # Tabla de acceso a canales mejorada
             await conn.execute(
                 """
@@ -127,18 +278,76 @@ class EnhancedSubscriberManager:
                 """
             )
             
-            # Tabla de logs de actividad mejorada
+            # Tabla de logs de actividad particionada por mes; una tabla antigua sin
+            # particionar se migra una vez copiando solo lo que cubre la retención
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", MAINTENANCE_LOCK_KEY)
+                
+                is_legacy_table = await conn.fetchval(
+                    """
+                    SELECT to_regclass('activity_logs') IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('activity_logs')
+                    )
+                    """
+                )
+                if is_legacy_table:
+                    await conn.execute("ALTER TABLE activity_logs RENAME TO activity_logs_legacy")
+                    await conn.execute("ALTER INDEX IF EXISTS activity_logs_pkey RENAME TO activity_logs_legacy_pkey")
+                    await conn.execute("ALTER SEQUENCE IF EXISTS activity_logs_id_seq RENAME TO activity_logs_legacy_id_seq")
+                
+                await conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS activity_logs (
+                        id BIGSERIAL,
+                        user_id BIGINT,
+                        action TEXT NOT NULL,
+                        details JSONB,
+                        ip_address TEXT,
+                        user_agent TEXT,
+                        timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
+                        PRIMARY KEY (id, timestamp),
+                        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+                    ) PARTITION BY RANGE (timestamp)
+                    """
+                )
+                
+                retention_months = ACTIVITY_LOG_CONFIG["retention_months"]
+                await ensure_activity_partitions(conn, months_back=retention_months if is_legacy_table else 0)
+                
+                if is_legacy_table:
+                    await conn.execute(
+                        """
+                        INSERT INTO activity_logs (user_id, action, details, ip_address, user_agent, timestamp)
+                        SELECT user_id, action, details, ip_address, user_agent, timestamp
+                        FROM activity_logs_legacy
+                        WHERE timestamp >= date_trunc('month', NOW()) - make_interval(months => $1)
+                        """,
+                        retention_months
+                    )
+                    await conn.execute("DROP TABLE activity_logs_legacy")
+                    logger.info("✅ activity_logs migrated to monthly partitions")
+            
+            # Resúmenes diarios por acción para los paneles de administración
             await conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS activity_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
+                CREATE TABLE IF NOT EXISTS activity_daily_rollups (
+                    day DATE NOT NULL,
                     action TEXT NOT NULL,
-                    details JSONB,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    timestamp TIMESTAMP DEFAULT NOW(),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE SET NULL
+                    events INTEGER NOT NULL,
+                    unique_users INTEGER NOT NULL,
+                    PRIMARY KEY (day, action)
+                )
+                """
+            )
+            
+            # Latidos del despachador de cada proceso para repartir GLOBAL_RATE (estado efímero)
+            await conn.execute(
+                """
+                CREATE UNLOGGED TABLE IF NOT EXISTS dispatcher_leases (
+                    process_id TEXT PRIMARY KEY,
+                    top_lane SMALLINT NULL,
+                    throttled_until TIMESTAMPTZ NOT NULL,
+                    heartbeat_at TIMESTAMPTZ NOT NULL
                 )
                 """
             )
@@ -158,19 +367,80 @@ class EnhancedSubscriberManager:
                 """
             )
             
+            # Tabla de jobs de broadcast (checkpoints para reanudar tras reinicios)
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    broadcast_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    payload JSONB NOT NULL,
+                    cursor_user_id BIGINT NULL,
+                    processed INTEGER DEFAULT 0,
+                    messages_sent INTEGER DEFAULT 0,
+                    messages_failed INTEGER DEFAULT 0,
+                    blocked_users INTEGER DEFAULT 0,
+                    error TEXT NULL,
+                    scheduled_at TIMESTAMP NULL,
+                    started_at TIMESTAMP DEFAULT NOW(),
+                    updated_at TIMESTAMP DEFAULT NOW(),
+                    completed_at TIMESTAMP NULL
+                )
+                """
+            )
+            await conn.execute(
+                "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMP NULL"
+            )
+            
+            # Registro por destinatario de cada broadcast (escrito con COPY)
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    broadcast_id TEXT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    status TEXT NOT NULL,
+                    error_class TEXT NULL,
+                    latency_ms INTEGER,
+                    delivered_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (broadcast_id, user_id)
+                )
+                """
+            )
+            
+            # Caché de file_ids de Telegram por hash de contenido
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    content_hash TEXT NOT NULL,
+                    media_type TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    source TEXT,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    last_used_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (content_hash, media_type)
+                )
+                """
+            )
+            
             # Crear índices optimizados
             indexes = [
                 "CREATE INDEX IF NOT EXISTS idx_subscribers_expires_at ON subscribers (expires_at)",
                 "CREATE INDEX IF NOT EXISTS idx_subscribers_reminder ON subscribers (expires_at, reminder_sent) WHERE reminder_sent = FALSE",
                 "CREATE INDEX IF NOT EXISTS idx_subscribers_transaction ON subscribers (transaction_id) WHERE transaction_id IS NOT NULL",
+                "CREATE INDEX IF NOT EXISTS idx_subscribers_pending_revoke ON subscribers (expires_at) WHERE revoked_at IS NULL",
+                "CREATE INDEX IF NOT EXISTS idx_subscription_reminders_due ON subscription_reminders (stage, due_at) WHERE sent_at IS NULL",
                 "CREATE INDEX IF NOT EXISTS idx_users_language ON users (language)",
                 "CREATE INDEX IF NOT EXISTS idx_users_age_verified ON users (age_verified) WHERE age_verified = TRUE",
                 "CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)",
+                "CREATE INDEX IF NOT EXISTS idx_users_reachable ON users (user_id) WHERE is_blocked IS NOT TRUE",
+                "CREATE INDEX IF NOT EXISTS idx_users_segment ON users (subscription_status, language, is_blocked, user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_channel_access_user ON channel_access (user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_channel_access_active ON channel_access (user_id, channel_id) WHERE revoked_at IS NULL",
                 "CREATE INDEX IF NOT EXISTS idx_activity_logs_user_action ON activity_logs (user_id, action)",
-                "CREATE INDEX IF NOT EXISTS idx_activity_logs_timestamp ON activity_logs (timestamp)",
-                "CREATE INDEX IF NOT EXISTS idx_metrics_name_date ON metrics (metric_name, metric_date)"
+                "CREATE INDEX IF NOT EXISTS idx_activity_logs_timestamp ON activity_logs USING BRIN (timestamp)",
+                "CREATE INDEX IF NOT EXISTS idx_metrics_name_date ON metrics (metric_name, metric_date)",
+                "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_running ON broadcast_jobs (started_at) WHERE status = 'running'",
+                "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_scheduled ON broadcast_jobs (scheduled_at) WHERE status = 'scheduled'",
+                "CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_failed ON broadcast_deliveries (broadcast_id, user_id) WHERE status = 'failed'"
             ]
             
             for index_sql in indexes:
@@ -180,13 +450,14 @@ class EnhancedSubscriberManager:
 
     @backoff.on_exception(
         backoff.expo,
-        (TelegramError, RetryAfter),
+        TelegramError,
         max_tries=RATE_LIMIT_CONFIG["max_retries"],
+        giveup=is_permanent_error,
         base=2
     )
-    async def _send_with_retry(self, method, *args, **kwargs):
-        """Enviar mensaje con reintentos automáticos"""
-        return await method(*args, **kwargs)
+    async def _send_with_retry(self, method, *args, lane: Lane = Lane.TRANSACTIONAL, **kwargs):
+        """Enviar mensaje a través del despachador global; solo se reintentan errores transitorios"""
+        return await get_dispatcher().call(lane, method, *args, **kwargs)
 
     async def add_subscriber(self, user_id: int, plan_name: str, transaction_id: str = None, 
                            payment_amount: float = None, payment_currency: str = "USD") -> bool:
@@ -212,51 +483,77 @@ class EnhancedSubscriberManager:
                 payment_amount = float(plan_info["price"].replace("$", ""))
 
             duration_days = plan_info["duration_days"]
-            start_date = datetime.now(timezone.utc)
+            # UTC sin zona, como las columnas TIMESTAMP que se comparan y escriben abajo
+            start_date = datetime.now(timezone.utc).replace(tzinfo=None)
             expiry_date = start_date + timedelta(days=duration_days)
 
+            # Fila de users primero: channel_access y subscription_status dependen de ella
+            await self.record_user(user_id, durable=True)
+            
             async with self.pool.acquire() as conn:
-                # Verificar si ya existe suscripción activa
-                existing = await conn.fetchrow(
-                    "SELECT expires_at FROM subscribers WHERE user_id = $1", user_id
-                )
-                
-                if existing and existing['expires_at'] > start_date:
-                    logger.warning(f"⚠️ User {user_id} already has active subscription")
-                    # Extender suscripción existente en lugar de reemplazar
-                    new_expiry = existing['expires_at'] + timedelta(days=duration_days)
-                    await conn.execute(
-                        """
-                        UPDATE subscribers SET 
-                            expires_at = $1, 
-                            reminder_sent = FALSE,
-                            updated_at = NOW()
-                        WHERE user_id = $2
-                        """,
-                        new_expiry, user_id
+                async with conn.transaction():
+                    # Verificar si ya existe suscripción activa (bloqueando la fila ante pagos simultáneos)
+                    existing = await conn.fetchrow(
+                        "SELECT expires_at FROM subscribers WHERE user_id = $1 FOR UPDATE", user_id
                     )
-                    expiry_date = new_expiry
-                else:
-                    # Insertar nueva suscripción
+                
+                    if existing and existing['expires_at'] > start_date:
+                        logger.warning(f"⚠️ User {user_id} already has active subscription")
+                        # Extender suscripción existente en lugar de reemplazar
+                        new_expiry = existing['expires_at'] + timedelta(days=duration_days)
+                        await conn.execute(
+                            """
+                            UPDATE subscribers SET 
+                                expires_at = $1, 
+                                reminder_sent = FALSE,
+                                updated_at = NOW()
+                            WHERE user_id = $2
+                            """,
+                            new_expiry, user_id
+                        )
+                        expiry_date = new_expiry
+                    else:
+                        # Insertar nueva suscripción
+                        await conn.execute(
+                            """
+                            INSERT INTO subscribers (user_id, plan, start_date, expires_at, transaction_id, 
+                                                   payment_amount, payment_currency, reminder_sent)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7, FALSE)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                plan=EXCLUDED.plan,
+                                start_date=EXCLUDED.start_date,
+                                expires_at=EXCLUDED.expires_at,
+                                transaction_id=EXCLUDED.transaction_id,
+                                payment_amount=EXCLUDED.payment_amount,
+                                payment_currency=EXCLUDED.payment_currency,
+                                reminder_sent=FALSE,
+                                access_state='active',
+                                revoked_at=NULL,
+                                revoke_claimed_at=NULL,
+                                revoke_attempts=0,
+                                next_attempt_at=NULL,
+                                updated_at=NOW()
+                            """,
+                            user_id, plan_name, start_date, expiry_date, transaction_id,
+                            payment_amount, payment_currency
+                        )
+                
+                    # Estado del segmento en la misma transacción: si el acceso o el
+                    # mensaje fallan después, el usuario ya figura como activo
                     await conn.execute(
                         """
-                        INSERT INTO subscribers (user_id, plan, start_date, expires_at, transaction_id, 
-                                               payment_amount, payment_currency, reminder_sent)
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, FALSE)
-                        ON CONFLICT (user_id) DO UPDATE SET
-                            plan=EXCLUDED.plan,
-                            start_date=EXCLUDED.start_date,
-                            expires_at=EXCLUDED.expires_at,
-                            transaction_id=EXCLUDED.transaction_id,
-                            payment_amount=EXCLUDED.payment_amount,
-                            payment_currency=EXCLUDED.payment_currency,
-                            reminder_sent=FALSE,
-                            updated_at=NOW()
+                        UPDATE users SET subscription_status = 'active', updated_at = NOW()
+                        WHERE user_id = $1 AND subscription_status IS DISTINCT FROM 'active'
                         """,
-                        user_id, plan_name, start_date, expiry_date, transaction_id,
-                        payment_amount, payment_currency
+                        user_id
                     )
                 
+                    # Reprogramar las etapas de recordatorio para la nueva fecha
+                    reminder_times = await self._schedule_reminders(conn, user_id, expiry_date)
+                    await self._invalidate_user_status(conn, [user_id])
+                    # El planificador corre en el proceso del bot: despertarlo vía NOTIFY
+                    await publish_expiry_change(conn, expiry_date, reminder_times)
+                
                 # Log de actividad con detalles completos
                 await self._log_activity(user_id, "subscription_created", {
                     "plan": plan_name,
@@ -266,12 +563,12 @@ class EnhancedSubscriberManager:
                     "currency": payment_currency
                 })
 
+            # Y al de este proceso, si lo hay, sin esperar al NOTIFY
+            self.scheduler.notify_expiry_changed(expiry_date, reminder_times)
+            
             # Otorgar acceso a canales específicos del plan
             await self._grant_channel_access(user_id, plan_name)
             
-            # Recordar usuario
-            await self.record_user(user_id)
-            
             # Actualizar métricas
             self._metrics['payments_processed'] += 1
             await self._update_metric("payments_processed", 1)
@@ -285,10 +582,10 @@ class EnhancedSubscriberManager:
             return False
 
     async def _grant_channel_access(self, user_id: int, plan_name: str = None) -> None:
-        """Otorgar acceso a canales con rate limiting mejorado"""
-        success_channels = []
-        failed_channels = []
-        
+        """
+        Otorgar acceso a canales: todas las invitaciones se crean en paralelo,
+        se registran con un único upsert y se envían en un solo mensaje.
+        """
         # Obtener canales específicos del plan
         if plan_name:
             channel_ids = get_plan_channels(plan_name)
@@ -297,72 +594,88 @@ class EnhancedSubscriberManager:
             channel_ids = list(CHANNELS.values())
             channel_names = list(CHANNELS.keys())
         
-        for i, channel_id in enumerate(channel_ids):
-            channel_name = channel_names[i] if i < len(channel_names) else f"channel_{i+1}"
+        channels = [
+            (channel_id, channel_names[i] if i < len(channel_names) else f"channel_{i+1}")
+            for i, channel_id in enumerate(channel_ids)
+        ]
+        
+        async def create_invite(channel_id: int, channel_name: str) -> Optional[Tuple[str, float]]:
+            # Enlace pre-generado si hay; creación en vivo solo con el pool vacío
+            pooled = self.invite_pool.take(channel_id)
+            if pooled is not None:
+                return pooled
             
+            expires_at = int((datetime.now() + timedelta(days=1)).timestamp())
             try:
-                # Generar enlace de invitación con retry
                 invite_link = await self._send_with_retry(
                     self.bot.create_chat_invite_link,
                     chat_id=channel_id,
                     member_limit=1,
-                    expire_date=int((datetime.now() + timedelta(days=1)).timestamp())
+                    expire_date=expires_at
                 )
-                
-                # Enviar enlace al usuario con retry
-                await self._send_with_retry(
-                    self.bot.send_message,
-                    chat_id=user_id,
-                    text=f"🎬 **Welcome to {channel_name}!**\n\n"
-                         f"Click here to join: {invite_link.invite_link}\n\n"
-                         f"⏰ Link expires in 24 hours",
-                    parse_mode='Markdown'
-                )
-                
-                # Registrar acceso en la base de datos
-                async with self.pool.acquire() as conn:
-                    await conn.execute(
-                        """
-                        INSERT INTO channel_access (user_id, channel_id, channel_name, granted_at, invite_link)
-                        VALUES ($1, $2, $3, NOW(), $4)
-                        ON CONFLICT (user_id, channel_id) DO UPDATE SET
-                            granted_at = NOW(),
-                            revoked_at = NULL,
-                            channel_name = EXCLUDED.channel_name,
-                            invite_link = EXCLUDED.invite_link,
-                            access_count = channel_access.access_count + 1
-                        """,
-                        user_id, channel_id, channel_name, invite_link.invite_link
-                    )
-                
-                success_channels.append(channel_name)
-                self._metrics['invites_sent'] += 1
-                logger.info(f"✅ Access granted to {user_id} for channel {channel_name}")
+                return invite_link.invite_link, float(expires_at)
                 
             except TelegramError as e:
-                failed_channels.append(channel_name)
-                self._metrics['invites_failed'] += 1
                 logger.error(f"❌ Error granting access to {user_id} for channel {channel_name}: {e}")
-            
-            # Rate limiting optimizado
-            await asyncio.sleep(RATE_LIMIT_CONFIG["invite_delay"])
+                return None
+        
+        links = await asyncio.gather(*(create_invite(channel_id, name) for channel_id, name in channels))
         
-        # Mensaje de resumen mejorado
-        if success_channels:
+        granted = [(channel_id, name, link[0]) for (channel_id, name), link in zip(channels, links) if link]
+        failed_channels = [name for (_, name), link in zip(channels, links) if not link]
+        success_channels = [name for _, name, _ in granted]
+        
+        self._metrics['invites_sent'] += len(success_channels)
+        self._metrics['invites_failed'] += len(failed_channels)
+        
+        if granted:
+            # Registrar todos los accesos en la base de datos con un solo upsert
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO channel_access (user_id, channel_id, channel_name, granted_at, invite_link)
+                    SELECT $1, c.channel_id, c.channel_name, NOW(), c.invite_link
+                    FROM unnest($2::bigint[], $3::text[], $4::text[]) AS c(channel_id, channel_name, invite_link)
+                    ON CONFLICT (user_id, channel_id) DO UPDATE SET
+                        granted_at = NOW(),
+                        revoked_at = NULL,
+                        channel_name = EXCLUDED.channel_name,
+                        invite_link = EXCLUDED.invite_link,
+                        access_count = channel_access.access_count + 1
+                    """,
+                    user_id,
+                    [channel_id for channel_id, _, _ in granted],
+                    success_channels,
+                    [link for _, _, link in granted]
+                )
+                await self._invalidate_user_status(conn, [user_id])
+            
+            # Un único mensaje con todos los enlaces; nombres y enlaces escapados para
+            # que un `_` o `*` no invalide el Markdown y se pierdan todos
             summary_text = f"✅ **Access Granted Successfully!**\n\n"
-            summary_text += f"📺 Channels available: {len(success_channels)}\n"
+            for _, channel_name, link in granted:
+                summary_text += f"🎬 **{escape_markdown(channel_name)}:** {escape_markdown(link)}\n"
+            hours_left = max(1, int((min(link[1] for link in links if link) - time.time()) // 3600))
+            summary_text += f"\n⏰ Links expire in {hours_left} hours\n"
             summary_text += f"🎬 Start enjoying exclusive content now!"
             
             if failed_channels:
-                summary_text += f"\n\n⚠️ Some channels had issues: {', '.join(failed_channels)}\n"
+                summary_text += f"\n\n⚠️ Some channels had issues: {escape_markdown(', '.join(failed_channels))}\n"
                 summary_text += f"Contact support: support@pnptv.app"
             
-            await self._send_with_retry(
-                self.bot.send_message,
-                chat_id=user_id,
-                text=summary_text,
-                parse_mode='Markdown'
-            )
+            # El acceso ya está registrado: un fallo al enviar no deshace la suscripción
+            try:
+                await self._send_with_retry(
+                    self.bot.send_message,
+                    chat_id=user_id,
+                    text=summary_text,
+                    parse_mode='Markdown'
+                )
+            except TelegramError as e:
+                logger.error(f"❌ Could not send invite links to {user_id}: {e}")
+                await self._log_activity(user_id, "invite_delivery_failed", {"channels": success_channels, "error": str(e)})
+            
+            logger.info(f"✅ Access granted to {user_id} for channels: {', '.join(success_channels)}")
         
         # Actualizar métricas
         await self._update_metric("invites_sent", len(success_channels))
@@ -371,57 +684,102 @@ class EnhancedSubscriberManager:
 
     async def revoke_channel_access(self, user_id: int) -> None:
         """Revocar acceso a canales con logging mejorado"""
-        revoked_channels = []
+        await self.revoke_channel_access_batch([user_id])
+
+    async def revoke_channel_access_batch(self, user_ids: List[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        Revocar el acceso de varios usuarios a la vez.
         
-        # Obtener canales a los que el usuario tiene acceso
+        Todas las parejas (usuario, canal) se expulsan en paralelo a través del
+        despachador global; el resultado se guarda con un único UPDATE. Un
+        usuario o chat que ya no existe cuenta como revocado.
+        
+        Returns:
+            Tuple[Set[int], Set[int]]: usuarios sin canales pendientes de revocar, y
+            usuarios cuya revocación falló de forma permanente (p. ej. el bot
+            perdió el permiso de expulsar en el canal)
+        """
+        if not user_ids:
+            return set(), set()
+        
+        # Obtener canales a los que los usuarios tienen acceso
         async with self.pool.acquire() as conn:
             channel_rows = await conn.fetch(
                 """
-                SELECT channel_id, channel_name FROM channel_access 
-                WHERE user_id = $1 AND revoked_at IS NULL
+                SELECT user_id, channel_id, channel_name FROM channel_access 
+                WHERE user_id = ANY($1::bigint[]) AND revoked_at IS NULL
                 """,
-                user_id
+                user_ids
             )
         
-        for row in channel_rows:
-            channel_id = row['channel_id']
-            channel_name = row['channel_name']
-            
-            try:
-                # Intentar expulsar al usuario del canal con retry
-                await self._send_with_retry(
-                    self.bot.ban_chat_member,
-                    chat_id=channel_id,
-                    user_id=user_id
-                )
-                
-                # Inmediatamente desbanearlo
-                await self._send_with_retry(
-                    self.bot.unban_chat_member,
-                    chat_id=channel_id,
-                    user_id=user_id
-                )
-                
-                revoked_channels.append(channel_name)
-                logger.info(f"✅ Access revoked for {user_id} from channel {channel_name}")
-                
-            except TelegramError as e:
-                logger.error(f"❌ Error revoking access for {user_id} from channel {channel_name}: {e}")
+        semaphore = asyncio.Semaphore(EXPIRY_CONFIG["revoke_concurrency"])
         
-        # Actualizar base de datos
-        if revoked_channels:
-            async with self.pool.acquire() as conn:
+        async def kick(user_id: int, channel_id: int, channel_name: str) -> str:
+            async with semaphore:
+                try:
+                    # Expulsar y desbanear inmediatamente (el ban es lo que saca al usuario)
+                    await self._send_with_retry(
+                        self.bot.ban_chat_member,
+                        lane=Lane.REMINDER,
+                        chat_id=channel_id,
+                        user_id=user_id
+                    )
+                    await self._send_with_retry(
+                        self.bot.unban_chat_member,
+                        lane=Lane.REMINDER,
+                        chat_id=channel_id,
+                        user_id=user_id
+                    )
+                    logger.info(f"✅ Access revoked for {user_id} from channel {channel_name}")
+                    return 'revoked'
+                    
+                except TelegramError as e:
+                    kind = classify_error(e)
+                    if kind == ErrorKind.NOT_FOUND:
+                        # Cuenta o chat eliminados: no queda acceso que revocar
+                        logger.info(f"ℹ️ User {user_id} or channel {channel_name} no longer exists: {e}")
+                        return 'revoked'
+                    logger.error(f"❌ Error revoking access for {user_id} from channel {channel_name}: {e}")
+                    return 'failed' if kind.retryable else 'dead'
+        
+        results = await asyncio.gather(
+            *(kick(row['user_id'], row['channel_id'], row['channel_name']) for row in channel_rows)
+        )
+        
+        revoked_channels: Dict[int, List[str]] = {}
+        failed_users: Set[int] = set()
+        dead_users: Set[int] = set()
+        revoked_pairs = ([], [])
+        for row, outcome in zip(channel_rows, results):
+            if outcome == 'revoked':
+                revoked_channels.setdefault(row['user_id'], []).append(row['channel_name'])
+                revoked_pairs[0].append(row['user_id'])
+                revoked_pairs[1].append(row['channel_id'])
+            elif outcome == 'dead':
+                dead_users.add(row['user_id'])
+            else:
+                failed_users.add(row['user_id'])
+        # Con un fallo transitorio pendiente el usuario se reintenta entero
+        dead_users -= failed_users
+        
+        # Actualizar base de datos en una sola sentencia
+        async with self.pool.acquire() as conn:
+            if revoked_pairs[0]:
                 await conn.execute(
                     """
-                    UPDATE channel_access 
-                    SET revoked_at = NOW() 
-                    WHERE user_id = $1 AND revoked_at IS NULL
+                    UPDATE channel_access ca
+                    SET revoked_at = NOW()
+                    FROM unnest($1::bigint[], $2::bigint[]) AS r(user_id, channel_id)
+                    WHERE ca.user_id = r.user_id AND ca.channel_id = r.channel_id
+                    AND ca.revoked_at IS NULL
                     """,
-                    user_id
+                    *revoked_pairs
                 )
-            
+            await self._invalidate_user_status(conn, list(user_ids))
+        
+        async def notify(user_id: int, channels: List[str]) -> None:
             await self._log_activity(user_id, "access_revoked", {
-                "channels": revoked_channels,
+                "channels": channels,
                 "reason": "subscription_expired"
             })
             
@@ -429,6 +787,7 @@ class EnhancedSubscriberManager:
             try:
                 await self._send_with_retry(
                     self.bot.send_message,
+                    lane=Lane.REMINDER,
                     chat_id=user_id,
                     text="⚠️ **Subscription Expired**\n\n"
                          "Your access to premium channels has been revoked.\n"
@@ -438,36 +797,999 @@ class EnhancedSubscriberManager:
                 )
             except TelegramError as e:
                 logger.warning(f"⚠️ Could not notify user {user_id} about revocation: {e}")
+        
+        await asyncio.gather(*(notify(user_id, channels) for user_id, channels in revoked_channels.items()))
+        
+        return set(user_ids) - failed_users - dead_users, dead_users
+
+    @staticmethod
+    def _audience_conditions(language: Optional[str], statuses: Optional[List[str]], args: List) -> List[str]:
+        """Construir condiciones WHERE de un segmento de audiencia (agrega parámetros a `args`)"""
+        conditions = []
+        
+        if language:
+            args.append(language)
+            conditions.append(f"u.language = ${len(args)}")
+        
+        if statuses:
+            args.append(list(statuses))
+            conditions.append(f"u.subscription_status = ANY(${len(args)}::text[])")
+        
+        return conditions
+
+    async def iter_audience(
+        self,
+        *,
+        language: Optional[str] = None,
+        statuses: Optional[List[str]] = None,
+        after_user_id: Optional[int] = None,
+        page_size: Optional[int] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Recorrer la audiencia filtrada en páginas keyset ordenadas por user_id
+        
+        Cada página usa su propia conexión del pool y la libera antes de entregar
+        las filas, así ninguna consulta queda abierta durante todo el broadcast y
+        la memoria se mantiene en una página sin importar el número de usuarios.
+        Los usuarios marcados como bloqueados se omiten y el estado se lee de
+        users.subscription_status, así los segmentos usan idx_users_segment.
+        
+        Args:
+            language: Filtro de idioma ('en', 'es', None para todos)
+            statuses: Filtro de estados (['active'], ['churned'], ['never'])
+            after_user_id: Reanudar después de este user_id
+            page_size: Filas por página (por defecto DATABASE_CONFIG["audience_page_size"])
+        """
+        if not self.pool:
+            raise RuntimeError("Database pool not initialized. Call initialize() first.")
+        
+        page_size = page_size or DATABASE_CONFIG["audience_page_size"]
+        last_user_id = after_user_id
+        
+        while True:
+            args: List = []
+            conditions = ["u.is_blocked IS NOT TRUE"]
+            conditions += self._audience_conditions(language, statuses, args)
+            
+            if last_user_id is not None:
+                args.append(last_user_id)
+                conditions.append(f"u.user_id > ${len(args)}")
+            
+            args.append(page_size)
+            where_clause = f"WHERE {' AND '.join(conditions)}"
+            
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT u.user_id, u.language, u.subscription_status AS status
+                    FROM users u
+                    {where_clause}
+                    ORDER BY u.user_id
+                    LIMIT ${len(args)}
+                    """,
+                    *args
+                )
+            
+            for row in rows:
+                yield {"user_id": row["user_id"], "language": row["language"], "status": row["status"]}
+            
+            if len(rows) < page_size:
+                return
+            
+            last_user_id = rows[-1]["user_id"]
+
+    async def count_audience(
+        self,
+        *,
+        language: Optional[str] = None,
+        statuses: Optional[List[str]] = None,
+        use_cache: bool = True
+    ) -> int:
+        """
+        Contar la audiencia de un segmento con un único COUNT(*)
+        
+        Usa los mismos filtros que iter_audience. El resultado se cachea
+        DATABASE_CONFIG["audience_count_ttl"] segundos por combinación de filtros,
+        así las vistas previas repetidas no vuelven a consultar la base de datos.
+        """
+        if not self.pool:
+            raise RuntimeError("Database pool not initialized. Call initialize() first.")
+        
+        cache_key = (language, tuple(sorted(statuses)) if statuses else None)
+        now = time.monotonic()
+        
+        if use_cache:
+            cached = self._audience_count_cache.get(cache_key)
+            if cached and cached[0] > now:
+                return cached[1]
+        
+        args: List = []
+        conditions = ["u.is_blocked IS NOT TRUE"]
+        conditions += self._audience_conditions(language, statuses, args)
+        
+        async with self.pool.acquire() as conn:
+            count = await conn.fetchval(
+                f"""
+                SELECT COUNT(*) FROM users u
+                WHERE {' AND '.join(conditions)}
+                """,
+                *args
+            )
+        
+        self._audience_count_cache[cache_key] = (now + DATABASE_CONFIG["audience_count_ttl"], count)
+        return count
+
+    async def record_user(self, user_id: int, language: Optional[str] = None, username: Optional[str] = None,
+                          first_name: Optional[str] = None, last_name: Optional[str] = None,
+                          age_verified: Optional[bool] = None, terms_accepted: Optional[bool] = None,
+                          durable: bool = False) -> None:
+        """
+        Registrar o actualizar un usuario; los campos en None conservan su valor.
+        
+        Las escrituras se acumulan en memoria y se vuelcan en lote (last_seen y
+        datos de perfil son sobre todo escrituras redundantes). `durable=True`
+        vuelca antes de retornar, para datos legales como la aceptación de términos.
+        """
+        fields = {
+            'language': language,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'age_verified': age_verified,
+            'terms_accepted': terms_accepted
+        }
+        
+        pending = self._user_writes.setdefault(user_id, {})
+        pending.update({key: value for key, value in fields.items() if value is not None})
+        pending['seen_at'] = datetime.now(timezone.utc).replace(tzinfo=None)
+        
+        if durable:
+            await self.flush_user_writes()
+        elif len(self._user_writes) >= DATABASE_CONFIG["user_write_max_pending"]:
+            self._user_writes_full.set()
+
+    async def flush_user_writes(self) -> int:
+        """Volcar las escrituras de usuarios en buffer con un único upsert multi-fila"""
+        async with self._user_flush_lock:
+            if not self._user_writes:
+                return 0
+            
+            pending, self._user_writes = self._user_writes, {}
+            user_ids = list(pending)
+            columns = ('language', 'username', 'first_name', 'last_name', 'age_verified', 'terms_accepted', 'seen_at')
+            
+            try:
+                async with self.pool.acquire() as conn:
+                    # UPDATE de los existentes e INSERT del resto en una sentencia;
+                    # un usuario que vuelve a escribir al bot vuelve a ser alcanzable
+                    await conn.execute(
+                        """
+                        WITH pending AS (
+                            SELECT * FROM unnest(
+                                $1::bigint[], $2::text[], $3::text[], $4::text[], $5::text[],
+                                $6::boolean[], $7::boolean[], $8::timestamp[]
+                            ) AS p(user_id, language, username, first_name, last_name,
+                                   age_verified, terms_accepted, seen_at)
+                        ),
+                        updated AS (
+                            UPDATE users u SET
+                                language = COALESCE(p.language, u.language),
+                                username = COALESCE(p.username, u.username),
+                                first_name = COALESCE(p.first_name, u.first_name),
+                                last_name = COALESCE(p.last_name, u.last_name),
+                                age_verified = COALESCE(p.age_verified, u.age_verified),
+                                terms_accepted = COALESCE(p.terms_accepted, u.terms_accepted),
+                                terms_accepted_at = CASE WHEN p.terms_accepted THEN p.seen_at ELSE u.terms_accepted_at END,
+                                is_blocked = FALSE,
+                                last_seen = GREATEST(u.last_seen, p.seen_at),
+                                updated_at = NOW()
+                            FROM pending p
+                            WHERE u.user_id = p.user_id
+                            RETURNING u.user_id
+                        )
+                        INSERT INTO users (user_id, language, username, first_name, last_name,
+                                           age_verified, terms_accepted, terms_accepted_at, last_seen)
+                        SELECT p.user_id, COALESCE(p.language, 'en'), p.username, p.first_name, p.last_name,
+                               COALESCE(p.age_verified, FALSE), COALESCE(p.terms_accepted, FALSE),
+                               CASE WHEN p.terms_accepted THEN p.seen_at END, p.seen_at
+                        FROM pending p
+                        WHERE p.user_id NOT IN (SELECT user_id FROM updated)
+                        ON CONFLICT (user_id) DO NOTHING
+                        """,
+                        user_ids,
+                        *([pending[user_id].get(column) for user_id in user_ids] for column in columns)
+                    )
+                    await self._invalidate_user_status(conn, user_ids)
+                    
+            except BaseException:
+                # Devolver al buffer sin pisar escrituras más nuevas (también si se cancela)
+                for user_id, fields in pending.items():
+                    self._user_writes[user_id] = {**fields, **self._user_writes.get(user_id, {})}
+                raise
+            
+            return len(user_ids)
+
+    async def _user_write_loop(self) -> None:
+        """Volcar el buffer cada `user_write_flush_ms` o al llenarse"""
+        interval = DATABASE_CONFIG["user_write_flush_ms"] / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._user_writes_full.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._user_writes_full.clear()
+            
+            try:
+                await self.flush_user_writes()
+            except Exception as e:
+                logger.error(f"❌ Error flushing buffered user writes: {e}")
+
+    def _with_pending_writes(self, user_status: Dict) -> Dict:
+        """Superponer las escrituras aún en buffer (leer lo propio recién escrito)"""
+        pending = self._user_writes.get(user_status['user_id'])
+        if pending:
+            for key in ('language', 'age_verified', 'terms_accepted'):
+                if key in pending:
+                    user_status[key] = pending[key]
+            user_status['last_seen'] = pending['seen_at']
+            user_status['is_blocked'] = False
+        return user_status
+
+    async def get_user_status(self, user_id: int) -> Dict:
+        """
+        Estado completo del usuario para los menús (perfil, suscripción y canales).
+        
+        Se sirve desde una caché LRU/TTL en memoria; record_user, add_subscriber
+        y las revocaciones la invalidan aquí y, vía NOTIFY, en los demás procesos.
+        """
+        # Sin listener se podrían perder invalidaciones de otros procesos
+        use_cache = self._status_listener is not None
+        
+        if use_cache:
+            cached = self._status_cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                self._status_cache.move_to_end(user_id)
+                return self._with_pending_writes(dict(cached[1]))
+        
+        read_generation = self._status_generation
+        async with self.pool.acquire() as conn:
+            user = await conn.fetchrow(
+                """
+                SELECT language, age_verified, terms_accepted, last_seen, is_blocked
+                FROM users WHERE user_id = $1
+                """,
+                user_id
+            )
+            subscription = await conn.fetchrow(
+                """
+                SELECT plan, start_date, expires_at, transaction_id, payment_amount, payment_currency
+                FROM subscribers WHERE user_id = $1
+                """,
+                user_id
+            )
+            channel_rows = await conn.fetch(
+                """
+                SELECT channel_id, channel_name, granted_at, revoked_at
+                FROM channel_access WHERE user_id = $1
+                ORDER BY channel_id
+                """,
+                user_id
+            )
+        
+        if subscription is None:
+            status = 'never'
+        else:
+            # expires_at es TIMESTAMP sin zona, guardado en UTC
+            status = 'active' if subscription['expires_at'] > datetime.now(timezone.utc).replace(tzinfo=None) else 'churned'
+        
+        user_status = {
+            'user_id': user_id,
+            'status': status,
+            'language': user['language'] if user else 'en',
+            'age_verified': bool(user and user['age_verified']),
+            'terms_accepted': bool(user and user['terms_accepted']),
+            'last_seen': user['last_seen'] if user else None,
+            'is_blocked': bool(user and user['is_blocked']),
+            'subscription': dict(subscription) if subscription else None,
+            'channel_access': [dict(row) for row in channel_rows]
+        }
+        
+        # Una invalidación llegada durante las consultas gana: no se cachea un estado viejo
+        invalidated_during_read = (
+            read_generation < self._status_floor
+            or self._status_invalidated.get(user_id, -1) > read_generation
+        )
+        
+        if use_cache and not invalidated_during_read:
+            self._status_cache[user_id] = (time.monotonic() + DATABASE_CONFIG["user_status_cache_ttl"], user_status)
+            self._status_cache.move_to_end(user_id)
+            while len(self._status_cache) > DATABASE_CONFIG["user_status_cache_size"]:
+                self._status_cache.popitem(last=False)
+        
+        return self._with_pending_writes(dict(user_status))
+
+    async def _invalidate_user_status(self, conn, user_ids: List[int]) -> None:
+        """Invalidar el estado en caché aquí y avisar a los demás procesos"""
+        for user_id in user_ids:
+            self._forget_user_status(user_id)
+        
+        if user_ids:
+            await conn.execute(
+                "SELECT pg_notify($1, user_id::text) FROM unnest($2::bigint[]) AS user_id",
+                USER_STATUS_CHANNEL, user_ids
+            )
+
+    def _forget_user_status(self, user_id: int) -> None:
+        """Descartar el estado en caché y anotar la invalidación para lecturas en curso"""
+        self._status_generation += 1
+        self._status_cache.pop(user_id, None)
+        self._status_invalidated[user_id] = self._status_generation
+        
+        # Acotar el registro: podar invalida de forma conservadora las lecturas en curso
+        if len(self._status_invalidated) > DATABASE_CONFIG["user_status_cache_size"]:
+            self._status_invalidated.clear()
+            self._status_floor = self._status_generation
+
+    async def _start_status_listener(self) -> None:
+        """Escuchar invalidaciones de estado de otros procesos (LISTEN/NOTIFY)"""
+        while self.pool is not None:
+            try:
+                conn = await asyncpg.connect(dsn=self.db_url)
+                await conn.add_listener(USER_STATUS_CHANNEL, self._on_status_notification)
+                conn.add_termination_listener(self._on_status_listener_lost)
+                self._status_listener = conn
+                logger.info("✅ Listening for user status invalidations")
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Could not start user status listener, cache disabled: {e}")
+                await asyncio.sleep(30)
+
+    def _on_status_notification(self, conn, pid, channel, payload) -> None:
+        """NOTIFY recibido: descartar el estado en caché de ese usuario"""
+        try:
+            self._forget_user_status(int(payload))
+        except ValueError:
+            logger.warning(f"Ignoring malformed {channel} payload: {payload!r}")
+
+    def _on_status_listener_lost(self, conn) -> None:
+        """Conexión LISTEN perdida: vaciar la caché y reconectar"""
+        self._status_listener = None
+        self._status_cache.clear()
+        self._status_generation += 1
+        self._status_floor = self._status_generation
+        if self.pool is not None:
+            logger.warning("⚠️ User status listener lost, reconnecting")
+            asyncio.create_task(self._start_status_listener())
+
+    async def set_subscription_status(self, user_id: int, status: str) -> None:
+        """Actualizar el estado de suscripción almacenado en users"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE users SET subscription_status = $2, updated_at = NOW()
+                WHERE user_id = $1 AND subscription_status IS DISTINCT FROM $2
+                """,
+                user_id, status
+            )
+            await self._invalidate_user_status(conn, [user_id])
+
+    async def mark_users_blocked(self, user_ids: List[int]) -> int:
+        """Marcar en bloque usuarios que bloquearon el bot o ya no existen"""
+        if not user_ids:
+            return 0
+        
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE users SET is_blocked = TRUE, updated_at = NOW()
+                WHERE user_id = ANY($1::bigint[]) AND is_blocked IS NOT TRUE
+                """,
+                user_ids
+            )
+            await self._invalidate_user_status(conn, user_ids)
+        
+        return int(result.split()[-1])
+
+    async def create_broadcast_job(self, broadcast_id: str, payload: Dict,
+                                   scheduled_at: Optional[datetime] = None) -> None:
+        """Registrar un broadcast como job durable ('running', o 'scheduled' si tiene fecha)"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO broadcast_jobs (broadcast_id, status, payload, scheduled_at)
+                VALUES ($1, $2, $3::jsonb, $4)
+                """,
+                broadcast_id, 'scheduled' if scheduled_at else 'running',
+                json.dumps(payload), scheduled_at
+            )
+
+    async def count_scheduled_broadcasts(self, window_start: datetime, window_end: datetime) -> int:
+        """Broadcasts pendientes programados dentro de una ventana (idx_broadcast_jobs_scheduled)"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT COUNT(*) FROM broadcast_jobs
+                WHERE status = 'scheduled' AND scheduled_at >= $1 AND scheduled_at < $2
+                """,
+                window_start, window_end
+            )
+
+    async def get_scheduled_broadcast_jobs(self) -> List[Dict]:
+        """Broadcasts pendientes ordenados por fecha de ejecución"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT broadcast_id, payload, scheduled_at
+                FROM broadcast_jobs
+                WHERE status = 'scheduled'
+                ORDER BY scheduled_at
+                """
+            )
+        
+        return [
+            {**dict(row), 'payload': json.loads(row['payload'])}
+            for row in rows
+        ]
+
+    async def claim_scheduled_broadcast_job(self, broadcast_id: str) -> Optional[Dict]:
+        """
+        Pasar un broadcast programado a 'running' y devolver su payload.
+        
+        Devuelve None si fue cancelado o ya lo tomó otro proceso.
+        """
+        async with self.pool.acquire() as conn:
+            payload = await conn.fetchval(
+                """
+                UPDATE broadcast_jobs SET
+                    status = 'running',
+                    started_at = NOW(),
+                    updated_at = NOW()
+                WHERE broadcast_id = $1 AND status = 'scheduled'
+                RETURNING payload
+                """,
+                broadcast_id
+            )
+        
+        return json.loads(payload) if payload is not None else None
+
+    async def cancel_scheduled_broadcast_job(self, broadcast_id: str) -> bool:
+        """Cancelar un broadcast que todavía no empezó"""
+        async with self.pool.acquire() as conn:
+            cancelled = await conn.fetchval(
+                """
+                UPDATE broadcast_jobs SET
+                    status = 'cancelled',
+                    updated_at = NOW(),
+                    completed_at = NOW()
+                WHERE broadcast_id = $1 AND status = 'scheduled'
+                RETURNING broadcast_id
+                """,
+                broadcast_id
+            )
+        
+        return cancelled is not None
+
+    async def checkpoint_broadcast_job(self, broadcast_id: str, cursor_user_id: Optional[int], counters: Dict[str, int]) -> None:
+        """Guardar el cursor y los contadores de un job en curso"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE broadcast_jobs SET
+                    cursor_user_id = $2,
+                    processed = $3,
+                    messages_sent = $4,
+                    messages_failed = $5,
+                    blocked_users = $6,
+                    updated_at = NOW()
+                WHERE broadcast_id = $1
+                """,
+                broadcast_id, cursor_user_id, counters['processed'],
+                counters['sent'], counters['failed'], counters['blocked']
+            )
+
+    async def finish_broadcast_job(self, broadcast_id: str, status: str,
+                                   counters: Optional[Dict[str, int]] = None, error: Optional[str] = None) -> None:
+        """Cerrar un job como 'completed', 'failed' o 'cancelled'"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE broadcast_jobs SET
+                    status = $2,
+                    processed = COALESCE($3, processed),
+                    messages_sent = COALESCE($4, messages_sent),
+                    messages_failed = COALESCE($5, messages_failed),
+                    blocked_users = COALESCE($6, blocked_users),
+                    error = $7,
+                    updated_at = NOW(),
+                    completed_at = NOW()
+                WHERE broadcast_id = $1
+                """,
+                broadcast_id, status,
+                counters['processed'] if counters else None,
+                counters['sent'] if counters else None,
+                counters['failed'] if counters else None,
+                counters['blocked'] if counters else None,
+                error
+            )
+
+    async def get_resumable_broadcast_jobs(self) -> List[Dict]:
+        """Jobs que quedaron en 'running' (el proceso se detuvo a mitad del envío)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT broadcast_id, payload, cursor_user_id, processed,
+                       messages_sent, messages_failed, blocked_users, started_at
+                FROM broadcast_jobs
+                WHERE status = 'running'
+                ORDER BY started_at
+                """
+            )
+        
+        return [
+            {**dict(row), 'payload': json.loads(row['payload'])}
+            for row in rows
+        ]
+
+    async def get_broadcast_job(self, broadcast_id: str) -> Optional[Dict]:
+        """Obtener un job de broadcast con su payload"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT broadcast_id, status, payload, cursor_user_id, processed,
+                       messages_sent, messages_failed, blocked_users, started_at, completed_at
+                FROM broadcast_jobs
+                WHERE broadcast_id = $1
+                """,
+                broadcast_id
+            )
+        
+        if row is None:
+            return None
+        
+        return {**dict(row), 'payload': json.loads(row['payload'])}
+
+    async def record_deliveries(self, records: List[tuple]) -> None:
+        """
+        Guardar en bloque filas (broadcast_id, user_id, status, error_class, latency_ms)
+        
+        Las filas se cargan con COPY en una tabla temporal y se pasan al registro
+        con un solo INSERT ... ON CONFLICT: un reintento puede sobrescribir un
+        'failed', pero nunca un 'sent'.
+        """
+        if not records:
+            return
+        
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    CREATE TEMP TABLE IF NOT EXISTS broadcast_deliveries_stage (
+                        broadcast_id TEXT,
+                        user_id BIGINT,
+                        status TEXT,
+                        error_class TEXT,
+                        latency_ms INTEGER
+                    ) ON COMMIT DELETE ROWS
+                    """
+                )
+                await conn.copy_records_to_table(
+                    'broadcast_deliveries_stage',
+                    records=records,
+                    columns=['broadcast_id', 'user_id', 'status', 'error_class', 'latency_ms']
+                )
+                await conn.execute(
+                    """
+                    INSERT INTO broadcast_deliveries (broadcast_id, user_id, status, error_class, latency_ms)
+                    SELECT DISTINCT ON (broadcast_id, user_id)
+                           broadcast_id, user_id, status, error_class, latency_ms
+                    FROM broadcast_deliveries_stage
+                    ORDER BY broadcast_id, user_id, (status = 'sent') DESC
+                    ON CONFLICT (broadcast_id, user_id) DO UPDATE SET
+                        status = EXCLUDED.status,
+                        error_class = EXCLUDED.error_class,
+                        latency_ms = EXCLUDED.latency_ms,
+                        delivered_at = NOW()
+                    WHERE broadcast_deliveries.status <> 'sent'
+                    """
+                )
+
+    async def get_delivered_user_ids(self, broadcast_id: str, after_user_id: Optional[int] = None) -> Set[int]:
+        """user_ids que ya recibieron el broadcast (para no repetir envíos al reanudar)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id FROM broadcast_deliveries
+                WHERE broadcast_id = $1 AND status = 'sent'
+                AND ($2::bigint IS NULL OR user_id > $2)
+                """,
+                broadcast_id, after_user_id
+            )
+        
+        return {row['user_id'] for row in rows}
+
+    async def get_failed_delivery_user_ids(self, broadcast_id: str) -> List[int]:
+        """user_ids con fallo transitorio en un broadcast (excluye bloqueados y cuentas borradas)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id FROM broadcast_deliveries
+                WHERE broadcast_id = $1 AND status = 'failed'
+                ORDER BY user_id
+                """,
+                broadcast_id
+            )
+        
+        return [row['user_id'] for row in rows]
+
+    async def get_cached_file_id(self, content_hash: str, media_type: str) -> Optional[str]:
+        """Buscar un file_id ya subido para este contenido"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                UPDATE media_cache SET last_used_at = NOW()
+                WHERE content_hash = $1 AND media_type = $2
+                RETURNING file_id
+                """,
+                content_hash, media_type
+            )
+
+    async def store_cached_file_id(self, content_hash: str, media_type: str, file_id: str, source: str = None) -> None:
+        """Guardar el file_id devuelto por Telegram tras la primera subida"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO media_cache (content_hash, media_type, file_id, source)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (content_hash, media_type) DO UPDATE SET
+                    file_id = EXCLUDED.file_id,
+                    source = EXCLUDED.source,
+                    last_used_at = NOW()
+                """,
+                content_hash, media_type, file_id, source
+            )
+
+    async def _claim_expired_batch(self, conn, batch_size: int) -> List[asyncpg.Record]:
+        """
+        Reclamar un lote de suscripciones vencidas pendientes de revocar.
+        
+        SKIP LOCKED permite varias instancias en paralelo sin reclamar la misma
+        fila; un lote abandonado (proceso caído) se vuelve a reclamar tras
+        `claim_timeout` segundos.
+        """
+        return await conn.fetch(
+            """
+            UPDATE subscribers s
+            SET access_state = 'revoking', revoke_claimed_at = NOW()
+            FROM (
+                SELECT user_id FROM subscribers
+                WHERE revoked_at IS NULL
+                AND expires_at <= NOW()
+                AND (
+                    access_state = 'active'
+                    OR (access_state = 'revoking' AND revoke_claimed_at < NOW() - make_interval(secs => $2))
+                )
+                AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                ORDER BY expires_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            ) due
+            WHERE s.user_id = due.user_id
+            RETURNING s.user_id, s.plan, s.expires_at, s.revoke_attempts
+            """,
+            batch_size, EXPIRY_CONFIG["claim_timeout"]
+        )
 
     async def check_expired_subscriptions(self) -> List[int]:
-        """Verificar y procesar suscripciones expiradas con mejoras"""
+        """Verificar y procesar suscripciones expiradas por lotes reclamados"""
         if not self.pool:
             raise RuntimeError("Database pool not initialized")
         
         expired_users = []
-        
         try:
             async with self.pool.acquire() as conn:
-                # Query optimizada para encontrar suscripciones expiradas
-                rows = await conn.fetch(
+                # Suscripciones vencidas pasan a 'churned' en un solo UPDATE
+                await conn.execute(
                     """
-                    SELECT s.user_id, s.plan, s.expires_at 
+                    UPDATE users u SET subscription_status = 'churned', updated_at = NOW()
                     FROM subscribers s
-                    WHERE s.expires_at <= NOW() 
-                    AND NOT EXISTS (
-                        SELECT 1 FROM activity_logs al 
-                        WHERE al.user_id = s.user_id 
-                        AND al.action = 'access_revoked' 
-                        AND al.timestamp > s.expires_at
-                    )
-                    ORDER BY s.expires_at
+                    WHERE s.user_id = u.user_id
+                    AND u.subscription_status = 'active'
+                    AND s.expires_at <= NOW()
                     """
                 )
+            
+            while True:
+                async with self.pool.acquire() as conn:
+                    rows = await self._claim_expired_batch(conn, EXPIRY_CONFIG["batch_size"])
                 
-                for row in rows:
-                    user_id = row['user_id']
-                    plan = row['plan']
-                    expired_users.append(user_id)
-                    
-                    # Revocar acceso
-                    await self.revoke_channel_access(
\ No newline at end of file
+                if not rows:
+                    break
+                
+                user_ids = [row['user_id'] for row in rows]
+                try:
+                    done, dead = await self.revoke_channel_access_batch(user_ids)
+                except Exception as e:
+                    logger.error(f"❌ Error revoking expired batch of {len(user_ids)}: {e}")
+                    done, dead = set(), set()
+                
+                revoked = [user_id for user_id in user_ids if user_id in done]
+                # Agotados los intentos, un fallo transitorio también se da por perdido
+                exhausted = {
+                    row['user_id'] for row in rows
+                    if row['revoke_attempts'] + 1 >= EXPIRY_CONFIG["max_revoke_attempts"]
+                }
+                failed = [user_id for user_id in user_ids if user_id in dead or (user_id not in done and user_id in exhausted)]
+                released = [user_id for user_id in user_ids if user_id not in done and user_id not in failed]
+                
+                async with self.pool.acquire() as conn:
+                    # Una renovación durante la revocación deja la fila en 'active' y no se toca
+                    await conn.execute(
+                        """
+                        UPDATE subscribers
+                        SET access_state = 'revoked', revoked_at = NOW(), revoke_claimed_at = NULL,
+                            revoke_attempts = 0, next_attempt_at = NULL
+                        WHERE user_id = ANY($1::bigint[]) AND access_state = 'revoking'
+                        """,
+                        revoked
+                    )
+                    if failed:
+                        # Fuera de la cola: no se reclaman más hasta una renovación
+                        await conn.execute(
+                            """
+                            UPDATE subscribers
+                            SET access_state = 'revoke_failed', revoke_claimed_at = NULL,
+                                revoke_attempts = revoke_attempts + 1, next_attempt_at = NULL
+                            WHERE user_id = ANY($1::bigint[]) AND access_state = 'revoking'
+                            """,
+                            failed
+                        )
+                    if released:
+                        # Los fallos transitorios se reintentan con espera exponencial,
+                        # así no ocupan los primeros puestos de cada barrido
+                        await conn.execute(
+                            """
+                            UPDATE subscribers
+                            SET access_state = 'active', revoke_claimed_at = NULL,
+                                revoke_attempts = revoke_attempts + 1,
+                                next_attempt_at = NOW() + make_interval(secs => LEAST($2::float8 * power(2, revoke_attempts), $3::float8))
+                            WHERE user_id = ANY($1::bigint[]) AND access_state = 'revoking'
+                            """,
+                            released, max(1, EXPIRY_CONFIG["revoke_retry_base"]), EXPIRY_CONFIG["revoke_retry_max"]
+                        )
+                
+                for user_id in failed:
+                    await self._log_activity(user_id, "access_revoke_failed", {"reason": "subscription_expired"})
+                
+                expired_users.extend(revoked)
+                logger.info(
+                    f"🔒 Expiry batch: {len(revoked)} revoked, {len(failed)} failed permanently, "
+                    f"{len(released)} scheduled for retry"
+                )
+                
+                # Cada fila reclamada sale de la cola (revocada, fallida o diferida): seguir mientras haya lotes llenos
+                if len(rows) < EXPIRY_CONFIG["batch_size"]:
+                    break
+            
+            return expired_users
+            
+        except Exception as e:
+            logger.error(f"❌ Error checking expired subscriptions: {e}")
+            return expired_users
+
+    @staticmethod
+    def _reminder_offset(user_id: int) -> int:
+        """Desfase determinista (s) dentro de la ventana de reparto de cada etapa"""
+        return (user_id * 2654435761) % max(REMINDER_CONFIG["spread_seconds"], 1)
+
+    async def _schedule_reminders(self, conn, user_id: int, expires_at: datetime) -> List[datetime]:
+        """Reemplazar las etapas de recordatorio del usuario; devuelve sus vencimientos"""
+        # Todo en UTC sin zona, como las columnas TIMESTAMP (una fecha sin zona ya es UTC)
+        if expires_at.tzinfo is not None:
+            expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        offset = timedelta(seconds=self._reminder_offset(user_id))
+        
+        # Solo etapas futuras: un plan de 7 días no recibe el aviso de 7 días al comprar
+        stages = [
+            (days, expires_at - timedelta(days=days) + offset)
+            for days in REMINDER_CONFIG["stages"]
+            if expires_at - timedelta(days=days) > now
+        ]
+        
+        async with conn.transaction():
+            await conn.execute("DELETE FROM subscription_reminders WHERE user_id = $1", user_id)
+            if stages:
+                await conn.execute(
+                    """
+                    INSERT INTO subscription_reminders (user_id, stage, due_at)
+                    SELECT $1, st.stage, st.due_at
+                    FROM unnest($2::int[], $3::timestamp[]) AS st(stage, due_at)
+                    """,
+                    user_id, [days for days, _ in stages], [due_at for _, due_at in stages]
+                )
+        
+        return [due_at for _, due_at in stages]
+
+    async def check_renewal_reminders(self) -> List[int]:
+        """
+        Enviar el recordatorio de renovación vencido más cercano al vencimiento de cada usuario.
+        
+        Las etapas anteriores que también vencieron se marcan como omitidas; cada etapa
+        se reclama con un único UPDATE ... RETURNING sobre el índice (stage, due_at) y
+        solo se da por enviada tras un envío correcto.
+        """
+        if not self.pool:
+            raise RuntimeError("Database pool not initialized")
+        
+        claimed = []
+        try:
+            async with self.pool.acquire() as conn:
+                # Un usuario con varias etapas vencidas (bot caído, compra tardía) recibe solo la última
+                await conn.execute(
+                    """
+                    UPDATE subscription_reminders r SET sent_at = NOW(), skipped = TRUE, claimed_at = NULL
+                    WHERE r.due_at <= NOW()
+                    AND r.sent_at IS NULL
+                    AND EXISTS (
+                        SELECT 1 FROM subscription_reminders n
+                        WHERE n.user_id = r.user_id AND n.stage < r.stage AND n.due_at <= NOW()
+                    )
+                    """
+                )
+                for days in REMINDER_CONFIG["stages"]:
+                    rows = await conn.fetch(
+                        """
+                        UPDATE subscription_reminders r SET claimed_at = NOW()
+                        FROM subscribers s
+                        WHERE r.stage = $1
+                        AND r.due_at <= NOW()
+                        AND r.sent_at IS NULL
+                        AND (r.claimed_at IS NULL OR r.claimed_at < NOW() - make_interval(secs => $2))
+                        AND s.user_id = r.user_id
+                        AND s.expires_at > NOW()
+                        RETURNING r.user_id, r.stage, s.plan, s.expires_at
+                        """,
+                        days, REMINDER_CONFIG["claim_timeout"]
+                    )
+                    claimed.extend(rows)
+        except Exception as e:
+            logger.error(f"❌ Error checking renewal reminders: {e}")
+        
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        
+        async def remind(row) -> Optional[ErrorKind]:
+            # Días reales hasta el vencimiento (redondeando hacia arriba), no los nominales de la etapa
+            days = max(1, math.ceil((row['expires_at'] - now).total_seconds() / 86400))
+            try:
+                await self._send_with_retry(
+                    self.bot.send_message,
+                    lane=Lane.REMINDER,
+                    chat_id=row['user_id'],
+                    text=f"⏰ **Subscription Expiring Soon**\n\n"
+                         f"Your {row['plan']} plan expires in {days} day{'s' if days != 1 else ''} "
+                         f"({row['expires_at']:%Y-%m-%d}).\n"
+                         f"Renew now to keep your access to premium channels!\n\n"
+                         f"Use /plans to see available options.",
+                    parse_mode='Markdown'
+                )
+                return None
+            except TelegramError as e:
+                logger.warning(f"⚠️ Could not send {row['stage']}d renewal reminder to {row['user_id']}: {e}")
+                return classify_error(e)
+        
+        results = await asyncio.gather(*(remind(row) for row in claimed))
+        sent = [row for row, kind in zip(claimed, results) if kind is None]
+        # Los rechazos definitivos (bot bloqueado, chat inexistente) no se reintentan
+        dropped = [row for row, kind in zip(claimed, results) if kind is not None and not kind.retryable]
+        retry = [row for row, kind in zip(claimed, results) if kind is not None and kind.retryable]
+        
+        try:
+            async with self.pool.acquire() as conn:
+                for rows, query in (
+                    (sent, "SET sent_at = NOW(), claimed_at = NULL"),
+                    (dropped, "SET sent_at = NOW(), skipped = TRUE, claimed_at = NULL"),
+                    (retry, "SET claimed_at = NULL, due_at = NOW() + make_interval(secs => $3)"),
+                ):
+                    if not rows:
+                        continue
+                    args = [[row['user_id'] for row in rows], [row['stage'] for row in rows]]
+                    if rows is retry:
+                        args.append(REMINDER_CONFIG["retry_delay"])
+                    await conn.execute(
+                        f"""
+                        UPDATE subscription_reminders r {query}
+                        FROM unnest($1::bigint[], $2::int[]) AS d(user_id, stage)
+                        WHERE r.user_id = d.user_id AND r.stage = d.stage
+                        """,
+                        *args
+                    )
+        except Exception as e:
+            # Las etapas reclamadas sin confirmar se re-reclaman tras claim_timeout
+            logger.error(f"❌ Error recording renewal reminder results: {e}")
+        
+        reminded_users = [row['user_id'] for row in sent]
+        if reminded_users:
+            self._metrics['reminders_sent'] += len(reminded_users)
+            await self._update_metric("reminders_sent", len(reminded_users))
+        
+        return reminded_users
+
+    async def _log_activity(self, user_id: Optional[int], action: str, details: Optional[Dict] = None) -> None:
+        """Registrar actividad del usuario (encolada; se escribe en lote en segundo plano)"""
+        await self.activity_log.log(user_id, action, details)
+
+    async def get_activity_rollups(self, days: int = 30, action: Optional[str] = None) -> List[Dict]:
+        """Eventos y usuarios únicos por día y acción (sin tocar activity_logs)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT day, action, events, unique_users
+                FROM activity_daily_rollups
+                WHERE day >= CURRENT_DATE - $1::int
+                AND ($2::text IS NULL OR action = $2)
+                ORDER BY day, action
+                """,
+                days, action
+            )
+        return [dict(row) for row in rows]
+
+    async def _update_metric(self, metric_name: str, value: int) -> None:
+        """Acumular una métrica diaria en la tabla metrics"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO metrics (metric_name, metric_value)
+                    VALUES ($1, $2)
+                    ON CONFLICT (metric_name, metric_date) DO UPDATE SET
+                        metric_value = metrics.metric_value + EXCLUDED.metric_value
+                    """,
+                    metric_name, value
+                )
+        except Exception as e:
+            logger.warning(f"Failed to update metric {metric_name}: {e}")
+
+    async def close(self):
+        """Cerrar pool de conexiones"""
+        await self.scheduler.close()
+        await self.invite_pool.close()
+        if self._user_write_task is not None:
+            self._user_write_task.cancel()
+            self._user_write_task = None
+        if self.pool:
+            try:
+                await self.flush_user_writes()
+            except Exception as e:
+                logger.error(f"❌ Error flushing buffered user writes on close: {e}")
+            await self.activity_log.close()
+        await get_dispatcher().stop_coordination()
+        if self._status_listener is not None:
+            listener, self._status_listener = self._status_listener, None
+            listener.remove_termination_listener(self._on_status_listener_lost)
+            await listener.close()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+            logger.info("✅ Enhanced SubscriberManager pool closed")
+
+# Instancia global singleton
+_subscriber_manager_instance: Optional[EnhancedSubscriberManager] = None
+
+async def get_subscriber_manager() -> EnhancedSubscriberManager:
+    """Obtener instancia global inicializada del subscriber manager"""
+    global _subscriber_manager_instance
+    
+    if _subscriber_manager_instance is None:
+        _subscriber_manager_instance = EnhancedSubscriberManager()
+        await _subscriber_manager_instance.initialize()
+        logger.info("✅ EnhancedSubscriberManager singleton initialized")
+    
+    return _subscriber_manager_instance
+
+async def cleanup_subscriber_manager() -> None:
+    """Cerrar el subscriber manager global"""
+    global _subscriber_manager_instance
+    
+    if _subscriber_manager_instance is not None:
+        await _subscriber_manager_instance.close()
+        _subscriber_manager_instance = None
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+POOL DE ENLACES DE INVITACIÓN PRE-GENERADOS
+===========================================
+Mantiene enlaces de un solo uso listos por canal para que otorgar acceso tras
+un pago no espere a create_chat_invite_link. Un task en segundo plano repone
+el pool y revoca los enlaces que están por vencer.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import TelegramError
+
+from bot.config import INVITE_POOL_CONFIG
+from bot.dispatcher import Lane
+
+logger = logging.getLogger(__name__)
+
+
+class InvitePool:
+    """Enlaces de invitación (member_limit=1) listos para entregar, por canal"""
+
+    def __init__(self, manager, channel_ids: List[int]):
+        self.manager = manager
+        self.size = INVITE_POOL_CONFIG["size"]
+        # Por canal, en orden de creación: (enlace, expira_en epoch)
+        self._links: Dict[int, Deque[Tuple[str, float]]] = {channel_id: deque() for channel_id in channel_ids}
+        # Enlaces retirados pendientes de revocar: (canal, enlace)
+        self._stale: List[Tuple[int, str]] = []
+        self._refill_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self) -> None:
+        """Arrancar el reabastecimiento en segundo plano (no-op con tamaño 0)"""
+        if self.size <= 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._refill_loop())
+        logger.info(f"✅ Invite pool started: {self.size} links per channel")
+
+    def take(self, channel_id: int) -> Optional[Tuple[str, float]]:
+        """Sacar un enlace listo en O(1); None si el pool del canal está vacío"""
+        links = self._links.get(channel_id)
+        min_expiry = time.time() + INVITE_POOL_CONFIG["min_remaining"]
+
+        while links:
+            link, expires_at = links.popleft()
+            if expires_at >= min_expiry:
+                self.hits += 1
+                self._refill_needed.set()
+                return link, expires_at
+            # El más antiguo está por vencer: se retira sin entregarlo
+            self._stale.append((channel_id, link))
+
+        self.misses += 1
+        self._refill_needed.set()
+        return None
+
+    async def _refill_loop(self) -> None:
+        """Retirar enlaces viejos y reponer cada canal hasta `size`"""
+        while True:
+            self._refill_needed.clear()
+            try:
+                await self._retire_stale()
+                await self._refill()
+            except Exception as e:
+                logger.error(f"❌ Error refilling invite pool: {e}")
+
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(), timeout=INVITE_POOL_CONFIG["refill_interval"])
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self) -> None:
+        """Crear en paralelo los enlaces que faltan en todos los canales"""
+        missing = [
+            channel_id
+            for channel_id, links in self._links.items()
+            for _ in range(self.size - len(links))
+        ]
+        if not missing:
+            return
+
+        results = await asyncio.gather(*(self._create(channel_id) for channel_id in missing))
+
+        created = 0
+        for channel_id, result in zip(missing, results):
+            if result is not None:
+                self._links[channel_id].append(result)
+                created += 1
+
+        logger.debug(f"Invite pool refilled with {created}/{len(missing)} links")
+
+    async def _create(self, channel_id: int) -> Optional[Tuple[str, float]]:
+        """Crear un enlace de un solo uso con el TTL configurado"""
+        expires_at = int(time.time() + INVITE_POOL_CONFIG["link_ttl"])
+        try:
+            invite_link = await self.manager._send_with_retry(
+                self.manager.bot.create_chat_invite_link,
+                lane=Lane.REMINDER,
+                chat_id=channel_id,
+                member_limit=1,
+                expire_date=expires_at
+            )
+            return invite_link.invite_link, float(expires_at)
+        except TelegramError as e:
+            logger.warning(f"⚠️ Could not pre-generate invite for channel {channel_id}: {e}")
+            return None
+
+    async def _retire_stale(self) -> None:
+        """Revocar los enlaces que vencerán antes de `min_remaining`"""
+        min_expiry = time.time() + INVITE_POOL_CONFIG["min_remaining"]
+        stale, self._stale = self._stale, []
+
+        for channel_id, links in self._links.items():
+            while links and links[0][1] < min_expiry:
+                stale.append((channel_id, links.popleft()[0]))
+
+        if stale:
+            await asyncio.gather(*(self._revoke(channel_id, link) for channel_id, link in stale))
+            logger.info(f"🔄 Retired {len(stale)} stale invite links")
+
+    async def _revoke(self, channel_id: int, link: str) -> None:
+        """Revocar un enlace no entregado"""
+        try:
+            await self.manager._send_with_retry(
+                self.manager.bot.revoke_chat_invite_link,
+                lane=Lane.REMINDER,
+                chat_id=channel_id,
+                invite_link=link
+            )
+        except TelegramError as e:
+            logger.warning(f"⚠️ Could not revoke pooled invite for channel {channel_id}: {e}")
+
+    async def close(self) -> None:
+        """Detener el reabastecimiento y revocar los enlaces que quedan en el pool"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        pending, self._stale = self._stale, []
+        pending += [(channel_id, link) for channel_id, links in self._links.items() for link, _ in links]
+        for links in self._links.values():
+            links.clear()
+
+        if pending:
+            await asyncio.gather(*(self._revoke(channel_id, link) for channel_id, link in pending))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Enlaces disponibles por canal y aciertos del pool"""
+        return {
+            'size': self.size,
+            'available': {str(channel_id): len(links) for channel_id, links in self._links.items()},
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+FAN-OUT DE MEDIOS CON FILE_ID EN CACHÉ
+======================================
+Un medio remoto se descarga y se sube a Telegram una sola vez por broadcast;
+el file_id devuelto se reutiliza con el resto de destinatarios y se guarda
+por hash de contenido para que campañas posteriores no vuelvan a subirlo.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from telegram import InputFile, Message
+
+logger = logging.getLogger(__name__)
+
+# Límite de descarga: Telegram no acepta subidas de bots mayores a 50 MB
+MAX_MEDIA_BYTES = 50 * 1024 * 1024
+
+
+def is_remote_media(value: Any) -> bool:
+    """True si el medio es una URL (y no un file_id ya subido)"""
+    return isinstance(value, str) and value.startswith(("http://", "https://"))
+
+
+def extract_file_id(message: Message, media_type: str) -> Optional[str]:
+    """Obtener el file_id del medio contenido en un mensaje enviado"""
+    if media_type == 'photo' and message.photo:
+        return message.photo[-1].file_id
+    if media_type == 'video' and message.video:
+        return message.video.file_id
+    if media_type == 'animation':
+        # Telegram puede devolver un GIF como animation o como document
+        media = message.animation or message.document
+        return media.file_id if media else None
+    return None
+
+
+async def fetch_media(url: str) -> bytes:
+    """Descargar un medio remoto respetando el límite de tamaño"""
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            data = await response.content.read(MAX_MEDIA_BYTES + 1)
+
+    if len(data) > MAX_MEDIA_BYTES:
+        raise ValueError(f"Media at {url} exceeds {MAX_MEDIA_BYTES} bytes")
+
+    return data
+
+
+class MediaFanout:
+    """Sube un medio una sola vez y reutiliza su file_id en todo el broadcast"""
+
+    def __init__(self, media_type: str, source: str, manager):
+        self.media_type = media_type
+        self.source = source
+        self.manager = manager
+        self.file_id: Optional[str] = None
+        self.content_hash: Optional[str] = None
+        self._data: Optional[bytes] = None
+        self._lock = asyncio.Lock()
+
+    async def prepare(self) -> None:
+        """Descargar el medio y buscar un file_id previo por hash de contenido"""
+        self._data = await fetch_media(self.source)
+        self.content_hash = hashlib.sha256(self._data).hexdigest()
+        self.file_id = await self.manager.get_cached_file_id(self.content_hash, self.media_type)
+
+        if self.file_id:
+            self._data = None
+            logger.info(f"Media cache hit for {self.media_type} {self.content_hash[:12]}")
+
+    async def send(self, deliver: Callable[[Any], Awaitable[Message]]) -> Message:
+        """
+        Entregar usando el file_id en caché; el primer envío sin file_id sube
+        los bytes mientras el resto de workers espera a que quede disponible.
+        """
+        if self.file_id:
+            return await deliver(self.file_id)
+
+        async with self._lock:
+            if self.file_id is None:
+                filename = os.path.basename(urlparse(self.source).path) or self.media_type
+                message = await deliver(InputFile(self._data, filename=filename))
+                self.file_id = extract_file_id(message, self.media_type)
+
+                if self.file_id:
+                    self._data = None
+                    try:
+                        await self.manager.store_cached_file_id(
+                            self.content_hash, self.media_type, self.file_id, self.source
+                        )
+                    except Exception as e:
+                        logger.warning(f"Failed to cache file_id for {self.content_hash[:12]}: {e}")
+
+                return message
+
+        return await deliver(self.file_id)
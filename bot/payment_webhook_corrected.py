@@ -18,7 +18,8 @@ from typing import Dict, Any, Optional
 import asyncio
 
 from bot.config import BOT_TOKEN, WEBHOOK_PORT, BOLD_WEBHOOK_SECRET, SECURITY_CONFIG
-from bot.enhanced_subscriber_manager import get_subscriber_manager  # ✅ CORREGIDO: Import correcto
+from bot.enhanced_subscriber_manager import get_subscriber_manager, cleanup_subscriber_manager  # ✅ CORREGIDO: Import correcto
+from bot.dispatcher import Lane, get_dispatcher
 from telegram import Bot
 from telegram.error import TelegramError
 
@@ -320,7 +321,9 @@ Invitation links to your channels have been sent automatically.
 
 Thank you for joining PNP Television! 🚀"""
         
-        await bot.send_message(
+        await get_dispatcher().call(
+            Lane.TRANSACTIONAL,
+            bot.send_message,
             chat_id=user_id,
             text=confirmation_message,
             parse_mode='Markdown'
@@ -373,7 +376,9 @@ Include your transaction ID: `{transaction_id}`
 
 Thank you for your patience! 🙏"""
         
-        await bot.send_message(
+        await get_dispatcher().call(
+            Lane.TRANSACTIONAL,
+            bot.send_message,
             chat_id=user_id,
             text=error_message,
             parse_mode='Markdown'
@@ -404,7 +409,9 @@ Consider following up with VIP support."""
         # Notificar a administradores principales
         for admin_id in ADMIN_IDS[:3]:  # Solo primeros 3 admins
             try:
-                await bot.send_message(
+                await get_dispatcher().call(
+                    Lane.SUPPORT,
+                    bot.send_message,
                     chat_id=admin_id,
                     text=admin_message,
                     parse_mode='Markdown'
@@ -414,7 +421,9 @@ Consider following up with VIP support."""
         
         # Notificar chat de servicio al cliente si está configurado
         if CUSTOMER_SERVICE_CHAT_ID:
-            await bot.send_message(
+            await get_dispatcher().call(
+                Lane.SUPPORT,
+                bot.send_message,
                 chat_id=CUSTOMER_SERVICE_CHAT_ID,
                 text=admin_message,
                 parse_mode='Markdown'
@@ -462,7 +471,9 @@ async def notify_admins_payment_error(payment_data: Dict, error_msg: str):
         
         # Notificar solo al primer admin para evitar spam
         if ADMIN_IDS:
-            await bot.send_message(
+            await get_dispatcher().call(
+                Lane.SUPPORT,
+                bot.send_message,
                 chat_id=ADMIN_IDS[0],
                 text=error_message,
                 parse_mode='Markdown'
@@ -470,7 +481,9 @@ async def notify_admins_payment_error(payment_data: Dict, error_msg: str):
         
         # Notificar chat de servicio al cliente
         if CUSTOMER_SERVICE_CHAT_ID:
-            await bot.send_message(
+            await get_dispatcher().call(
+                Lane.SUPPORT,
+                bot.send_message,
                 chat_id=CUSTOMER_SERVICE_CHAT_ID,
                 text=error_message,
                 parse_mode='Markdown'
@@ -479,6 +492,17 @@ async def notify_admins_payment_error(payment_data: Dict, error_msg: str):
     except Exception as e:
         logger.error(f"Failed to notify admins of payment error: {e}")
 
+@app.on_event("startup")
+async def start_invite_pool():
+    """Pre-generar enlaces de invitación solo aquí, donde se otorga el acceso tras el pago"""
+    manager = await get_subscriber_manager()
+    manager.invite_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown_subscriber_manager():
+    """Volcar escrituras y logs de actividad en buffer antes de cerrar el pool"""
+    await cleanup_subscriber_manager()
+
 @app.get("/")
 async def root():
     """Endpoint de información del webhook"""
@@ -690,6 +714,9 @@ async def get_webhook_metrics():
             "cors_enabled": True,
             "rate_limiting": True
         },
+        "outbound_dispatcher": get_dispatcher().get_metrics(),
+        "invite_pool": (await get_subscriber_manager()).invite_pool.get_metrics(),
+        "activity_log": (await get_subscriber_manager()).activity_log.get_metrics(),
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+CONTROL DE TASA PARA ENVÍOS A TELEGRAM
+======================================
+Token bucket global, control adaptativo ante RetryAfter y espaciado por chat
+para los envíos concurrentes
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Token bucket asíncrono que limita la tasa global de llamadas a la API"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("Rate must be greater than zero")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """Reponer tokens según el tiempo transcurrido"""
+        now = time.monotonic()
+        # `_updated` puede estar en el futuro (fin de una pausa): hasta entonces no se repone nada
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def _blocked_for(self) -> float:
+        """Segundos durante los que no se puede conceder ningún token"""
+        return 0.0
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Esperar hasta disponer de `tokens` y consumirlos.
+
+        El lock mantiene el orden de llegada: quien espera primero sale primero.
+
+        Returns:
+            float: segundos esperados
+        """
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                # Se comprueba dentro del lock: quien ya esperaba aquí también respeta una pausa nueva
+                blocked = self._blocked_for()
+                if blocked > 0:
+                    await asyncio.sleep(blocked)
+                    continue
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return time.monotonic() - start
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class AdaptiveRateController(TokenBucket):
+    """
+    Token bucket con tasa adaptativa (AIMD) compartido por todos los workers.
+
+    Un RetryAfter reduce la tasa multiplicativamente y pausa a todos los
+    envíos durante `retry_after`; cada envío exitoso la vuelve a subir de
+    forma aditiva (≈ `increase_step` msg/s por segundo) hasta `max_rate`.
+    La cuota entre procesos (`set_max_rate`) solo acota la tasa: el valor AIMD
+    se conserva en `rate_before_clamp` y se recupera al subir la cuota.
+    Los RetryAfter que llegan durante una pausa pertenecen al mismo episodio
+    (requests que ya estaban en vuelo) y solo alargan la pausa.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        min_rate: float = 1.0,
+        increase_step: float = 1.0,
+        decrease_factor: float = 0.5
+    ):
+        super().__init__(max_rate)
+        self.max_rate = max_rate
+        self.ceiling = max_rate
+        self.rate_before_clamp = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.throttle_events = 0
+        self.last_throttle_at: Optional[float] = None
+        self._paused_until = 0.0
+
+    @property
+    def current_rate(self) -> float:
+        return self.rate
+
+    @property
+    def pause_remaining(self) -> float:
+        """Segundos que quedan de la pausa global (0 si no hay pausa)"""
+        return max(0.0, self._blocked_for())
+
+    def _blocked_for(self) -> float:
+        """Tiempo restante de la pausa global"""
+        return self._paused_until - time.monotonic()
+
+    def on_throttle(self, retry_after: float) -> None:
+        """Registrar un RetryAfter: recortar la tasa una vez por episodio y pausar a todos los workers"""
+        now = time.monotonic()
+        new_episode = now >= self._paused_until
+
+        self._paused_until = max(self._paused_until, now + max(0.0, retry_after))
+        # Sin tokens acumulados durante la pausa: al terminar no hay ráfaga
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+        if new_episode:
+            self.rate_before_clamp = max(self.min_rate, self.rate * self.decrease_factor)
+            self.rate = min(self.rate_before_clamp, self.max_rate)
+            self.throttle_events += 1
+            self.last_throttle_at = now
+
+    def set_max_rate(self, max_rate: float) -> None:
+        """Cambiar el techo (cuota entre procesos) sin perder el recorte AIMD pendiente"""
+        max_rate = max(self.min_rate, max_rate)
+        self._refill()
+        self.ceiling = max(self.ceiling, max_rate)
+        self.max_rate = max_rate
+        self.rate = min(self.rate_before_clamp, max_rate)
+        self.capacity = max(1.0, max_rate)
+        self._tokens = min(self._tokens, self.capacity)
+
+    def on_success(self) -> None:
+        """Subida aditiva: +increase_step msg/s por cada `rate` envíos exitosos"""
+        if self.rate_before_clamp < self.ceiling:
+            self._refill()
+            self.rate_before_clamp = min(self.ceiling, self.rate_before_clamp + self.increase_step / self.rate)
+            self.rate = min(self.rate_before_clamp, self.max_rate)
+
+
+class ChatPacer:
+    """Espaciado mínimo entre mensajes consecutivos al mismo chat"""
+
+    # Tamaño a partir del cual se purgan chats inactivos
+    _PRUNE_THRESHOLD = 10_000
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_allowed: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        """Esperar el turno del chat y reservar el siguiente hueco"""
+        if self.min_interval <= 0:
+            return
+
+        now = time.monotonic()
+        if len(self._next_allowed) > self._PRUNE_THRESHOLD:
+            self._prune(now)
+
+        slot = max(now, self._next_allowed.get(chat_id, now))
+        # Reservar antes de dormir para que envíos concurrentes al mismo chat se encadenen
+        self._next_allowed[chat_id] = slot + self.min_interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _prune(self, now: float) -> None:
+        """Eliminar chats cuyo hueco ya expiró"""
+        self._next_allowed = {
+            chat_id: slot for chat_id, slot in self._next_allowed.items() if slot > now
+        }
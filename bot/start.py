@@ -14,6 +14,7 @@ import importlib
 import asyncio
 from bot.texts import TEXTS
 from bot.config import BOT_TOKEN, ADMIN_IDS, CUSTOMER_SERVICE_CHAT_ID
+from bot.dispatcher import Lane, get_dispatcher
 
 # Verificar que no se ejecute directamente
 if __name__ == "__main__":
@@ -224,6 +225,9 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'photo': None,
         'video': None,
         'animation': None,
+        'from_chat_id': None,
+        'message_ids': [],
+        'media_group_id': None,
         'audience': 'all',
         'language': None
     }
@@ -262,10 +266,17 @@ async def broadcast_text_handler(update: Update, context: ContextTypes.DEFAULT_T
         broadcast_data[user_id]['animation'] = update.message.animation.file_id
         broadcast_data[user_id]['text'] = update.message.caption
         content_type = "🎬 GIF"
+    elif update.message.effective_attachment:
+        content_type = "📎 Archivo"
     else:
         await update.message.reply_text("❌ Tipo de contenido no soportado. Intenta de nuevo.")
         return BROADCAST_TEXT
     
+    # El broadcast copia el mensaje original (conserva formato, entidades y álbumes)
+    broadcast_data[user_id]['from_chat_id'] = update.effective_chat.id
+    broadcast_data[user_id]['message_ids'] = [update.message.message_id]
+    broadcast_data[user_id]['media_group_id'] = update.message.media_group_id
+    
     # Mostrar opciones de audiencia
     keyboard = [
         [InlineKeyboardButton("🌍 Todos los usuarios", callback_data="audience_all")],
@@ -284,6 +295,17 @@ async def broadcast_text_handler(update: Update, context: ContextTypes.DEFAULT_T
     
     return BROADCAST_AUDIENCE
 
+async def broadcast_album_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Agregar los demás elementos de un álbum al broadcast en curso"""
+    user_id = update.effective_user.id
+    data = broadcast_data.get(user_id)
+    media_group_id = update.message.media_group_id
+    
+    if data and media_group_id and media_group_id == data.get('media_group_id'):
+        data['message_ids'].append(update.message.message_id)
+    
+    return BROADCAST_AUDIENCE
+
 async def broadcast_audience_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manejar selección de audiencia"""
     query = update.callback_query
@@ -345,8 +367,7 @@ async def broadcast_language_callback(update: Update, context: ContextTypes.DEFA
         elif broadcast_data[user_id]['audience'] == 'never':
             status_filter = ['never']
         
-        users = await manager.get_users(language=lang_filter, statuses=status_filter)
-        audience_count = len(users)
+        audience_count = await manager.count_audience(language=lang_filter, statuses=status_filter)
         
     except Exception as e:
         logger.error(f"Error calculating audience: {e}")
@@ -424,35 +445,108 @@ async def broadcast_confirm_callback(update: Update, context: ContextTypes.DEFAU
         
         await query.edit_message_text("📤 **Enviando broadcast...**\n\nEsto puede tomar unos momentos.")
         
-        # Enviar broadcast usando el sistema existente
-        from bot.broadcast_manager import broadcast_manager
+        # El envío corre en segundo plano para que el botón de detener siga respondiendo
+        context.application.create_task(
+            _run_broadcast_with_progress(query, user_id, dict(data), lang_filter, status_filter)
+        )
         
-        await broadcast_manager.send(
-            text=data['text'],
-            photo=data.get('photo'),
-            video=data.get('video'),
-            animation=data.get('animation'),
+    except Exception as e:
+        logger.error(f"Error sending broadcast: {e}")
+        await query.edit_message_text(f"❌ **Error enviando broadcast:**\n\n{str(e)}")
+    
+    # Limpiar datos
+    if user_id in broadcast_data:
+        del broadcast_data[user_id]
+    
+    return ConversationHandler.END
+
+def _format_eta(seconds: float) -> str:
+    """Formatear un ETA en horas/minutos/segundos"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+def _format_broadcast_progress(event: dict) -> str:
+    """Texto del mensaje de progreso de un broadcast"""
+    titles = {
+        'running': '📤 **Enviando broadcast...**',
+        'completed': '✅ **Broadcast enviado exitosamente!**',
+        'cancelled': '⏹️ **Broadcast detenido**'
+    }
+    
+    text = f"""{titles[event['state']]}
+
+📊 **Procesados:** {event['processed']}/{event['target_users'] or '?'}
+✅ **Enviados:** {event['sent']}
+❌ **Fallidos:** {event['failed']} (🚫 bloqueados: {event['blocked']})
+⚡ **Velocidad:** {event['messages_per_second']:.1f} msg/s (límite actual {event['current_rate']:.0f} msg/s)"""
+    
+    if event['state'] == 'running' and event['eta_seconds'] is not None:
+        text += f"\n⏱️ **Tiempo restante:** ~{_format_eta(event['eta_seconds'])}"
+    elif event['state'] != 'running':
+        text += f"\n⏱️ **Duración:** {_format_eta(event['elapsed_seconds'])}"
+    
+    return text
+
+async def _run_broadcast_with_progress(query, admin_id: int, data: dict, lang_filter, status_filter):
+    """Ejecutar el broadcast editando el mensaje del admin con el progreso"""
+    from bot.broadcast_manager_corrected import broadcast_manager
+    
+    dispatcher = get_dispatcher()
+    
+    async def on_progress(event: dict) -> None:
+        keyboard = None
+        if event['state'] == 'running':
+            keyboard = InlineKeyboardMarkup([[
+                InlineKeyboardButton("⏹️ Detener envío", callback_data=f"stop_broadcast:{event['broadcast_id']}")
+            ]])
+        
+        await dispatcher.call(
+            Lane.SUPPORT,
+            query.edit_message_text,
+            _format_broadcast_progress(event),
+            parse_mode='Markdown',
+            reply_markup=keyboard
+        )
+    
+    try:
+        # Enviar broadcast copiando el mensaje original del admin
+        result = await broadcast_manager.send(
+            from_chat_id=data['from_chat_id'],
+            message_ids=sorted(data['message_ids']),
             language=lang_filter,
             statuses=status_filter,
-            parse_mode='Markdown'
+            progress_callback=on_progress
         )
         
-        await query.edit_message_text(
-            "✅ **Broadcast enviado exitosamente!**\n\n"
-            "📊 Todos los usuarios de la audiencia seleccionada han recibido el mensaje."
+        logger.info(
+            f"Broadcast {result['broadcast_id']} by admin {admin_id} to audience: {data['audience']}, "
+            f"language: {lang_filter} {'cancelled' if result['cancelled'] else 'completed'}"
         )
         
-        logger.info(f"Broadcast sent by admin {user_id} to audience: {data['audience']}, language: {lang_filter}")
-        
     except Exception as e:
         logger.error(f"Error sending broadcast: {e}")
         await query.edit_message_text(f"❌ **Error enviando broadcast:**\n\n{str(e)}")
+
+async def broadcast_stop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Detener un broadcast en curso desde el botón del mensaje de progreso"""
+    query = update.callback_query
     
-    # Limpiar datos
-    if user_id in broadcast_data:
-        del broadcast_data[user_id]
+    if query.from_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Solo administradores", show_alert=True)
+        return
     
-    return ConversationHandler.END
+    from bot.broadcast_manager_corrected import broadcast_manager
+    
+    broadcast_id = query.data.split(":", 1)[1]
+    
+    if broadcast_manager.cancel(broadcast_id):
+        await query.answer("⏹️ Deteniendo broadcast...")
+    else:
+        await query.answer("Este broadcast ya terminó", show_alert=True)
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancelar broadcast"""
@@ -496,7 +590,9 @@ async def handle_customer_message(update: Update, context: ContextTypes.DEFAULT_
 
             # Enviar al chat de soporte
             bot = Bot(token=BOT_TOKEN)
-            await bot.send_message(
+            await get_dispatcher().call(
+                Lane.SUPPORT,
+                bot.send_message,
                 chat_id=CUSTOMER_SERVICE_CHAT_ID,
                 text=support_message,
                 parse_mode='Markdown'
@@ -546,7 +642,9 @@ async def reply_to_customer(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Enviar respuesta al cliente
         bot = Bot(token=BOT_TOKEN)
-        await bot.send_message(
+        await get_dispatcher().call(
+            Lane.SUPPORT,
+            bot.send_message,
             chat_id=customer_id,
             text=f"👨‍💼 **Soporte PNP Television**\n\n{response_message}\n\n"
                  f"¿Necesitas más ayuda? Solo escribe tu pregunta.",
@@ -605,13 +703,17 @@ async def register_smart_handlers(application: Application):
             entry_points=[CommandHandler("broadcast", broadcast_command)],
             states={
                 BROADCAST_TEXT: [MessageHandler(filters.ALL & ~filters.COMMAND, broadcast_text_handler)],
-                BROADCAST_AUDIENCE: [CallbackQueryHandler(broadcast_audience_callback, pattern="^audience_")],
+                BROADCAST_AUDIENCE: [
+                    CallbackQueryHandler(broadcast_audience_callback, pattern="^audience_"),
+                    MessageHandler(filters.ATTACHMENT & ~filters.COMMAND, broadcast_album_handler)
+                ],
                 BROADCAST_LANGUAGE: [CallbackQueryHandler(broadcast_language_callback, pattern="^lang_")],
                 BROADCAST_CONFIRM: [CallbackQueryHandler(broadcast_confirm_callback, pattern="^(confirm|cancel)_broadcast$")]
             },
             fallbacks=[CommandHandler("cancel", cancel_broadcast)]
         )
         application.add_handler(broadcast_conversation)
+        application.add_handler(CallbackQueryHandler(broadcast_stop_callback, pattern="^stop_broadcast:"))
         logger.info("✅ Broadcast conversation handler registered")
         
         # ===== SERVICIO AL CLIENTE =====
@@ -692,7 +794,7 @@ async def register_smart_handlers(application: Application):
 # ==========================================
 
 async def start_automation_tasks():
-    """Iniciar tareas de automatización en background con recordatorios"""
+    """Iniciar el planificador de expiraciones y recordatorios de renovación"""
     try:
         logger.info("🤖 Starting automation tasks...")
         
@@ -700,36 +802,8 @@ async def start_automation_tasks():
         
         manager = await get_subscriber_manager()
         
-        async def automation_loop():
-            while True:
-                try:
-                    logger.info("🔄 Running automated subscription check...")
-                    
-                    # Verificar suscripciones expiradas
-                    expired_users = await manager.check_expired_subscriptions()
-                    
-                    if expired_users:
-                        logger.info(f"📊 Processed {len(expired_users)} expired subscriptions")
-                    else:
-                        logger.info("📊 No expired subscriptions found")
-                    
-                    # Verificar recordatorios de renovación
-                    reminded_users = await manager.check_renewal_reminders()
-                    
-                    if reminded_users:
-                        logger.info(f"📧 Sent {len(reminded_users)} renewal reminders")
-                    else:
-                        logger.info("📧 No renewal reminders needed")
-                    
-                    # Esperar 1 hora antes del siguiente check
-                    await asyncio.sleep(3600)
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error in automation loop: {e}")
-                    await asyncio.sleep(300)  # Esperar 5 minutos si hay error
-        
-        # Iniciar loop de automatización
-        asyncio.create_task(automation_loop())
+        # Revoca accesos y envía recordatorios a la hora exacta de cada vencimiento
+        manager.scheduler.start()
         logger.info("✅ Automation tasks started successfully")
         
     except Exception as e:
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+PLANIFICADOR DE EXPIRACIONES Y RECORDATORIOS
+============================================
+En lugar de barrer la tabla cada hora, mantiene los próximos vencimientos
+(expiraciones y recordatorios) en un min-heap cargado con una consulta
+indexada, duerme exactamente hasta el siguiente y se despierta antes si
+add_subscriber cambia una fecha de expiración. Los pagos llegan al proceso
+del webhook y el planificador corre en el del bot: el aviso viaja por
+NOTIFY en el canal `subscription_expiry`.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+from bot.config import EXPIRY_CONFIG, REMINDER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+EXPIRY = 'expiry'
+REMINDER = 'reminder'
+
+# Vencimientos que caen dentro de esta ventana se procesan en la misma pasada
+_BATCH_GRACE_SECONDS = 1.0
+
+# Canal NOTIFY con los vencimientos nuevos de add_subscriber (payload JSON de epochs)
+EXPIRY_CHANNEL = 'subscription_expiry'
+
+
+def _epoch(value: datetime) -> float:
+    """Las fechas sin zona de la base se guardan en UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+async def publish_expiry_change(conn, expires_at: datetime, reminder_times: List[datetime]) -> None:
+    """Avisar al planificador de cualquier proceso (se entrega al confirmar la transacción)"""
+    payload = json.dumps({
+        'expiry': _epoch(expires_at),
+        'reminders': [_epoch(due_at) for due_at in reminder_times]
+    })
+    await conn.execute("SELECT pg_notify($1, $2)", EXPIRY_CHANNEL, payload)
+
+
+class SubscriptionScheduler:
+    """Un único timer sobre un min-heap de (vence_en epoch, tipo)"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._heap: List[Tuple[float, str]] = []
+        self._changed = asyncio.Event()
+        self._reload_at = 0.0
+        # Barridos que no procesan nada se espacian de forma exponencial
+        self._not_before = 0.0
+        self._idle_backoff = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._listener = None
+        self.runs = {EXPIRY: 0, REMINDER: 0}
+
+    def start(self) -> None:
+        """Arrancar el planificador y su LISTEN (idempotente)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_loop())
+            asyncio.create_task(self._start_listener())
+            logger.info("✅ Subscription scheduler started")
+
+    def notify_expiry_changed(self, expires_at: datetime, reminder_times: List[datetime]) -> None:
+        """Programar la expiración y los recordatorios de una fecha nueva o extendida"""
+        if self._task is None:
+            return
+
+        heapq.heappush(self._heap, (self._epoch(expires_at), EXPIRY))
+        for due_at in reminder_times:
+            heapq.heappush(self._heap, (self._epoch(due_at), REMINDER))
+        self._changed.set()
+
+    @staticmethod
+    def _epoch(value: datetime) -> float:
+        """Las fechas sin zona de la base se guardan en UTC"""
+        return _epoch(value)
+
+    async def _start_listener(self) -> None:
+        """Escuchar los vencimientos publicados por otros procesos (LISTEN/NOTIFY)"""
+        while self._task is not None and not self._task.done():
+            try:
+                conn = await asyncpg.connect(dsn=self.manager.db_url)
+                await conn.add_listener(EXPIRY_CHANNEL, self._on_expiry_notification)
+                conn.add_termination_listener(self._on_listener_lost)
+                self._listener = conn
+                logger.info("✅ Listening for subscription expiry changes")
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Could not start expiry listener, relying on periodic reloads: {e}")
+                await asyncio.sleep(30)
+
+    def _on_expiry_notification(self, conn, pid, channel, payload) -> None:
+        """NOTIFY recibido: programar la expiración y los recordatorios publicados"""
+        try:
+            change = json.loads(payload)
+            entries = [(float(change['expiry']), EXPIRY)]
+            entries += [(float(due_at), REMINDER) for due_at in change.get('reminders', [])]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed {channel} payload: {payload!r}")
+            return
+
+        for entry in entries:
+            heapq.heappush(self._heap, entry)
+        self._changed.set()
+
+    def _on_listener_lost(self, conn) -> None:
+        """Conexión LISTEN perdida: recargar desde la base (pudo perderse un aviso) y reconectar"""
+        self._listener = None
+        if self._task is not None and not self._task.done():
+            logger.warning("⚠️ Expiry listener lost, reloading and reconnecting")
+            self._reload_at = 0.0
+            self._changed.set()
+            asyncio.create_task(self._start_listener())
+
+    async def _load(self) -> None:
+        """Reconstruir el heap con los vencimientos del próximo intervalo de recarga"""
+        horizon = EXPIRY_CONFIG["reload_interval"]
+        limit = EXPIRY_CONFIG["load_limit"]
+
+        async with self.manager.pool.acquire() as conn:
+            # Segundos restantes calculados en la base para no depender del huso del proceso
+            expiries = await conn.fetch(
+                """
+                SELECT EXTRACT(EPOCH FROM (GREATEST(expires_at, next_attempt_at) - NOW()))::float8 AS seconds_left
+                FROM subscribers
+                WHERE revoked_at IS NULL
+                AND access_state <> 'revoke_failed'
+                AND expires_at <= NOW() + make_interval(secs => $1)
+                AND (next_attempt_at IS NULL OR next_attempt_at <= NOW() + make_interval(secs => $1))
+                ORDER BY expires_at
+                LIMIT $2
+                """,
+                horizon, limit
+            )
+            # Una consulta por etapa para recorrer el índice (stage, due_at) en orden
+            reminders = []
+            for days in REMINDER_CONFIG["stages"]:
+                reminders += await conn.fetch(
+                    """
+                    SELECT EXTRACT(EPOCH FROM (
+                        GREATEST(due_at, claimed_at + make_interval(secs => $4)) - NOW()
+                    ))::float8 AS seconds_left
+                    FROM subscription_reminders
+                    WHERE stage = $1
+                    AND sent_at IS NULL
+                    AND due_at <= NOW() + make_interval(secs => $2)
+                    ORDER BY due_at
+                    LIMIT $3
+                    """,
+                    days, horizon, limit, REMINDER_CONFIG["claim_timeout"]
+                )
+
+        now = time.time()
+        self._heap = [(now + row['seconds_left'], EXPIRY) for row in expiries]
+        self._heap += [(now + row['seconds_left'], REMINDER) for row in reminders]
+        heapq.heapify(self._heap)
+
+        # Con el límite alcanzado, recargar en cuanto se agote lo cargado (nunca en bucle:
+        # si todo lo cargado ya venció, la recarga espera `min_sweep_interval`)
+        self._reload_at = now + horizon
+        if len(expiries) >= limit or len(reminders) >= limit:
+            self._reload_at = max(
+                now + EXPIRY_CONFIG["min_sweep_interval"],
+                min(self._reload_at, max(entry[0] for entry in self._heap))
+            )
+
+        logger.info(f"📅 Subscription scheduler loaded {len(expiries)} expiries and {len(reminders)} reminders")
+
+    async def _run_loop(self) -> None:
+        """Dormir hasta el próximo vencimiento, procesar lo vencido y repetir"""
+        while True:
+            try:
+                if time.time() >= self._reload_at:
+                    await self._load()
+
+                self._changed.clear()
+                now = time.time()
+                wake_at = min(self._heap[0][0], self._reload_at) if self._heap else self._reload_at
+                wake_at = max(wake_at, self._not_before)
+
+                if wake_at > now:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=wake_at - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                due = set()
+                while self._heap and self._heap[0][0] <= now + _BATCH_GRACE_SECONDS:
+                    due.add(heapq.heappop(self._heap)[1])
+
+                # Las consultas reclaman todo lo vencido: entradas obsoletas no cuestan más que una consulta vacía
+                progress = False
+                if EXPIRY in due:
+                    expired_users = await self.manager.check_expired_subscriptions()
+                    self.runs[EXPIRY] += 1
+                    if expired_users:
+                        progress = True
+                        logger.info(f"📊 Processed {len(expired_users)} expired subscriptions")
+
+                if REMINDER in due:
+                    reminded_users = await self.manager.check_renewal_reminders()
+                    self.runs[REMINDER] += 1
+                    if reminded_users:
+                        progress = True
+                        logger.info(f"📧 Sent {len(reminded_users)} renewal reminders")
+
+                self._record_progress(progress)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error in subscription scheduler: {e}")
+                await asyncio.sleep(EXPIRY_CONFIG["error_backoff"])
+
+    def _record_progress(self, progress: bool) -> None:
+        """Sin progreso, retrasar el siguiente barrido (min_sweep_interval, duplicando hasta error_backoff)"""
+        if progress:
+            self._idle_backoff = 0.0
+        else:
+            self._idle_backoff = min(
+                max(EXPIRY_CONFIG["min_sweep_interval"], self._idle_backoff * 2),
+                EXPIRY_CONFIG["error_backoff"]
+            )
+        self._not_before = time.time() + self._idle_backoff
+
+    async def close(self) -> None:
+        """Detener el planificador"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.remove_termination_listener(self._on_listener_lost)
+            await listener.close()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+CLASIFICACIÓN DE ERRORES DE TELEGRAM
+====================================
+Traduce las excepciones de python-telegram-bot a una decisión: frenar y
+reintentar, reintentar, o rendirse. Un error permanente (usuario que bloqueó
+el bot, chat inexistente, petición inválida) nunca se reintenta.
+"""
+
+from enum import Enum
+
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Conflict,
+    Forbidden,
+    InvalidToken,
+    NetworkError,
+    RetryAfter,
+    TimedOut,
+)
+
+# Descripciones de BadRequest que significan que el destinatario ya no existe
+_NOT_FOUND_MARKERS = ("chat not found", "user not found", "peer_id_invalid")
+
+
+class ErrorKind(Enum):
+    """Qué hacer ante un error de la API"""
+    THROTTLE = 'throttle'    # RetryAfter: frenar la tasa global y reintentar
+    RETRY = 'retry'          # Fallo transitorio de red o del servidor
+    BLOCKED = 'blocked'      # Forbidden: el usuario bloqueó el bot o lo expulsó
+    NOT_FOUND = 'not_found'  # El chat o la cuenta ya no existen
+    PERMANENT = 'permanent'  # Cualquier otro rechazo definitivo
+
+    @property
+    def retryable(self) -> bool:
+        """True si tiene sentido volver a intentar la misma llamada"""
+        return self in (ErrorKind.THROTTLE, ErrorKind.RETRY)
+
+
+def classify_error(error: Exception) -> ErrorKind:
+    """Clasificar una excepción por su tipo"""
+    if isinstance(error, RetryAfter):
+        return ErrorKind.THROTTLE
+    if isinstance(error, Forbidden):
+        return ErrorKind.BLOCKED
+    # BadRequest hereda de NetworkError: debe evaluarse antes
+    if isinstance(error, BadRequest):
+        if any(marker in error.message.lower() for marker in _NOT_FOUND_MARKERS):
+            return ErrorKind.NOT_FOUND
+        return ErrorKind.PERMANENT
+    if isinstance(error, (ChatMigrated, InvalidToken)):
+        return ErrorKind.PERMANENT
+    if isinstance(error, (TimedOut, NetworkError, Conflict)):
+        return ErrorKind.RETRY
+    return ErrorKind.PERMANENT
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Predicado `giveup` para backoff: no reintentar errores permanentes"""
+    return not classify_error(error).retryable
@@ -152,7 +152,15 @@ async def start_automation_services():
         
         # Start background tasks
         await start_automation_tasks()
-        
+
+        # Resume broadcasts interrupted by a restart or deploy
+        from bot.broadcast_manager_corrected import get_broadcast_manager
+
+        asyncio.create_task(get_broadcast_manager().resume_jobs())
+
+        # Load the durable broadcast schedule into the timer loop
+        await get_broadcast_manager().start_scheduler()
+
         logger.info("✅ Automation services started successfully")
         
     except Exception as e:
@@ -183,7 +191,13 @@ class GracefulShutdown:
         self.logger.info("🔄 Starting graceful shutdown...")
         
         try:
-            # Cleanup database connections
+            # Stop running broadcasts first so they checkpoint while the pool
+            # is still open; resume_jobs() continues them on the next start
+            from bot.broadcast_manager_corrected import get_broadcast_manager
+            await get_broadcast_manager().shutdown()
+            
+            # Cleanup database connections (flushes buffered user writes and
+            # queued activity logs before the pool closes)
             from bot.enhanced_subscriber_manager import cleanup_subscriber_manager
             await cleanup_subscriber_manager()
             
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Configuración común de las pruebas: entorno mínimo y una base de datos en memoria"""
+
+import os
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, List, Tuple
+
+import pytest
+
+# Importar `bot` desde la raíz del proyecto, como run_bot.py
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+os.environ.setdefault("BOLD_IDENTITY_KEY", "test")
+
+from asyncpg.exceptions import DataError  # noqa: E402
+
+
+def _check_argument(value: Any, position: int) -> None:
+    """asyncpg no codifica datetimes con zona en columnas TIMESTAMP: fallar igual que él"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        raise DataError(f"invalid input for query argument ${position}: {value!r} (can't subtract offset-naive and offset-aware datetimes)")
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            _check_argument(item, position)
+
+
+class FakeConnection:
+    """
+    Conexión asyncpg en memoria.
+
+    Registra cada consulta en `calls` y responde fetch/fetchrow/fetchval con
+    el primer valor de `respond()` cuyo fragmento aparece en el SQL.
+    """
+
+    _DEFAULTS = {'execute': 'OK', 'fetch': [], 'fetchrow': None, 'fetchval': None}
+
+    def __init__(self):
+        self.calls: List[Tuple[str, str, tuple]] = []
+        self._responses: List[Tuple[str, Any]] = []
+
+    def respond(self, fragment: str, value: Any) -> None:
+        self._responses.append((fragment, value))
+
+    def queries(self, fragment: str) -> List[tuple]:
+        """Argumentos de las consultas que contienen `fragment`"""
+        return [args for _, sql, args in self.calls if fragment in sql]
+
+    async def _run(self, kind: str, sql: str, args: tuple) -> Any:
+        for position, value in enumerate(args, start=1):
+            _check_argument(value, position)
+        self.calls.append((kind, sql, args))
+        for fragment, value in self._responses:
+            if fragment in sql:
+                return value(*args) if callable(value) else value
+        return self._DEFAULTS[kind]
+
+    async def execute(self, sql: str, *args) -> Any:
+        return await self._run('execute', sql, args)
+
+    async def fetch(self, sql: str, *args) -> Any:
+        return await self._run('fetch', sql, args)
+
+    async def fetchrow(self, sql: str, *args) -> Any:
+        return await self._run('fetchrow', sql, args)
+
+    async def fetchval(self, sql: str, *args) -> Any:
+        return await self._run('fetchval', sql, args)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    """Pool que entrega siempre la misma FakeConnection"""
+
+    def __init__(self, conn: FakeConnection):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+@pytest.fixture
+def fake_conn() -> FakeConnection:
+    return FakeConnection()
+
+
+@pytest.fixture
+def fake_pool(fake_conn) -> FakePool:
+    return FakePool(fake_conn)
+
+
+@pytest.fixture
+def subscriber_manager(fake_conn):
+    """EnhancedSubscriberManager sobre la base en memoria (sin initialize)"""
+    from bot.enhanced_subscriber_manager import EnhancedSubscriberManager
+
+    manager = EnhancedSubscriberManager()
+    manager.pool = FakePool(fake_conn)
+    return manager
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""add_subscriber: altas nuevas y renovaciones con fechas UTC sin zona"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+
+from bot.config import PLANS
+from bot.subscription_scheduler import EXPIRY_CHANNEL
+
+PLAN = PLANS["trial"]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.mark.asyncio
+async def test_first_subscription_inserts_naive_utc_dates(subscriber_manager, fake_conn):
+    subscriber_manager._grant_channel_access = AsyncMock()
+
+    assert await subscriber_manager.add_subscriber(42, PLAN["name"], transaction_id="TX-1") is True
+
+    (insert,) = fake_conn.queries("INSERT INTO subscribers")
+    start_date, expires_at = insert[2], insert[3]
+    assert start_date.tzinfo is None and expires_at.tzinfo is None
+    assert abs(start_date - _utcnow()) < timedelta(minutes=1)
+    assert expires_at - start_date == timedelta(days=PLAN["duration_days"])
+    subscriber_manager._grant_channel_access.assert_awaited_once_with(42, PLAN["name"])
+
+
+@pytest.mark.asyncio
+async def test_renewal_extends_current_expiry(subscriber_manager, fake_conn):
+    current_expiry = _utcnow() + timedelta(days=3)
+    fake_conn.respond("SELECT expires_at FROM subscribers", {'expires_at': current_expiry})
+    subscriber_manager._grant_channel_access = AsyncMock()
+
+    assert await subscriber_manager.add_subscriber(42, PLAN["name"], transaction_id="TX-2") is True
+
+    (update,) = fake_conn.queries("UPDATE subscribers SET")
+    assert update[0] == current_expiry + timedelta(days=PLAN["duration_days"])
+    assert not fake_conn.queries("INSERT INTO subscribers")
+
+
+@pytest.mark.asyncio
+async def test_new_expiry_is_published_for_the_bot_process_scheduler(subscriber_manager, fake_conn):
+    subscriber_manager._grant_channel_access = AsyncMock()
+
+    assert await subscriber_manager.add_subscriber(42, PLAN["name"], transaction_id="TX-3") is True
+
+    published = [args for args in fake_conn.queries("pg_notify") if args[0] == EXPIRY_CHANNEL]
+    assert len(published) == 1
+    (insert,) = fake_conn.queries("INSERT INTO subscribers")
+    expires_at = insert[3].replace(tzinfo=timezone.utc)
+    assert json.loads(published[0][1])['expiry'] == expires_at.timestamp()
+
+
+@pytest.mark.asyncio
+async def test_subscription_status_is_written_with_the_subscription(subscriber_manager, fake_conn):
+    subscriber_manager._grant_channel_access = AsyncMock(side_effect=RuntimeError("telegram down"))
+
+    await subscriber_manager.add_subscriber(42, PLAN["name"], transaction_id="TX-4")
+
+    kinds = [sql for _, sql, _ in fake_conn.calls]
+    subscription_write = next(i for i, sql in enumerate(kinds) if "INSERT INTO subscribers" in sql)
+    status_write = next(i for i, sql in enumerate(kinds) if "subscription_status = 'active'" in sql)
+    users_write = next(i for i, sql in enumerate(kinds) if "INSERT INTO users" in sql)
+    assert users_write < subscription_write < status_write
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Ciclo de vida de los jobs de broadcast"""
+
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import bot.broadcast_manager_corrected as broadcast_module
+from bot.broadcast_manager_corrected import BroadcastManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    subscriber_manager = MagicMock()
+    subscriber_manager.finish_broadcast_job = AsyncMock()
+    monkeypatch.setattr(broadcast_module, "get_subscriber_manager", AsyncMock(return_value=subscriber_manager))
+    return subscriber_manager
+
+
+@pytest.mark.asyncio
+async def test_job_that_fails_before_sending_is_marked_failed(manager):
+    broadcasts = BroadcastManager(bot=MagicMock())
+    broadcasts._build_message_kwargs = AsyncMock(side_effect=RuntimeError("media upload failed"))
+
+    with pytest.raises(RuntimeError):
+        await broadcasts._execute_job("BC_1", {'text': 'hi'}, datetime.now(timezone.utc))
+
+    manager.finish_broadcast_job.assert_awaited_once_with("BC_1", 'failed', error="media upload failed")
+    assert broadcasts._running_jobs == {}
+    assert broadcasts._job_tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_scheduled_runs_are_tracked_and_cancelled_on_shutdown(manager):
+    broadcasts = BroadcastManager(bot=MagicMock())
+    started = asyncio.Event()
+
+    async def run_scheduled(broadcast_id):
+        started.set()
+        await asyncio.Event().wait()
+
+    broadcasts._run_scheduled = run_scheduled
+    broadcasts._schedule_heap = [(datetime.now(timezone.utc), "BC_1")]
+    broadcasts._ensure_scheduler()
+    await asyncio.wait_for(started.wait(), timeout=1)
+
+    (run,) = broadcasts._scheduled_runs
+    await broadcasts.shutdown(timeout=1)
+
+    assert run.cancelled()
+    assert broadcasts._scheduled_runs == set()
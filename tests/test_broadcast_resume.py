@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Reanudación de broadcasts: checkpoint contiguo y paginación keyset"""
+
+import pytest
+
+from bot.broadcast_manager_corrected import _CompletionWatermark
+
+
+def test_watermark_only_advances_over_a_contiguous_prefix():
+    watermark = _CompletionWatermark(start=10)
+    for user_id in (11, 12, 13, 14):
+        watermark.dispatch(user_id)
+
+    watermark.complete(13)
+    watermark.complete(12)
+    assert watermark.value == 10
+
+    watermark.complete(11)
+    assert watermark.value == 13
+
+    watermark.complete(14)
+    assert watermark.value == 14
+
+
+def test_watermark_starts_empty_without_a_checkpoint():
+    watermark = _CompletionWatermark()
+    watermark.dispatch(1)
+
+    assert watermark.value is None
+    watermark.complete(1)
+    assert watermark.value == 1
+
+
+@pytest.mark.asyncio
+async def test_audience_resumes_after_the_checkpoint_page_by_page(subscriber_manager, fake_conn):
+    users = [{'user_id': user_id, 'language': 'es', 'status': 'active'} for user_id in range(1, 9)]
+
+    def page(*args):
+        *filters, page_size = args
+        after = filters[-1] if filters and isinstance(filters[-1], int) else 0
+        return [row for row in users if row['user_id'] > after][:page_size]
+
+    fake_conn.respond("FROM users u", page)
+
+    seen = [row['user_id'] async for row in subscriber_manager.iter_audience(
+        statuses=['active'], after_user_id=3, page_size=2
+    )]
+
+    assert seen == [4, 5, 6, 7, 8]
+    # Cada página continúa desde el último user_id de la anterior
+    assert [args[-2] for args in fake_conn.queries("FROM users u")] == [3, 5, 7]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Despachador central: prioridad estricta entre carriles"""
+
+import asyncio
+
+import pytest
+
+from bot.dispatcher import Lane, OutboundDispatcher
+from bot.rate_limiter import AdaptiveRateController
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_lanes_are_served_first():
+    dispatcher = OutboundDispatcher(AdaptiveRateController(max_rate=200))
+    # Una pausa retiene al repartidor hasta que todos los carriles están en cola
+    dispatcher.rate_limiter.on_throttle(0.05)
+    served = []
+
+    async def send(name):
+        served.append(name)
+
+    calls = [
+        (Lane.MARKETING, 'marketing-1'),
+        (Lane.REMINDER, 'reminder'),
+        (Lane.MARKETING, 'marketing-2'),
+        (Lane.TRANSACTIONAL, 'invite'),
+        (Lane.SUPPORT, 'support'),
+    ]
+    await asyncio.gather(*(dispatcher.call(lane, send, name) for lane, name in calls))
+
+    assert served == ['invite', 'support', 'reminder', 'marketing-1', 'marketing-2']
+
+
+@pytest.mark.asyncio
+async def test_cancelled_callers_do_not_consume_a_turn():
+    dispatcher = OutboundDispatcher(AdaptiveRateController(max_rate=200))
+    dispatcher.rate_limiter.on_throttle(0.05)
+    served = []
+
+    async def send(name):
+        served.append(name)
+
+    abandoned = asyncio.create_task(dispatcher.call(Lane.TRANSACTIONAL, send, 'abandoned'))
+    waiting = asyncio.create_task(dispatcher.call(Lane.MARKETING, send, 'broadcast'))
+    await asyncio.sleep(0)
+    abandoned.cancel()
+
+    await waiting
+    assert served == ['broadcast']
+    lanes = dispatcher.get_metrics()['lanes']
+    assert lanes['transactional'] == {'queue_depth': 0, 'dispatched': 0, 'avg_wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+    assert lanes['marketing']['dispatched'] == 1
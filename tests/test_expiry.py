@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Barrido de expiraciones: clasificación de fallos de revocación y reintentos"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.error import BadRequest, TimedOut
+
+from bot.config import EXPIRY_CONFIG
+
+
+@pytest.mark.asyncio
+async def test_revoke_batch_separates_gone_permanent_and_transient(subscriber_manager, fake_conn):
+    fake_conn.respond("FROM channel_access", [
+        {'user_id': user_id, 'channel_id': -100, 'channel_name': 'channel_1'} for user_id in (1, 2, 3, 4)
+    ])
+    errors = {
+        2: BadRequest("Chat not found"),
+        3: BadRequest("Not enough rights to restrict/unrestrict chat member"),
+        4: TimedOut(),
+    }
+
+    async def send(method, *args, lane=None, **kwargs):
+        if method.__name__ == 'ban_chat_member' and kwargs['user_id'] in errors:
+            raise errors[kwargs['user_id']]
+
+    subscriber_manager._send_with_retry = send
+
+    done, dead = await subscriber_manager.revoke_channel_access_batch([1, 2, 3, 4])
+
+    assert done == {1, 2}
+    assert dead == {3}
+    (revoked_pairs,) = fake_conn.queries("UPDATE channel_access ca")
+    assert sorted(revoked_pairs[0]) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_expiry_sweep_defers_transient_and_retires_permanent_failures(subscriber_manager, fake_conn):
+    last_attempt = EXPIRY_CONFIG["max_revoke_attempts"] - 1
+    batches = [[
+        {'user_id': 1, 'revoke_attempts': 0},
+        {'user_id': 2, 'revoke_attempts': 0},
+        {'user_id': 3, 'revoke_attempts': 0},
+        {'user_id': 4, 'revoke_attempts': last_attempt},
+    ]]
+    fake_conn.respond("SET access_state = 'revoking'", lambda *args: batches.pop() if batches else [])
+    subscriber_manager.revoke_channel_access_batch = AsyncMock(return_value=({1}, {3}))
+
+    assert await subscriber_manager.check_expired_subscriptions() == [1]
+
+    (revoked,) = fake_conn.queries("SET access_state = 'revoked'")
+    (failed,) = fake_conn.queries("SET access_state = 'revoke_failed'")
+    (released,) = fake_conn.queries("next_attempt_at = NOW() + make_interval")
+    assert revoked[0] == [1]
+    assert failed[0] == [3, 4]
+    assert released[0] == [2]
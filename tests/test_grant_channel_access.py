@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""_grant_channel_access: mensaje de enlaces escapado y fallos de envío aislados"""
+
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from bot.config import PLANS
+
+PLAN = PLANS["trial"]
+
+
+@pytest.mark.asyncio
+async def test_invite_message_failure_keeps_the_committed_access(subscriber_manager, fake_conn):
+    sent_texts = []
+
+    async def send(method, *args, lane=None, **kwargs):
+        if method.__name__ == 'create_chat_invite_link':
+            return SimpleNamespace(invite_link="https://t.me/+ab_cd*ef")
+        sent_texts.append(kwargs['text'])
+        raise BadRequest("Can't parse entities")
+
+    subscriber_manager._send_with_retry = send
+
+    await subscriber_manager._grant_channel_access(42, PLAN["name"])
+
+    assert fake_conn.queries("INSERT INTO channel_access")
+    (text,) = sent_texts
+    assert "channel\\_1" in text
+    assert "https://t.me/+ab\\_cd\\*ef" in text
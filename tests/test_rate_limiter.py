@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Control de tasa: token bucket, recorte AIMD y cuota entre procesos"""
+
+import pytest
+
+from bot.rate_limiter import AdaptiveRateController, TokenBucket
+
+
+def test_quota_changes_keep_the_aimd_reduction():
+    controller = AdaptiveRateController(max_rate=23, min_rate=1)
+    controller.on_throttle(0)
+    assert controller.current_rate == 11.5
+
+    controller.set_max_rate(1)
+    assert controller.current_rate == 1
+    controller.set_max_rate(23)
+    assert controller.current_rate == 11.5
+
+
+def test_rate_follows_the_quota_without_throttling():
+    controller = AdaptiveRateController(max_rate=23, min_rate=1)
+
+    controller.set_max_rate(5)
+    assert controller.current_rate == 5
+    controller.set_max_rate(20)
+    assert controller.current_rate == 20
+
+
+def test_throttles_within_one_pause_cut_the_rate_once():
+    controller = AdaptiveRateController(max_rate=20, min_rate=1)
+
+    controller.on_throttle(5)
+    controller.on_throttle(5)
+
+    assert controller.current_rate == 10
+    assert controller.throttle_events == 1
+    assert controller.pause_remaining > 4
+
+
+def test_rate_never_drops_below_the_floor():
+    controller = AdaptiveRateController(max_rate=4, min_rate=2)
+
+    for _ in range(3):
+        controller.on_throttle(0)
+
+    assert controller.current_rate == 2
+
+
+def test_success_raises_the_rate_additively_up_to_the_ceiling():
+    controller = AdaptiveRateController(max_rate=10, min_rate=1, increase_step=1)
+    controller.on_throttle(0)
+
+    for _ in range(5):
+        controller.on_success()
+    assert 5 < controller.current_rate < 6
+
+    for _ in range(100):
+        controller.on_success()
+    assert controller.current_rate == 10
+
+
+@pytest.mark.asyncio
+async def test_bucket_spaces_calls_once_the_burst_is_spent():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    assert await bucket.acquire() < 0.005
+    assert await bucket.acquire() >= 0.015
+
+
+@pytest.mark.asyncio
+async def test_throttle_pauses_every_caller():
+    controller = AdaptiveRateController(max_rate=100)
+    controller.on_throttle(0.05)
+
+    assert await controller.acquire() >= 0.05
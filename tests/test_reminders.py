@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Recordatorios de renovación: una etapa por usuario y envío confirmado"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from telegram.error import Forbidden, TimedOut
+
+from bot.config import REMINDER_CONFIG
+
+
+@pytest.mark.asyncio
+async def test_reminders_are_marked_sent_only_after_delivery(subscriber_manager, fake_conn):
+    expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=30)
+    claimed = [
+        {'user_id': user_id, 'stage': 1, 'plan': 'Trial', 'expires_at': expires_at}
+        for user_id in (10, 11, 12)
+    ]
+    fake_conn.respond("SET claimed_at = NOW()", lambda stage, timeout: claimed if stage == 1 else [])
+    errors = {11: Forbidden("bot was blocked by the user"), 12: TimedOut()}
+    texts = {}
+
+    async def send(method, *args, lane=None, **kwargs):
+        if kwargs['chat_id'] in errors:
+            raise errors[kwargs['chat_id']]
+        texts[kwargs['chat_id']] = kwargs['text']
+
+    subscriber_manager._send_with_retry = send
+
+    assert await subscriber_manager.check_renewal_reminders() == [10]
+
+    # Días reales hasta el vencimiento, no los nominales de la etapa
+    assert "expires in 2 days" in texts[10]
+    assert fake_conn.queries("SET sent_at = NOW(), claimed_at = NULL") == [([10], [1])]
+    # Primero se omiten las etapas anteriores ya vencidas; después, los rechazos definitivos
+    assert fake_conn.queries("skipped = TRUE") == [(), ([11], [1])]
+    assert fake_conn.queries("SET claimed_at = NULL, due_at") == [([12], [1], REMINDER_CONFIG["retry_delay"])]
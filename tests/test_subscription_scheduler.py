@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""SubscriptionScheduler: recargas acotadas y espera ante barridos sin progreso"""
+
+import json
+import time
+
+import pytest
+
+from bot.config import EXPIRY_CONFIG
+from bot.subscription_scheduler import EXPIRY, EXPIRY_CHANNEL, REMINDER, SubscriptionScheduler
+
+
+class _Manager:
+    def __init__(self, pool):
+        self.pool = pool
+
+
+@pytest.mark.asyncio
+async def test_full_load_of_past_due_rows_does_not_reload_immediately(fake_conn, fake_pool):
+    past_due = [{'seconds_left': -3600.0}] * EXPIRY_CONFIG["load_limit"]
+    fake_conn.respond("FROM subscribers", past_due)
+    scheduler = SubscriptionScheduler(_Manager(fake_pool))
+
+    await scheduler._load()
+
+    assert scheduler._reload_at >= time.time() + EXPIRY_CONFIG["min_sweep_interval"] - 1
+
+
+def test_sweeps_without_progress_back_off_until_progress():
+    scheduler = SubscriptionScheduler(_Manager(None))
+
+    delays = []
+    for _ in range(10):
+        scheduler._record_progress(False)
+        delays.append(scheduler._idle_backoff)
+
+    assert delays[0] == EXPIRY_CONFIG["min_sweep_interval"]
+    assert delays == sorted(delays)
+    assert delays[-1] == EXPIRY_CONFIG["error_backoff"]
+
+    scheduler._record_progress(True)
+    assert scheduler._idle_backoff == 0.0
+    assert scheduler._not_before <= time.time()
+
+
+def test_expiry_published_by_another_process_wakes_the_scheduler():
+    scheduler = SubscriptionScheduler(_Manager(None))
+    payload = json.dumps({'expiry': 2000.0, 'reminders': [1000.0, 1500.0]})
+
+    scheduler._on_expiry_notification(None, 1234, EXPIRY_CHANNEL, payload)
+
+    assert sorted(scheduler._heap) == [(1000.0, REMINDER), (1500.0, REMINDER), (2000.0, EXPIRY)]
+    assert scheduler._changed.is_set()
+
+
+def test_malformed_expiry_payload_is_ignored():
+    scheduler = SubscriptionScheduler(_Manager(None))
+
+    scheduler._on_expiry_notification(None, 1234, EXPIRY_CHANNEL, 'not json')
+
+    assert scheduler._heap == []
+    assert not scheduler._changed.is_set()
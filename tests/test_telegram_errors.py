@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Clasificación de errores de Telegram"""
+
+import pytest
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Conflict,
+    Forbidden,
+    InvalidToken,
+    NetworkError,
+    RetryAfter,
+    TimedOut,
+)
+
+from bot.telegram_errors import ErrorKind, classify_error, is_permanent_error
+
+
+@pytest.mark.parametrize("error, kind", [
+    (RetryAfter(3), ErrorKind.THROTTLE),
+    (Forbidden("Forbidden: bot was blocked by the user"), ErrorKind.BLOCKED),
+    (BadRequest("Chat not found"), ErrorKind.NOT_FOUND),
+    (BadRequest("Bad Request: user not found"), ErrorKind.NOT_FOUND),
+    (BadRequest("PEER_ID_INVALID"), ErrorKind.NOT_FOUND),
+    (BadRequest("Message text is empty"), ErrorKind.PERMANENT),
+    (ChatMigrated(-1001), ErrorKind.PERMANENT),
+    (InvalidToken(), ErrorKind.PERMANENT),
+    (TimedOut(), ErrorKind.RETRY),
+    (NetworkError("Connection reset"), ErrorKind.RETRY),
+    (Conflict("terminated by other getUpdates request"), ErrorKind.RETRY),
+    (ValueError("unexpected"), ErrorKind.PERMANENT),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) is kind
+
+
+def test_only_throttle_and_transient_errors_are_retried():
+    assert not is_permanent_error(RetryAfter(1))
+    assert not is_permanent_error(TimedOut())
+    assert is_permanent_error(Forbidden("blocked"))
+    assert is_permanent_error(BadRequest("Chat not found"))